@@ -0,0 +1,313 @@
+# offline benchmark of the migration pipeline: query generation, batching and the writer pool,
+# on synthetic data and against an in-memory stand-in for the TypeDB server
+# @usage
+# python benchmarks/bench_migration.py --scale 0.01 --num_threads 4 --commit_latency 0.02 --conflict_rate 0.01
+# python benchmarks/bench_migration.py --cases pool --num_processes 4 --num_threads 2 --concurrent_files 3
+
+import argparse
+import multiprocessing
+import os
+import re
+import resource
+import sys
+from functools import partial
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_typedb import FakeTypeDBClient
+from synthetic_data import generate_synthetic_data, dict_entity_columns, relation_columns
+from typedb_data_offshoreleaks.migrate_helpers import (
+    LoaderPool,
+    build_id_type_index,
+    insert_data_bulk,
+    metrics,
+    prefetch,
+    run_dependency_schedule,
+    stream_entity_insert_queries,
+    stream_typed_relation_insert_queries
+    )
+
+dict_entity_file_type = {
+    "addresses": "node_address",
+    "entities": "org_entity",
+    "intermediaries": "intermediary",
+    "officers": "officer",
+    "others": "other"
+}
+
+# (start role, end role) per relation type, as picked by the migrator from offshoreleaks_schema.tql
+dict_relation_roles = {
+    "officer_of": ("is_officer", "has_officer"),
+    "registered_address": ("has_address", "is_address"),
+    "intermediary_of": ("is_intermediary", "has_intermediary"),
+    "underlying": ("is_underlying", "has_underlying"),
+    "connected_to": ("is_connected_to", "is_connected_to"),
+    "similar": ("similar_to", "similar_to"),
+    "same_name_as": ("has_same_name_as", "has_same_name_as"),
+    "same_id_as": ("has_same_id_as", "has_same_id_as"),
+    "same_as": ("is_same_as", "is_same_as"),
+    "probably_same_officer_as": ("is_probably_same_officer_as", "is_probably_same_officer_as"),
+    "same_intermediary_as": ("is_same_intermediary_as", "is_same_intermediary_as"),
+    "same_company_as": ("is_same_company_as", "is_same_company_as"),
+    "same_address_as": ("is_same_address_as", "is_same_address_as"),
+    "similar_company_as": ("is_similar_company_as", "is_similar_company_as")
+}
+
+pattern_rm_thingType = re.compile("^relationships_|_?clean_formatted_?|^nodes-|.csv$")
+
+
+def attribute_valuetypes():
+    '''@usage attribute valuetypes of the synthetic columns: the schema's dates are datetimes, all else strings'''
+    columns = {column for columns in dict_entity_columns.values() for column in columns} | set(relation_columns)
+    attrs = {column.lstrip("_") for column in columns} - {"start", "end", "type"}
+    return {attr: "DATETIME" if attr.endswith("_date") else "STRING" for attr in attrs}
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    '''@usage peak resident set size so far, in MB (Linux reports ru_maxrss in KB), of this process or of its largest finished child'''
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def timed(
+    queries,
+    timing
+    ):
+    '''
+    @usage pass queries through as they are generated, adding the seconds spent generating them to timing["render"]
+        and their number to timing["rows"], without holding more than one
+    @param queries: iterator of queries
+    @param timing: dict with render and rows keys, updated in place
+    @return iterator of the same queries
+    '''
+    iterator = iter(queries)
+    while True:
+        start = timer()
+        query = next(iterator, None)
+        timing["render"] += timer() - start
+        if query is None:
+            return
+        timing["rows"] += 1
+        yield query
+
+
+class BenchFiles:
+    '''@usage the synthetic files to load, and functions that start streaming the queries of each'''
+
+    def __init__(self, args):
+        dir_entities = args.data_dir + "/entities"
+        dir_relations = args.data_dir + "/relations"
+        self.args = args
+        self.dict_attr_valuetype = attribute_valuetypes()
+        self.dtype = {column: str for columns in dict_entity_columns.values() for column in columns}
+        self.dtype.update({column: str for column in relation_columns})
+        self.entity_files = [
+            (dir_entities + "/" + file, dict_entity_file_type[re.sub(pattern_rm_thingType, "", file)])
+            for file in sorted(os.listdir(dir_entities))
+            ]
+        self.relation_files = [
+            (dir_relations + "/" + file, re.sub(pattern_rm_thingType, "", file))
+            for file in sorted(os.listdir(dir_relations))
+            ]
+        self.id_type_index = None
+        self.time_index = 0.0
+
+    def mappings(self, path):
+        with open(path) as f:
+            columns = f.readline().strip().split(",")
+        return [f"has {column.lstrip('_')} <{column}>" for column in columns if column.lstrip("_") in self.dict_attr_valuetype]
+
+    def build_index(self):
+        start = timer()
+        self.id_type_index = build_id_type_index(self.entity_files)
+        self.time_index = timer() - start
+
+    def entity_queries(self, path, thingType):
+        return stream_entity_insert_queries(
+            path, thingType, self.mappings(path), self.dict_attr_valuetype, dtype=self.dtype, chunksize=self.args.chunk_size)
+
+    def relation_queries(self, path, thingType):
+        start_role, end_role = dict_relation_roles[thingType]
+        return stream_typed_relation_insert_queries(
+            path, thingType, self.mappings(path), self.dict_attr_valuetype, start_role, end_role, self.id_type_index,
+            dtype=self.dtype, chunksize=self.args.chunk_size)
+
+    def files(self):
+        '''@usage list of (name, thingType, function that starts streaming its queries, names of the files it waits for)'''
+        entity_names = [os.path.basename(path) for path, thingType in self.entity_files]
+        files = [
+            (os.path.basename(path), thingType, partial(self.entity_queries, path, thingType), set())
+            for path, thingType in self.entity_files
+            ]
+        # the synthetic relations connect nodes of every entity file, so each waits for all of them
+        files.extend(
+            (os.path.basename(path), thingType, partial(self.relation_queries, path, thingType), set(entity_names))
+            for path, thingType in self.relation_files
+            )
+        return files
+
+
+def insert_options(args):
+    return {
+        "num_threads": args.num_threads,
+        "batch_size": args.batch_size,
+        "min_batch_size": args.min_batch_size,
+        "max_batch_size": args.max_batch_size,
+        "target_latency": args.target_latency,
+        "max_retries": args.max_retries
+        }
+
+
+def fake_client_factory(args):
+    return partial(FakeTypeDBClient, args.commit_latency, args.per_query_latency, args.conflict_rate)
+
+
+def bench_sequential(args, bench_files):
+    '''
+    @usage load the files one at a time on writer threads, as insert_data_bulk does without a schedule,
+        streaming each file's queries into the writers
+    @return list of per-file result dicts
+    '''
+    client = fake_client_factory(args)()
+    results = []
+    for name, thingType, queries_factory, waits_for in bench_files.files():
+        if waits_for and bench_files.id_type_index is None:
+            bench_files.build_index()
+        timing = {"render": 0.0, "rows": 0}
+        start = timer()
+        insert_data_bulk(client, "bench", timed(queries_factory(), timing), **insert_options(args))
+        results.append({"name": thingType, **timing, "load": timer() - start, "rss": peak_rss_mb()})
+    return results
+
+
+def bench_schedule(
+    args,
+    bench_files,
+    insert
+    ):
+    '''
+    @usage load the files with run_dependency_schedule, --concurrent_files at a time, each relation file once the
+        entity files are loaded, with the next files' queries prefetched while others insert, as the migrator does
+    @param insert: function taking a query iterator, to load one file
+    @return list of per-file result dicts
+    '''
+    bench_files.build_index()
+    results = []
+    tasks, dependencies, prepare = {}, {}, {}
+    for name, thingType, queries_factory, waits_for in bench_files.files():
+        timing = {"name": thingType, "render": 0.0, "rows": 0}
+        results.append(timing)
+
+        def task(queries, timing=timing):
+            start = timer()
+            insert(queries)
+            timing["load"] = timer() - start
+            timing["rss"] = peak_rss_mb()
+
+        tasks[name] = task
+        dependencies[name] = waits_for
+        prepare[name] = partial(lambda queries_factory, timing: prefetch(timed(queries_factory(), timing)), queries_factory, timing)
+    run_dependency_schedule(tasks, dependencies, max_workers=args.concurrent_files, prepare=prepare)
+    return results
+
+
+def run_case(
+    args,
+    case,
+    result_queue
+    ):
+    '''
+    @usage run one benchmark case in a process of its own, so that its peak RSS is its own, and report on result_queue
+    '''
+    metrics.enable()
+    bench_files = BenchFiles(args)
+    start = timer()
+    if case == "sequential":
+        results = bench_sequential(args, bench_files)
+    elif case == "schedule":
+        client = fake_client_factory(args)()
+        results = bench_schedule(args, bench_files, lambda queries: insert_data_bulk(client, "bench", queries, **insert_options(args)))
+    else:
+        options = insert_options(args)
+        with LoaderPool(
+            "fake",
+            "bench",
+            num_processes=args.num_processes,
+            max_files=args.concurrent_files,
+            client_factory=fake_client_factory(args),
+            **options
+        ) as pool:
+            results = bench_schedule(args, bench_files, pool.insert)
+    snapshot = metrics.snapshot()
+    commits = sum(snapshot["commit_latency_buckets"].values())
+    result_queue.put({
+        "case": case,
+        "files": results,
+        "time_total": timer() - start,
+        "time_index": bench_files.time_index,
+        "stages": snapshot["stages"],
+        "commits": commits,
+        "rows_committed": snapshot["rows_committed"],
+        "retries": snapshot["retries"],
+        "mean_latency": snapshot["commit_latency_sum"] / commits if commits else 0.0,
+        "rss": peak_rss_mb(),
+        "rss_children": peak_rss_mb(resource.RUSAGE_CHILDREN)
+        })
+
+
+def rate(rows, seconds):
+    return f"{rows / seconds:,.0f}" if seconds > 0 else "-"
+
+
+def print_case(result):
+    print(f"\n{result['case']}")
+    print(f"{'type':<26}{'rows':>10}{'render rows/s':>15}{'load rows/s':>13}{'peak RSS MB':>13}")
+    for file in result["files"]:
+        print(f"{file['name']:<26}{file['rows']:>10}{rate(file['rows'], file['render']):>15}"
+              f"{rate(file['rows'], file['load']):>13}{file['rss']:>13.0f}")
+    rows = sum(file["rows"] for file in result["files"])
+    print(f"{'total':<26}{rows:>10}{rate(rows, sum(file['render'] for file in result['files'])):>15}"
+          f"{rate(rows, sum(file['load'] for file in result['files'])):>13}{result['rss']:>13.0f}")
+    stages = ", ".join(f"{name} {stage['seconds']:.2f}s" for name, stage in sorted(result["stages"].items()))
+    print(f"stages: {stages}")
+    if result["rss_children"]:
+        print(f"peak RSS of the largest loader process: {result['rss_children']:.0f} MB")
+    print(f"id type index: {result['time_index']:.2f}s; end to end: {rate(rows, result['time_total'])} rows/s over {result['time_total']:.1f}s")
+    print(f"commits: {result['commits']}, queries committed: {result['rows_committed']}, retries: {result['retries']}, "
+          f"mean commit latency: {result['mean_latency'] * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline migration benchmark with synthetic data and a fake TypeDB client.")
+    parser.add_argument("--data_dir", default="data/synthetic", help="synthetic data directory, generated if missing (default: data/synthetic)")
+    parser.add_argument("--scale", type=float, default=0.01, help="fraction of the full dataset to generate (default: 0.01)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    parser.add_argument("--chunk_size", type=int, default=50000, help="csv rows per chunk (default: 50000)")
+    parser.add_argument("--num_threads", type=int, default=4, help="writer threads, per process in the pool case (default: 4)")
+    parser.add_argument("--num_processes", type=int, default=2, help="loader processes in the pool case (default: 2)")
+    parser.add_argument("--concurrent_files", type=int, default=2, help="files loaded at once in the schedule and pool cases (default: 2)")
+    parser.add_argument("--batch_size", type=int, default=250, help="initial queries per commit (default: 250)")
+    parser.add_argument("--min_batch_size", type=int, default=50, help="smallest adaptive batch size (default: 50)")
+    parser.add_argument("--max_batch_size", type=int, default=1000, help="largest adaptive batch size (default: 1000)")
+    parser.add_argument("--target_latency", type=float, default=2.0, help="target commit latency in seconds (default: 2.0)")
+    parser.add_argument("--max_retries", type=int, default=5, help="retries after a write conflict (default: 5)")
+    parser.add_argument("--commit_latency", type=float, default=0.01, help="fake seconds per commit (default: 0.01)")
+    parser.add_argument("--per_query_latency", type=float, default=0.0001, help="fake extra seconds per query committed (default: 0.0001)")
+    parser.add_argument("--conflict_rate", type=float, default=0.0, help="fake probability of a write conflict per commit (default: 0)")
+    parser.add_argument("--cases", nargs="+", choices=["sequential", "schedule", "pool"], default=["sequential", "schedule", "pool"],
+                        help="cases to run: one file at a time on writer threads, files on a dependency schedule, "
+                             "and that schedule on a pool of loader processes (default: all)")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data_dir + "/entities"):
+        print(f"generating synthetic data in {args.data_dir} at scale {args.scale}")
+        generate_synthetic_data(args.data_dir, args.scale, args.seed)
+
+    ctx = multiprocessing.get_context("spawn")
+    for case in args.cases:
+        result_queue = ctx.Queue()
+        process = ctx.Process(target=run_case, args=(args, case, result_queue))
+        process.start()
+        result = result_queue.get()
+        process.join()
+        print_case(result)
@@ -0,0 +1,264 @@
+# benchmark the template query builder against the previous pandas str.cat implementation
+# @usage
+# python benchmarks/bench_query_builder.py --rows 200000 --repeat 3
+
+import argparse
+import string
+from timeit import default_timer as timer
+
+import numpy as np
+import pandas as pd
+
+from typedb_data_offshoreleaks.migrate_helpers import (
+    prep_entity_insert_queries,
+    prep_relation_insert_queries
+    )
+
+dict_attr_valuetype = {
+    "id": "STRING",
+    "node_id": "STRING",
+    "name": "STRING",
+    "countries": "STRING",
+    "country_codes": "STRING",
+    "sourceID": "STRING",
+    "incorporation_date": "DATETIME",
+    "link": "STRING",
+    "status": "STRING",
+    "start_date": "DATETIME"
+}
+
+
+###### previous implementation, kept here as the baseline ######
+
+def strcat_entity_insert_queries(
+    df,
+    isa_type,
+    mappings,
+    dict_attr_valuetype
+    ):
+    '''
+    @usage: subroutine to convert a typedb entity subtype and list of string
+        containing column-to-schematype mappings into a list of TypeQL insert queries
+        everything is vectorized using pandas.Series.str.cat for speed
+    @param df: data table
+    @param isa_type: typedb_type, string
+    @param mappings: list of string: "has {rel_attr_type} <{column_selected}>"
+    @param valuetype: attribute valuetype
+    @return list of TypeQL insert queries: ["insert $x isa cardealer, has name Lisette;", "insert $x isa ... "]
+    '''
+    
+    list_attr = [mapping.split(" <")[0].split("has ")[1].strip() for mapping in mappings]
+    pattern_missing = "|".join([f" has {attr} ?,|has {attr} '',| has {attr} 'nan',| has {attr} nan," for attr in list_attr])
+    list_series_stump = []
+    # for each input attribute, prepare series of string like ["$x has age 24", "$x has age 64", .. ]
+    for mapping in mappings:
+        mapping = str(mapping)
+        column_selected = mapping.split("<")[1].rstrip(">")
+        data = pd.Series(data=df[column_selected], dtype=str)
+        attr = mapping.split(" <")[0].split("has ")[1].strip()
+        if dict_attr_valuetype[attr]=="STRING":
+            stump = " has " + attr + " '"
+        else:
+            stump =" has " + attr + " "
+        list_stump = [stump]*df.shape[0]
+        series_stump = pd.Series(data=list_stump, dtype = str)
+        # # concatenate with values and the second quotation mark
+        series_stump = series_stump.str.cat(others = [data])
+        if dict_attr_valuetype[attr] == "STRING":
+            series_stump = series_stump.str.cat(others = [pd.Series(data=["'"]*df.shape[0], dtype=str)])
+        list_series_stump.append(series_stump)
+    # Now concatenate the lists of query stumps onto the initial "insert $x isa plumber; "
+    series_queries_init = pd.Series(data=[f"insert $x isa {isa_type}" for i in range(df.shape[0])], dtype=str)
+    # concatenate all the above lists to it element-wise; add a final semicolon to complete each query
+    series_queries_out = series_queries_init.str.cat(others=list_series_stump, sep=",")
+    # remove clauses with missing value attribute
+    series_queries_out = series_queries_out.str.replace(pat=pattern_missing, repl="", case=False, regex=True)
+    series_queries_out = series_queries_out.str.cat(others=pd.Series(data=["; "]*df.shape[0], dtype=str))
+    return list(series_queries_out)
+
+
+def strcat_relation_insert_queries(
+    df,
+    isa_type,
+    mappings,
+    dict_attr_valuetype,
+    ):
+    '''
+    @usage: subroutine to convert a typedb relation subtype and list of string
+        containing column-to-schematype mappings into a list of TypeQL insert queries
+        everything is vectorized using pandas.Series.str.cat for speed
+    @param df: data table
+    @param isa_type: typedb_type, string
+    @param mappings:
+        "has {0} <{1}>".format(select_sub,column_selected) for RELATION attributes
+        "{0} isa {1}, has {2} <{3}> ... {4} : {5}".format(rp_var, rp_type, rp_attr_type, column_selected, role, rp_var) for ROLEPLAYER attributes
+    @param dict_attr_valuetype: attribute valuetype
+
+    @return list of TypeQL insert queries:
+        ["match $company isa company, has name 'Telecom'; $customer isa person, has phone-number '+00 091 xxx'; insert (provider: $company, customer: $customer) isa contract;', ... ]
+    '''
+    
+    list_attr = [mapping.split(" <")[0].split("has ")[1].strip() for mapping in mappings]
+    pattern_missing = "|".join([f" ?has {attr} ?,| ?has {attr} '',| ?has {attr} 'nan',| ?has {attr} nan," for attr in list_attr])
+    series_stump_match_init = pd.Series(data=["match "] * df.shape[0], dtype=str)
+    list_series_stump_rp_isa_has = []
+    series_stump_insert_init = pd.Series(["insert ("] * df.shape[0], dtype=str)
+    list_series_stump_role_rp = []
+    series_stump_insert_rel_isa = pd.Series([f") isa {isa_type}" for i in range(df.shape[0])], dtype=str)
+    list_series_stump_rel_has = []
+    for mapping in mappings:
+        if " ... " in mapping:
+            # roleplayer attribute
+            # "${0} isa {1}, has {2} <{3}>, has {} <{}>, has {} <{}> ... {4} : {5}".format(rp_var, rp_type, rp_attr_type, column_selected, role, rp_var)
+            # prepare the isa / has part of the query
+            
+            series_stump_rp_isa = pd.Series(data=[mapping.split("; ")[0]]*df.shape[0], dtype=str) if "isa" in mapping else None
+            list_series_stump_rp_has = []
+            list_stump_rp_has = mapping.split(" ... ")[0].split(";")[1:] if type(series_stump_rp_isa) is pd.Series else mapping.split(" ... ")[0].split(";")
+            if not list_stump_rp_has:
+                raise ValueError(f"role player {mapping.split(' ')[0]} must have unique attributes but has none")
+            for stump_rp_has in list_stump_rp_has:
+                column_selected = stump_rp_has.split("<")[1].rstrip(">")
+
+                attr = stump_rp_has.split(" <")[0].split("has ")[1].strip()
+                if dict_attr_valuetype[attr]=="STRING":
+                    stump = f"{mapping.split(' ')[0]} has " + attr + " '"
+                else:
+                    stump = f"{mapping.split(' ')[0]} has " + attr + " "
+                series_stump_rp_has = pd.Series(data=[stump]*df.shape[0], dtype=str)
+                # # concatenate with values and the second quotation mark
+                data = pd.Series(data=df[column_selected], dtype=str)
+                series_stump_rp_has = series_stump_rp_has.str.cat(others = [data])
+                if dict_attr_valuetype[attr]=="STRING":
+                    series_stump_rp_has = series_stump_rp_has.str.cat(others=[pd.Series(data=["'"]*df.shape[0], dtype=str)])
+                list_series_stump_rp_has.append(series_stump_rp_has)
+            # concat the isa and the has parts for this roleplayer
+            if type(series_stump_rp_isa) is pd.Series:
+                series_stump_rp_isa_has = series_stump_rp_isa.str.cat(others=list_series_stump_rp_has, sep="; ") 
+            else:
+                series_stump_rp_isa_has = list_series_stump_rp_has[0].str.cat(others=list_series_stump_rp_has[1:], sep="; ")  if len(list_series_stump_rp_has)>1 else list_series_stump_rp_has[0]
+            # if attr value missing, remove clause
+            series_stump_rp_isa_has = series_stump_rp_isa_has.str.replace(pat=pattern_missing, repl="",regex=True)
+
+            list_series_stump_rp_isa_has.append(series_stump_rp_isa_has)
+
+            # append the the (role:$roleplayer) stump to list
+            series_stump_role_rp = pd.Series(data=[mapping.split(" ... ")[1]]*df.shape[0], dtype=str)
+            list_series_stump_role_rp.append(series_stump_role_rp)
+
+        else:
+            # relation attribute
+            column_selected = mapping.split("<")[1].rstrip(">")
+            attr = mapping.split(" <")[0].split("has ")[1].strip()
+            if dict_attr_valuetype[attr]=="STRING":
+                stump = "has " + attr + " '"
+            else:
+                stump = "has " + attr + " "
+            series_stump = pd.Series(data=[stump]*df.shape[0], dtype=str)
+            # # concatenate with values and the second quotation mark
+            data = pd.Series(data=df[column_selected], dtype=str)
+            series_stump = series_stump.str.cat(others = [pd.Series(data=data,dtype=str)])
+            if dict_attr_valuetype[attr]=="STRING":
+                series_stump = series_stump.str.cat(others = [pd.Series(data=["'"]*df.shape[0], dtype=str)])
+            list_series_stump_rel_has.append(series_stump)
+
+    # put everything together
+    # first concat those lists of series that are separated by commas
+    if len(list_series_stump_rp_isa_has)>1:
+        series_stump_rp_isa_has = list_series_stump_rp_isa_has[0].str.cat(others=list_series_stump_rp_isa_has[1:], sep="; ")
+        series_stump_role_rp = list_series_stump_role_rp[0].str.cat(others=list_series_stump_role_rp[1:], sep=", ")
+    elif len(list_series_stump_rp_isa_has)==1:
+        series_stump_rp_isa_has = list_series_stump_rp_isa_has[0]
+        series_stump_role_rp = list_series_stump_role_rp[0]
+    else:
+        raise ValueError("relation insert queries must match roleplayers to roles")
+
+    if len(list_series_stump_rel_has)>1:
+        series_stump_rel_has = list_series_stump_rel_has[0].str.cat(others=list_series_stump_rel_has[1:], sep=", ")
+    elif len(list_series_stump_rel_has)==1:
+        series_stump_rel_has = list_series_stump_rel_has[0]
+    else:
+        series_stump_rel_has = None
+
+    if type(series_stump_rel_has) is pd.Series: # i.e. not None. cannot check the usual way.
+        # if attr value missing, remove clause
+        series_stump_rel_has = series_stump_rel_has.str.replace(pat=pattern_missing, repl="",regex=True)
+    # cat "match" and "$employer isa person, has address '23 Rose Crescent'; ..."
+    series_queries_out = series_stump_match_init.str.cat(others=series_stump_rp_isa_has, sep = "")
+
+    # cat "insert (" and "employer: $employer, employee: $employee ... " and ")"
+    series_queries_insert = series_stump_insert_init.str.cat(others=[series_stump_role_rp, series_stump_insert_rel_isa], sep="")
+
+    series_queries_out = series_queries_out.str.cat(others=series_queries_insert, sep="; ")
+    if type(series_stump_rel_has) is pd.Series:
+        series_queries_out = series_queries_out.str.cat(others=[series_stump_rel_has], sep=", ")
+    series_queries_out = series_queries_out.str.cat(others=pd.Series(data=["; "]*df.shape[0], dtype=str))
+    return list(series_queries_out)
+
+
+###### synthetic data ######
+
+def random_strings(n, length, rng, missing=0.0):
+    letters = np.array(list(string.ascii_uppercase + " "))
+    values = ["".join(row) for row in rng.choice(letters, size=(n, length))]
+    return [None if rng.random() < missing else value for value in values]
+
+
+def entity_frame(n, rng):
+    return pd.DataFrame({
+        "_id": [str(i) for i in range(n)],
+        "node_id": [str(10000000 + i) for i in range(n)],
+        "name": random_strings(n, 24, rng),
+        "countries": random_strings(n, 12, rng, missing=0.3),
+        "country_codes": random_strings(n, 3, rng, missing=0.3),
+        "sourceID": random_strings(n, 16, rng),
+        "incorporation_date": [None if rng.random() < 0.5 else "2001-02-03" for _ in range(n)]
+        })
+
+
+def relation_frame(n, rng):
+    return pd.DataFrame({
+        "_start": [str(rng.integers(0, n)) for _ in range(n)],
+        "_end": [str(rng.integers(0, n)) for _ in range(n)],
+        "link": random_strings(n, 16, rng),
+        "status": random_strings(n, 8, rng, missing=0.7),
+        "start_date": [None if rng.random() < 0.6 else "2012-05-01" for _ in range(n)],
+        "sourceID": random_strings(n, 16, rng)
+        })
+
+
+def best_of(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = timer()
+        function()
+        timings.append(timer() - start)
+    return min(timings)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark insert query generation, in rows/sec.")
+    parser.add_argument("--rows", type=int, default=200000, help="rows per synthetic table (default: 200000)")
+    parser.add_argument("--repeat", type=int, default=3, help="timing repeats, best is reported (default: 3)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    df_entities = entity_frame(args.rows, rng)
+    df_relations = relation_frame(args.rows, rng)
+    entity_mappings = [f"has {column.lstrip('_')} <{column}>" for column in df_entities.columns]
+    relation_mappings = [f"has {column} <{column}>" for column in ["link", "status", "start_date", "sourceID"]] + [
+        "$start isa officer; $start has id <_start> ... is_officer : $start",
+        "$end isa org_entity; $end has id <_end> ... has_officer : $end"
+        ]
+
+    cases = [
+        ("entity", "strcat", lambda: strcat_entity_insert_queries(df_entities, "officer", entity_mappings, dict_attr_valuetype)),
+        ("entity", "template", lambda: prep_entity_insert_queries(df_entities, "officer", entity_mappings, dict_attr_valuetype)),
+        ("relation", "strcat", lambda: strcat_relation_insert_queries(df_relations, "officer_of", relation_mappings, dict_attr_valuetype)),
+        ("relation", "template", lambda: prep_relation_insert_queries(df_relations, "officer_of", relation_mappings, dict_attr_valuetype)),
+        ]
+    print(f"{'queries':<10}{'builder':<10}{'rows/sec':>14}")
+    for kind, builder, function in cases:
+        elapsed = best_of(function, args.repeat)
+        print(f"{kind:<10}{builder:<10}{args.rows / elapsed:>14,.0f}")
@@ -0,0 +1,128 @@
+# in-memory stand-in for the parts of the typedb.client API that insert_data_bulk and write_query_batch use,
+# with configurable commit latency, write conflict rate and invalid queries, for benchmarks and tests without a TypeDB server
+
+import random
+import threading
+import time
+
+
+class FakeTypeDBStats:
+    '''@usage counters shared by a fake client and all its sessions and transactions'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.commits = 0
+        self.conflicts = 0
+        self.queries = 0
+        self.commit_latencies = []
+
+    def record_commit(self, n_queries, latency):
+        with self.lock:
+            self.commits += 1
+            self.queries += n_queries
+            self.commit_latencies.append(latency)
+
+    def record_conflict(self):
+        with self.lock:
+            self.conflicts += 1
+
+
+class FakeTransaction:
+    '''@usage stand-in for a typedb write transaction: queries are only counted, and checked at commit'''
+
+    def __init__(self, client):
+        self.client = client
+        self.queries = []
+        self.open = True
+
+    @property
+    def n_queries(self):
+        return len(self.queries)
+
+    def query(self):
+        return self
+
+    def insert(self, query):
+        self.queries.append(query)
+        return iter(())
+
+    def delete(self, query):
+        self.queries.append(query)
+
+    def match(self, query):
+        return iter(())
+
+    def commit(self):
+        client = self.client
+        latency = client.commit_latency + client.per_query_latency * self.n_queries
+        latency *= random.uniform(1 - client.jitter, 1 + client.jitter)
+        time.sleep(latency)
+        self.open = False
+        if client.fail_pattern is not None and any(client.fail_pattern in query for query in self.queries):
+            raise RuntimeError(f"[TQL] fake invalid query: a query contains '{client.fail_pattern}'")
+        if random.random() < client.conflict_rate:
+            client.stats.record_conflict()
+            raise RuntimeError("[TXN] fake transaction conflict: the transaction was aborted")
+        client.stats.record_commit(self.n_queries, latency)
+
+    def close(self):
+        self.open = False
+
+    def is_open(self):
+        return self.open
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FakeSession:
+    '''@usage stand-in for a typedb data session'''
+
+    def __init__(self, client):
+        self.client = client
+
+    def transaction(self, transaction_type, options=None):
+        return FakeTransaction(self.client)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class FakeTypeDBClient:
+    '''
+    @usage stand-in for TypeDB.core_client
+    @param commit_latency: seconds each commit takes
+    @param per_query_latency: additional seconds per query in the committed transaction
+    @param conflict_rate: probability that a commit fails with a write conflict
+    @param jitter: relative random variation of the latency
+    @param fail_pattern: optional string; a commit fails, as on an invalid query, if any of its queries contains it
+    '''
+
+    def __init__(self, commit_latency=0.01, per_query_latency=0.0001, conflict_rate=0.0, jitter=0.2, fail_pattern=None):
+        self.commit_latency = commit_latency
+        self.per_query_latency = per_query_latency
+        self.conflict_rate = conflict_rate
+        self.jitter = jitter
+        self.fail_pattern = fail_pattern
+        self.stats = FakeTypeDBStats()
+
+    def session(self, database, session_type=None, options=None):
+        return FakeSession(self)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,156 @@
+# generate synthetic preprocessed offshoreleaks csv files, for benchmarking without the ICIJ download
+# @usage
+# python benchmarks/synthetic_data.py --dir_out data/synthetic --scale 0.01
+
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# entity counts of the full dataset, see README
+dict_entity_count = {
+    "entities": 803089,
+    "officers": 747001,
+    "intermediaries": 26775,
+    "others": 2920,
+    "addresses": 391069
+}
+
+# columns of the preprocessed entity files
+dict_entity_columns = {
+    "entities": ["_id", "node_id", "name", "original_name", "former_name", "jurisdiction", "jurisdiction_description",
+                 "company_type", "address", "internal_id", "incorporation_date", "inactivation_date", "struck_off_date",
+                 "dorm_date", "status", "service_provider", "ibcRUC", "country_codes", "countries", "sourceID",
+                 "valid_until", "note"],
+    "officers": ["_id", "node_id", "name", "countries", "country_codes", "sourceID", "valid_until", "note"],
+    "intermediaries": ["_id", "node_id", "name", "status", "internal_id", "address", "countries", "country_codes",
+                       "sourceID", "valid_until", "note"],
+    "others": ["_id", "node_id", "name", "incorporation_date", "struck_off_date", "closed_date", "jurisdiction",
+               "jurisdiction_description", "countries", "country_codes", "sourceID", "valid_until", "note"],
+    "addresses": ["_id", "node_id", "address", "name", "countries", "country_codes", "sourceID", "valid_until", "note"]
+}
+
+relation_columns = ["_start", "_end", "_type", "link", "status", "start_date", "end_date", "sourceID", "valid_until"]
+
+# approximate relation counts of the full dataset, by type, and the entity files their ends are drawn from
+dict_relation_spec = {
+    "officer_of": (1720000, ["officers", "intermediaries"], ["entities", "others"]),
+    "registered_address": (830000, ["entities", "officers", "intermediaries", "others"], ["addresses"]),
+    "intermediary_of": (600000, ["intermediaries", "officers"], ["entities", "others"]),
+    "underlying": (1300, ["entities", "others"], ["entities", "others"]),
+    "connected_to": (12000, ["entities", "officers", "others"], ["entities", "officers", "others"]),
+    "similar": (6000, ["officers", "entities"], ["officers", "entities"]),
+    "same_name_as": (90000, ["officers", "entities"], ["officers", "entities"]),
+    "same_id_as": (3000, ["entities", "officers"], ["entities", "officers"]),
+    "same_as": (500, ["entities"], ["entities"]),
+    "probably_same_officer_as": (130, ["officers"], ["officers"]),
+    "same_intermediary_as": (5, ["intermediaries"], ["intermediaries"]),
+    "same_company_as": (12000, ["entities"], ["entities"]),
+    "same_address_as": (100, ["addresses"], ["addresses"]),
+    "similar_company_as": (50, ["entities"], ["entities"])
+}
+
+# a handful of values recur across many rows, as in the real data
+low_cardinality = {
+    "jurisdiction": ["BVI", "PMA", "SAM", "BAH", "NEV", "HK", "CAYMN", "MLT"],
+    "jurisdiction_description": ["British Virgin Islands", "Panama", "Samoa", "Bahamas", "Nevada", "Hong Kong"],
+    "company_type": ["Standard International Company", "Business Company Limited By Shares", "Limited Company"],
+    "status": ["Active", "Defaulted", "Dissolved", "Struck / Defunct / Deregistered", "Inactivated"],
+    "service_provider": ["Mossack Fonseca", "Portcullis Trustnet", "Commonwealth Trust Limited", "Appleby"],
+    "country_codes": ["HKG", "CHE", "GBR", "USA", "RUS", "CHN", "VGB", "SGP", "PAN", "TWN"],
+    "countries": ["Hong Kong", "Switzerland", "United Kingdom", "United States", "Russia", "China", "Singapore"],
+    "sourceID": ["Panama Papers", "Paradise Papers - Appleby", "Offshore Leaks", "Bahamas Leaks", "Pandora Papers"],
+    "valid_until": ["The Panama Papers data is current through 2015",
+                    "The Offshore Leaks data is current through 2010"],
+    "note": ["", "", "", "Closed", "Record from the registry"]
+}
+
+letters = np.array(list("ABCDEFGHIJKLMNOPQRSTUVWXYZ     "))
+
+
+def random_names(rng, n, length=20):
+    '''@usage random upper-case words, e.g. company and person names'''
+    codes = rng.integers(0, len(letters), size=(n, length))
+    names = pd.Series(letters[codes].view(f"U{length}").ravel())
+    # preprocessing squishes whitespace
+    return names.str.replace(r"\s+", " ", regex=True).str.strip().str.title()
+
+
+def random_dates(rng, n, missing):
+    '''@usage yyyy-mm-dd dates between 1980 and 2015, or "" with probability missing'''
+    days = rng.integers(0, 35 * 365, size=n)
+    dates = (np.datetime64("1980-01-01") + days.astype("timedelta64[D]")).astype(str)
+    return np.where(rng.random(n) < missing, "", dates)
+
+
+def column_values(rng, column, n, id_offset):
+    '''@usage synthetic values for one column of n rows'''
+    if column == "_id":
+        return np.arange(id_offset, id_offset + n).astype(str)
+    if column == "node_id":
+        return np.arange(10000000 + id_offset, 10000000 + id_offset + n).astype(str)
+    if column.endswith("_date"):
+        return random_dates(rng, n, missing=0.6)
+    if column in low_cardinality:
+        values = np.array(low_cardinality[column])
+        # zipf-like: the first few values dominate
+        weights = 1 / np.arange(1, len(values) + 1)
+        return np.where(rng.random(n) < 0.2, "", rng.choice(values, size=n, p=weights / weights.sum()))
+    if column in ["address"]:
+        return random_names(rng, n, 40).values
+    if column in ["internal_id", "ibcRUC"]:
+        return np.where(rng.random(n) < 0.5, "", rng.integers(1, 10**6, size=n).astype(str))
+    return np.where(rng.random(n) < 0.05, "", random_names(rng, n).values)
+
+
+def skewed_choice(rng, ids, n, exponent=1.2):
+    '''@usage draw n ids with a power-law degree distribution, as a few intermediaries and addresses serve many entities'''
+    ranks = rng.zipf(exponent + 1, size=n) - 1
+    uniform = rng.integers(0, len(ids), size=n)
+    index = np.where(rng.random(n) < 0.5, ranks % len(ids), uniform)
+    return ids[index]
+
+
+def generate_synthetic_data(dir_out, scale=0.01, seed=0):
+    '''
+    @usage write synthetic entity and relation csv files shaped like data/preprocessed
+    @param dir_out: output directory; entities/ and relations/ are created within it
+    @param scale: fraction of the full dataset's row counts
+    @param seed: random seed
+    @return dict of entity file stem to number of rows and relation type to number of rows
+    '''
+    rng = np.random.default_rng(seed)
+    os.makedirs(dir_out + "/entities", exist_ok=True)
+    os.makedirs(dir_out + "/relations", exist_ok=True)
+    counts = {}
+    dict_ids = {}
+    id_offset = 0
+    for stem, columns in dict_entity_columns.items():
+        n = max(1, int(dict_entity_count[stem] * scale))
+        df = pd.DataFrame({column: column_values(rng, column, n, id_offset) for column in columns})
+        df.to_csv(f"{dir_out}/entities/nodes-{stem}_clean_formatted.csv", index=False)
+        dict_ids[stem] = df["_id"].values
+        counts[stem] = n
+        id_offset += n
+    for reltype, (count, start_stems, end_stems) in dict_relation_spec.items():
+        n = max(1, int(count * scale))
+        starts = np.concatenate([dict_ids[stem] for stem in start_stems])
+        ends = np.concatenate([dict_ids[stem] for stem in end_stems])
+        df = pd.DataFrame({column: column_values(rng, column, n, 0) for column in relation_columns[3:]})
+        df.insert(0, "_type", reltype)
+        df.insert(0, "_end", skewed_choice(rng, ends, n))
+        df.insert(0, "_start", rng.choice(starts, size=n))
+        df.to_csv(f"{dir_out}/relations/relationships_clean_formatted_{reltype}.csv", index=False)
+        counts[reltype] = n
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic preprocessed offshoreleaks csv files.")
+    parser.add_argument("--dir_out", default="data/synthetic", help="output directory (default: data/synthetic)")
+    parser.add_argument("--scale", type=float, default=0.01, help="fraction of the full dataset size (default: 0.01)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    args = parser.parse_args()
+    for name, n in generate_synthetic_data(args.dir_out, args.scale, args.seed).items():
+        print(f"{name}: {n} rows")
@@ -5,10 +5,24 @@ def migrator_parser():
         description='Define offshore leaks database schema and insert data.')
     parser.add_argument("-a", "--host", help="Server host address (default: localhost)", default="localhost")
     parser.add_argument("-p", "--port", help="Server port (default: 1729)", default="1729")
+    parser.add_argument("-m", "--concurrent_files", type=int,
+                        help="Number of files to load at once; relation files start once the entity files they depend on are loaded (default: 2)", default=2)
     parser.add_argument("-n", "--num_threads", type=int,
-                        help="Number of threads to enable multiprocessing (default: 4)", default=4)
-    parser.add_argument("-c", "--batch_size", help="Sets the number of queries made per commit (default: 250)",
-                        default=250)
+                        help="Number of writer threads, per loader process if --num_processes > 1 (default: 4)", default=4)
+    parser.add_argument("-w", "--num_processes", type=int,
+                        help="Number of loader processes, each with its own client and session; 1 writes from the main process (default: 1)", default=1)
+    parser.add_argument("-l", "--parallelisation", type=int,
+                        help="TypeDB client parallelisation, per client (default: 1)", default=1)
+    parser.add_argument("-c", "--batch_size", type=int,
+                        help="Sets the initial number of queries made per commit (default: 250)", default=250)
+    parser.add_argument("--min_batch_size", type=int,
+                        help="Smallest number of queries per commit the writers may adapt down to (default: 50)", default=50)
+    parser.add_argument("--max_batch_size", type=int,
+                        help="Largest number of queries per commit the writers may adapt up to (default: 1000)", default=1000)
+    parser.add_argument("--target_latency", type=float,
+                        help="Commit latency in seconds the writers tune their batch size towards (default: 2.0)", default=2.0)
+    parser.add_argument("--max_retries", type=int,
+                        help="Number of times to retry a transaction that failed on a write conflict (default: 5)", default=5)
     parser.add_argument("-d", "--database", help="Database name (default: offshoreleaks)", default="offshoreleaks")
     parser.add_argument("-e", "--existing", action='store_true',
                         help="Write to database by this name even if it already exists (default: False)",
@@ -16,33 +30,464 @@ def migrator_parser():
     parser.add_argument("-f", "--force", action='store_true',
                         help="If a database by this name already exists, delete and overwrite it (default: False)",
                         default=False)
+    parser.add_argument("-k", "--chunk_size", type=int,
+                        help="Number of csv rows to read and turn into queries at a time; 0 reads whole files at once (default: 50000)",
+                        default=50000)
+    parser.add_argument("-r", "--resume", action='store_true',
+                        help="Resume an interrupted migration into an existing database, skipping batches recorded as committed in the journal (default: False)",
+                        default=False)
+    parser.add_argument("-j", "--journal", help="Checkpoint journal file (default: data/migration_journal.jsonl)",
+                        default="data/migration_journal.jsonl")
+    parser.add_argument("--progress", action='store_true',
+                        help="Show a live progress and ETA line (default: False)", default=False)
+    parser.add_argument("--metrics_file", help="Periodically dump per-stage timers, commit latencies, writer and queue metrics to this file (default: None)",
+                        default=None)
+    parser.add_argument("--metrics_format", choices=["jsonl", "prometheus"],
+                        help="Format of --metrics_file: appended json lines, or a Prometheus textfile (default: jsonl)", default="jsonl")
+    parser.add_argument("--metrics_interval", type=float,
+                        help="Seconds between progress lines and metrics dumps (default: 5)", default=5)
+    parser.add_argument("--profile", help="Profile the query builders with cProfile and write the stats to this file (default: None)",
+                        default=None)
+    parser.add_argument("--cache_dir", help="Directory for the cached schema introspection and columnar data (default: data/cache)",
+                        default="data/cache")
+    parser.add_argument("--columnar_cache", action='store_true',
+                        help="Convert each preprocessed csv file once to a memory-mapped Arrow file, and read that on later runs; needs pyarrow (default: False)",
+                        default=False)
+    parser.add_argument("--dry_run", action='store_true',
+                        help="Generate and count all queries without connecting to a server; needs the schema introspection cached by an earlier run (default: False)",
+                        default=False)
+    parser.add_argument("--materialise_rules", action='store_true',
+                        help="Compute the relations the schema's rules would infer from the preprocessed files, insert them as data and define the schema without the rules (default: False)",
+                        default=False)
+    parser.add_argument("--max_group_size", type=int,
+                        help="With --materialise_rules, skip dates, officers and intermediaries shared by more entities than this, rather than pair them all up (default: 1000)",
+                        default=1000)
+    parser.add_argument("--min_shared_officers", type=int,
+                        help="With --materialise_rules, officers two entities must share to share_multiple_officers; the rule itself needs one (default: 1)",
+                        default=1)
+    parser.add_argument("--delta", action='store_true',
+                        help="Update an existing database to the current preprocessed files, writing only the rows that changed since the manifest of the last load (default: False)",
+                        default=False)
+    parser.add_argument("--manifest", help="Directory for the fingerprints of the loaded rows, written after each load and diffed against by --delta; '' to skip fingerprinting after a full load (default: data/manifest)",
+                        default="data/manifest")
+    parser.add_argument("--commit_marker", help="File whose modification time every commit bumps, for readers on this host to invalidate their cached results; readers elsewhere only expire them by age; '' for none (default: data/last_commit)",
+                        default="data/last_commit")
+    parser.add_argument("--dead_letters", help="File to write the queries that fail on their own to, after bisecting the batch that failed, so the load carries on without them; '' to stop at the first failed batch (default: data/dead_letters.jsonl)",
+                        default="data/dead_letters.jsonl")
+    parser.add_argument("--check_inserts", action='store_true',
+                        help="Fail, and so dead-letter, relation queries whose roleplayers are not in the database, which TypeDB otherwise skips without error (default: False)",
+                        default=False)
+    parser.add_argument("--export", help="Generate all insert queries without a server, and write them to this directory as sharded, compressed files with a manifest, for --replay (default: None)",
+                        default=None)
+    parser.add_argument("--replay", help="Load the queries exported to this directory by --export, without reading the preprocessed files (default: None)",
+                        default=None)
+    parser.add_argument("--shard_size", type=int,
+                        help="With --export, number of queries per shard (default: 50000)", default=50000)
+    parser.add_argument("--shard_workers", type=int,
+                        help="Threads compressing shards with --export, and shards read ahead of the writers per file with --replay (default: 4)",
+                        default=4)
+    parser.add_argument("--prepopulate_max_values", type=int,
+                        help="Insert the attribute values that rows share, such as countries, statuses and dates, before any entity, for attributes with at most this many distinct values; 0 to skip this phase (default: 50000)",
+                        default=50000)
+    parser.add_argument("--prepopulate_min_uses", type=int,
+                        help="Number of rows an attribute value must occur in to be inserted up front (default: 2)",
+                        default=2)
+    parser.add_argument("--snapshot", help="Instead of loading, write the graph of the preprocessed files to this directory as a memory-mapped adjacency, for offline traversals with typedb_data_offshoreleaks.graph_snapshot (default: None)",
+                        default=None)
     
     return parser
 
+
+import contextlib
 import pandas as pd
 import os 
 import re 
 from timeit import default_timer as timer   
-from multiprocessing.dummy import Pool as ThreadPool
 from functools import partial
+from itertools import chain
 from typedb.client import *
 
 from typedb_data_offshoreleaks.migrate_helpers import (
-    prep_entity_insert_queries, 
-    prep_relation_insert_queries, 
-    write_query_batch, 
-    multi_thread_write_query_batches,
-    generate_query_batches,
-    insert_data_bulk
+    stream_entity_insert_queries,
+    build_id_type_index,
+    stream_typed_relation_insert_queries,
+    insert_data_bulk,
+    insert_data_bulk_multiprocess,
+    LoaderPool,
+    start_journal,
+    load_journal,
+    end_torn_record,
+    register_journal_file,
+    prefetch,
+    run_dependency_schedule,
+    metrics,
+    start_reporter,
+    count_csv_rows,
+    file_sha256,
+    load_schema_cache,
+    save_schema_cache,
+    column_dtypes,
+    columnar_cache,
+    corporate_entity_types,
+    split_schema_rules,
+    materialise_inferred_relations,
+    compile_entity_template,
+    render_entity_queries,
+    render_entity_delete_queries,
+    render_entity_update_queries,
+    render_relation_queries,
+    render_relation_delete_queries,
+    render_typed_relation_queries,
+    load_manifest,
+    diff_against_manifest,
+    commit_manifest,
+    set_commit_marker,
+    count_dead_letters,
+    print_dead_letter_summary,
+    export_queries,
+    load_export_manifest,
+    replay_shard_queries,
+    collect_attribute_values,
+    attribute_values_metadata,
+    write_attribute_values,
+    load_attribute_values,
+    render_attribute_queries,
+    stream_attribute_insert_queries
     )
+from typedb_data_offshoreleaks.graph_snapshot import build_graph_snapshot
 
 # relative paths
 schema_file = "offshoreleaks_schema.tql"
 dir_entities = "data/preprocessed/entities"
 dir_relations = "data/preprocessed/relations"
+dir_inferred = "data/preprocessed/inferred"
+
+# entity file name stem to entity type
+dict_entity_file_type = {
+    "addresses": "node_address",
+    "entities": "org_entity",
+    "intermediaries": "intermediary",
+    "officers": "officer",
+    "others": "other"
+}
+
+pattern_rm_thingType = re.compile("^relationships_|_?clean_formatted_?|^nodes-|.csv$")
+pattern_rm_underscore_prefix = re.compile("^_")
+
+
+def start_loader_pool(args):
+    '''
+    @usage start the loader processes that every file is loaded on, once for the whole run
+    @param args: parsed command line arguments
+    @return LoaderPool if --num_processes > 1, else a context that yields None
+    '''
+    if args.num_processes == 1:
+        return contextlib.nullcontext()
+    return LoaderPool(
+        f"{args.host}:{args.port}",
+        args.database,
+        num_processes = args.num_processes,
+        num_threads = args.num_threads,
+        parallelisation = args.parallelisation,
+        max_files = args.concurrent_files,
+        batch_size = args.batch_size,
+        min_batch_size = args.min_batch_size,
+        max_batch_size = args.max_batch_size,
+        target_latency = args.target_latency,
+        max_retries = args.max_retries
+        )
+
+
+def insert_queries(args, queries, journal=None, client=None, pool=None):
+    '''
+    @usage insert queries in bulk, from this process or from a pool of loader processes
+    @param args: parsed command line arguments
+    @param queries: list or iterator of string
+    @param journal: optional (journal_path, key, committed) tuple, see insert_data_bulk
+    @param client: optional open typedb client to share between files; by default one is opened for the call
+    @param pool: optional LoaderPool to share between files, from start_loader_pool; by default,
+        if --num_processes > 1, one is started for the call
+    @return None
+    '''
+    dead_letter_path = args.dead_letters or None
+    if pool is not None:
+        pool.insert(queries, journal=journal, dead_letter_path=dead_letter_path, check_inserted=args.check_inserts)
+    elif args.num_processes > 1:
+        insert_data_bulk_multiprocess(
+            f"{args.host}:{args.port}",
+            args.database,
+            queries,
+            num_processes = args.num_processes,
+            num_threads = args.num_threads,
+            batch_size = args.batch_size,
+            parallelisation = args.parallelisation,
+            journal = journal,
+            min_batch_size = args.min_batch_size,
+            max_batch_size = args.max_batch_size,
+            target_latency = args.target_latency,
+            max_retries = args.max_retries,
+            dead_letter_path = dead_letter_path,
+            check_inserted = args.check_inserts
+            )
+    elif client is not None:
+        insert_data_bulk(
+            client,
+            args.database,
+            queries,
+            num_threads = args.num_threads,
+            batch_size = args.batch_size,
+            typedb_options=None,
+            journal = journal,
+            min_batch_size = args.min_batch_size,
+            max_batch_size = args.max_batch_size,
+            target_latency = args.target_latency,
+            max_retries = args.max_retries,
+            dead_letter_path = dead_letter_path,
+            check_inserted = args.check_inserts
+            )
+    else:
+        with TypeDB.core_client(
+            address=f"{args.host}:{args.port}",
+            parallelisation=args.parallelisation
+        ) as client:
+            insert_queries(args, queries, journal=journal, client=client)
+
+
+def entity_file_type(file):
+    '''
+    @usage map a preprocessed entity file name to its entity type
+    @param file: file name, e.g. nodes-officers_clean_formatted.csv
+    @return entity type, e.g. officer
+    '''
+    thingType = re.sub(pattern_rm_thingType, "", file)
+    if not thingType in dict_entity_file_type:
+        raise ValueError(f"unknown thingType {thingType}")
+    return dict_entity_file_type[thingType]
+
+
+def relation_roles(thingType, dict_rel_roles):
+    '''
+    @usage pick the roles played by the _start and _end nodes of a relation file
+    @param thingType: relation type
+    @param dict_rel_roles: dict of relation type to list of its roles
+    @return (start_role, end_role) tuple
+    '''
+    if thingType == "registered_address":
+        # directed_relation
+        start_role = [role for role in dict_rel_roles[thingType] if "has_" in role][0]
+        end_role = [role for role in dict_rel_roles[thingType] if "is_" in role][0]
+    elif thingType in ["intermediary_of", "officer_of", "underlying"]:
+        # directed_relation
+        start_role = [role for role in dict_rel_roles[thingType] if "is_" in role][0]
+        end_role = [role for role in dict_rel_roles[thingType] if "has_" in role][0]
+    else:
+        # undirected relation
+        start_role = end_role = dict_rel_roles[thingType][0]
+    return start_role, end_role
+
+
+def introspect_schema(client, database):
+    '''
+    @usage query the defined schema for what the migration needs to know about it
+    @param client: open typedb client
+    @param database: database
+    @return (dict_attr_valuetype, dict_rel_roles, dict_role_players, key_attributes) tuple:
+        attribute type to valuetype, relation type to its roles, (relation type, role) to the entity types that play it,
+        and the set of attribute types that any type owns as @key
+    '''
+    # get all attributes and their valuetypes
+    with client.session(database, SessionType.SCHEMA) as session:
+        with session.transaction(TransactionType.READ) as read_transaction:
+            iterator_conceptMap = read_transaction.query().match("match $x sub attribute; not {$x type attribute;}; ")
+            list_concept = [conceptMap.get("x") for conceptMap in iterator_conceptMap]
+            dict_attr_valuetype = {concept.get_label().name():concept.get_value_type().name for concept in list_concept}
+    # get relation roles
+    with client.session(database, SessionType.SCHEMA) as session:
+        dict_rel_roles = {}
+        with session.transaction(TransactionType.READ) as read_transaction:
+            iterator_conceptMap = read_transaction.query().match("match $x sub relation; not {$x type relation;}; $x relates $y; ")
+            for conceptMap in iterator_conceptMap:
+                reltype = conceptMap.get("x").get_label().name()
+                if not reltype in dict_rel_roles:
+                    dict_rel_roles[reltype] = []
+                dict_rel_roles[reltype].append(conceptMap.get("y").get_label().name())
+    # get the entity types that can play each relation role
+    with client.session(database, SessionType.SCHEMA) as session:
+        dict_role_players = {}
+        with session.transaction(TransactionType.READ) as read_transaction:
+            iterator_conceptMap = read_transaction.query().match("match $x sub relation; not {$x type relation;}; $x relates $y; $z plays $y; $z sub entity; ")
+            for conceptMap in iterator_conceptMap:
+                reltype = conceptMap.get("x").get_label().name()
+                role = conceptMap.get("y").get_label().name()
+                if not (reltype, role) in dict_role_players:
+                    dict_role_players[(reltype, role)] = set()
+                dict_role_players[(reltype, role)].add(conceptMap.get("z").get_label().name())
+    # get the key attributes, which an entity must keep whatever else changes
+    with client.session(database, SessionType.SCHEMA) as session:
+        with session.transaction(TransactionType.READ) as read_transaction:
+            iterator_conceptMap = read_transaction.query().match("match $x owns $a @key; ")
+            key_attributes = {conceptMap.get("a").get_label().name() for conceptMap in iterator_conceptMap}
+    return dict_attr_valuetype, dict_rel_roles, dict_role_players, key_attributes
+
+
+def attribute_mappings(path, dict_attr_valuetype):
+    '''
+    @usage construct mappings for each column to schema attribute, reading only the header of the file
+    @param path: path to csv file
+    @param dict_attr_valuetype: attribute valuetype
+    @return list of string: "has {attr} <{column}>"
+    '''
+    return column_mappings(pd.read_csv(path, nrows=0).columns, dict_attr_valuetype)
+
+
+def column_mappings(columns, dict_attr_valuetype):
+    '''
+    @usage construct mappings for each column to schema attribute
+    @param columns: column names
+    @param dict_attr_valuetype: attribute valuetype
+    @return list of string: "has {attr} <{column}>"
+    '''
+    return [f"has {re.sub(pattern_rm_underscore_prefix, '', colname)} <{colname}>" for colname in columns if re.sub(pattern_rm_underscore_prefix, '', colname) in dict_attr_valuetype.keys()]
+
+
+def prepare_entity_queries(args, path, source, thingType, dict_attr_valuetype, dict_attr_dtype):
+    '''
+    @usage start generating an entity file's insert queries in the background
+    @param path: path to the csv file
+    @param source: path to read the data from: the csv file, or its columnar cache
+    @return an iterator of queries
+    '''
+    print(f"\npreparing {thingType} insert queries")
+    return prefetch(name=thingType, iterator=stream_entity_insert_queries(
+        source,
+        thingType,
+        mappings=attribute_mappings(path, dict_attr_valuetype),
+        dict_attr_valuetype=dict_attr_valuetype,
+        dtype=column_dtypes(path, dict_attr_dtype),
+        chunksize=args.chunk_size
+        ))
+
+
+def prepare_relation_queries(args, path, source, thingType, start_role, end_role, dict_attr_valuetype, dict_attr_dtype, id_type_index):
+    '''
+    @usage start generating a relation file's insert queries in the background
+    @param path: path to the csv file
+    @param source: path to read the data from: the csv file, or its columnar cache
+    @return an iterator of queries
+    '''
+    print(f"\npreparing {thingType} insert queries")
+    return prefetch(name=thingType, iterator=stream_typed_relation_insert_queries(
+        source,
+        thingType,
+        attribute_mappings(path, dict_attr_valuetype),
+        dict_attr_valuetype,
+        start_role,
+        end_role,
+        id_type_index,
+        dtype=dict(column_dtypes(path, dict_attr_dtype), _start=str, _end=str),
+        chunksize=args.chunk_size
+        ))
+
+
+def prepare_attribute_queries(args, path):
+    '''
+    @usage start generating the insert queries of the shared attribute values in the background
+    @param path: path to the csv file from collect_attribute_values
+    @return an iterator of queries
+    '''
+    print("\npreparing attribute insert queries")
+    return prefetch(name="attribute", iterator=stream_attribute_insert_queries(path, chunksize=args.chunk_size))
 
-parallellisation = 1
 
+def prepare_replay_queries(args, key, info, journal):
+    '''
+    @usage start reading a file's exported queries in the background
+    @param key: string identifying the file in the export manifest and the journal
+    @param info: the file's entry in the export manifest
+    @param journal: journal state, or None
+    @return an iterator of queries
+    '''
+    print(f"\nreplaying {info['type']} insert queries")
+    committed = journal[key]["committed"] if journal and key in journal else []
+    return prefetch(name=info["type"], iterator=replay_shard_queries(
+        args.replay, info["shards"], committed, read_ahead=args.shard_workers
+        ))
+
+
+def load_file(args, key, path, thingType, journal, client, pool, queries, sha256=None, n_rows=None):
+    '''
+    @usage insert one file's queries, skipping those the journal records as committed
+    @param key: string identifying the file in the journal
+    @param path: path to the file
+    @param thingType: type inserted, for progress messages
+    @param journal: journal state
+    @param client: open typedb client to share, or None
+    @param pool: LoaderPool to share, or None
+    @param queries: iterator of queries, from prepare_entity_queries, prepare_relation_queries or prepare_replay_queries
+    @param sha256: hash of the file, if known without reading it, e.g. from an export manifest
+    @param n_rows: number of rows of the file, if known without reading it
+    @return None
+    '''
+    committed = register_journal_file(args.journal, journal, key, path, sha256=sha256)
+    if metrics.enabled:
+        n_rows = count_csv_rows(path) if n_rows is None else n_rows
+        metrics.expect_rows(n_rows - sum(stop - start for start, stop in committed))
+    print(f"\nperforming {thingType} insert queries")
+    insert_queries(args, queries, journal=(args.journal, key, committed), client=client, pool=pool)
+    print(f"\ndone inserting {thingType}")
+
+
+def delta_phases(dict_key_delta, dict_rel_roles, dict_attr_valuetype, key_attributes, id_type_index):
+    '''
+    @usage the queries that bring the database from the last load to the current files, in five phases,
+        each of which must be written before the next starts: relations are deleted while their roleplayers
+        can still be matched, and inserted once their roleplayers exist
+    @param dict_key_delta: dict of input file key to its changes, from diff_against_manifest
+    @param dict_rel_roles: dict of relation type to list of its roles
+    @param dict_attr_valuetype: attribute valuetype
+    @param key_attributes: set of attribute types owned as @key, which updates leave alone
+    @param id_type_index: pandas.Series from build_id_type_index
+    @return list of (phase name, query type, list of query iterators) tuples
+    '''
+    phases = {
+        "deleting relations": [], "deleting entities": [], "updating entities": [],
+        "inserting entities": [], "inserting relations": []
+        }
+    for key, delta in dict_key_delta.items():
+        thingType = delta["type"]
+        if delta["kind"] == "entity":
+            # added entities are deleted first too, in case an interrupted delta inserted them already
+            ids = pd.concat([delta["removed"], delta["added"]["_id"]])
+            phases["deleting entities"].append(render_entity_delete_queries(thingType, ids, dict_attr_valuetype["id"]))
+            template = compile_entity_template(thingType, column_mappings(delta["added"].columns, dict_attr_valuetype), dict_attr_valuetype)
+            phases["updating entities"].append(render_entity_update_queries(template, delta["changed"], key_attributes))
+            phases["inserting entities"].append(render_entity_queries(template, delta["added"]))
+        else:
+            start_role, end_role = relation_roles(thingType, dict_rel_roles)
+            for phase, df, render in [
+                ("deleting relations", delta["deleted"], render_relation_delete_queries),
+                ("inserting relations", delta["inserted"], render_relation_queries)
+                ]:
+                phases[phase].append(render_typed_relation_queries(
+                    df, thingType, column_mappings(df.columns, dict_attr_valuetype), dict_attr_valuetype,
+                    start_role, end_role, id_type_index, templates={}, render=render
+                    ))
+    dict_phase_query_type = {"deleting": "delete", "updating": "update", "inserting": "insert"}
+    return [(phase, dict_phase_query_type[phase.split(" ")[0]], queries) for phase, queries in phases.items()]
+
+
+def dry_run(prepare):
+    '''
+    @usage generate every file's queries without writing them, to time and count them
+    @param prepare: dict of file key to function that starts generating its queries
+    @return None
+    '''
+    total = 0
+    for key, prepare_queries in prepare.items():
+        n_queries = sum(1 for _ in prepare_queries())
+        print(f"{key}: {n_queries} queries")
+        total += n_queries
+    print(f"\ndry run: generated {total} queries, wrote none")
 
 
 if __name__ == "__main__":
@@ -52,47 +497,75 @@ if __name__ == "__main__":
     # get cmd line arguments
     parser = migrator_parser()
     args = parser.parse_args()
+    if args.resume and args.force:
+        parser.error("--resume continues an existing database; it cannot be combined with --force")
+    if args.delta and (args.force or args.resume):
+        parser.error("--delta updates an existing database; it cannot be combined with --force or --resume")
+    if args.export and (args.replay or args.delta or args.dry_run):
+        parser.error("--export writes the queries of a full load to files; it cannot be combined with --replay, --delta or --dry_run")
+    if args.snapshot and (args.export or args.replay or args.delta or args.dry_run):
+        parser.error("--snapshot only reads the preprocessed files; it cannot be combined with --export, --replay, --delta or --dry_run")
+    if args.replay and args.delta:
+        parser.error("--replay loads the queries of a full load; it cannot be combined with --delta")
+    if args.delta and not args.manifest:
+        parser.error("--delta diffs against the manifest of the last load; give its directory with --manifest")
+    if args.replay:
+        export_manifest = load_export_manifest(args.replay, schema_file)
+        if export_manifest["materialise_rules"] != args.materialise_rules:
+            parser.error(f"the queries in {args.replay} were exported with{'' if export_manifest['materialise_rules'] else 'out'} --materialise_rules, so replay them likewise")
+        # relation queries are ordered per csv chunk, which sets the offsets the journal records
+        args.chunk_size = export_manifest["chunk_size"]
+    # an export only generates queries, as a dry run does, and a snapshot only reads the files
+    offline = args.dry_run or bool(args.export) or bool(args.snapshot)
+    if args.progress or args.metrics_file or args.profile:
+        metrics.enable()
+        metrics.profiler_enabled = bool(args.profile)
+        stop_reporter = start_reporter(args.metrics_interval, args.progress, args.metrics_file, args.metrics_format)
         
-    # 0. all attribute value types as a dict through a query
-    with TypeDB.core_client(
-            address=f"{args.host}:{args.port}",
-            parallelisation=parallellisation
-        ) as client:
-        # checking whether database already exists; if not, create it
-        # databases = [db.name() for db in client.databases().all()]
-        if args.force:
-            try:
-                client.databases().get(args.database).delete()
-            except Exception:
-                pass 
-        if client.databases().contains(args.database):
-            if not args.existing:
-                raise UserWarning(f"database {args.database} already exists. Use --existing to write into existing database or --force to delete it and start anew.")
-        else:
-            client.databases().create(args.database)    
-        query_define = open(schema_file, "r").read()
-        # define schema
-        with client.session(args.database, SessionType.SCHEMA) as session:
-            with session.transaction(TransactionType.WRITE) as write_transaction:
-                write_transaction.query().define(query_define)
-                write_transaction.commit()
-        # load schema
-        # get all attributes and their valuetypes
-        with client.session(args.database, SessionType.SCHEMA) as session:
-            with session.transaction(TransactionType.READ) as read_transaction:
-                iterator_conceptMap = read_transaction.query().match("match $x sub attribute; not {$x type attribute;}; ")
-                list_concept = [conceptMap.get("x") for conceptMap in iterator_conceptMap]
-                dict_attr_valuetype = {concept.get_label().name():concept.get_value_type().name for concept in list_concept}
-        # get relation roles
-        with client.session(args.database, SessionType.SCHEMA) as session:
-            dict_rel_roles = {}
-            with session.transaction(TransactionType.READ) as read_transaction:
-                iterator_conceptMap = read_transaction.query().match("match $x sub relation; not {$x type relation;}; $x relates $y; ")
-                for conceptMap in iterator_conceptMap:
-                    reltype = conceptMap.get("x").get_label().name()
-                    if not reltype in dict_rel_roles:
-                        dict_rel_roles[reltype] = []
-                    dict_rel_roles[reltype].append(conceptMap.get("y").get_label().name())
+    # 0. define the schema, and introspect it unless this version of it is cached
+    schema_cache = load_schema_cache(args.cache_dir, schema_file)
+    if offline:
+        if schema_cache is None:
+            parser.error(f"--dry_run, --export and --snapshot need the schema introspection cached in {args.cache_dir} by an earlier run against a server")
+        dict_attr_valuetype, dict_rel_roles, dict_role_players, key_attributes = schema_cache
+    else:
+        with metrics.stage("schema"), TypeDB.core_client(
+                address=f"{args.host}:{args.port}",
+                parallelisation=args.parallelisation
+            ) as client:
+            # checking whether database already exists; if not, create it
+            # databases = [db.name() for db in client.databases().all()]
+            if args.force:
+                try:
+                    client.databases().get(args.database).delete()
+                except Exception:
+                    pass 
+            if client.databases().contains(args.database):
+                if not (args.existing or args.resume or args.delta):
+                    raise UserWarning(f"database {args.database} already exists. Use --existing to write into existing database or --force to delete it and start anew.")
+            elif args.resume or args.delta:
+                raise UserWarning(f"database {args.database} does not exist, so there is nothing to resume or update.")
+            else:
+                client.databases().create(args.database)    
+            query_define = open(schema_file, "r").read()
+            if args.materialise_rules:
+                # the inferred relations are loaded as data, so the rules would only infer them again
+                query_define, rule_labels = split_schema_rules(query_define)
+            # define schema
+            with client.session(args.database, SessionType.SCHEMA) as session:
+                with session.transaction(TransactionType.WRITE) as write_transaction:
+                    write_transaction.query().define(query_define)
+                    if args.materialise_rules:
+                        defined_rules = {rule.get_label() for rule in write_transaction.logic().get_rules()}
+                        for label in rule_labels:
+                            if label in defined_rules:
+                                write_transaction.query().undefine(f"undefine rule {label};")
+                    write_transaction.commit()
+            if schema_cache is None:
+                dict_attr_valuetype, dict_rel_roles, dict_role_players, key_attributes = introspect_schema(client, args.database)
+                save_schema_cache(args.cache_dir, schema_file, dict_attr_valuetype, dict_rel_roles, dict_role_players, key_attributes)
+            else:
+                dict_attr_valuetype, dict_rel_roles, dict_role_players, key_attributes = schema_cache
 
     # provide pandas read_csv with datatypes to avoid having to load whole df into memory first to guess
     dict_dtype_convert = {
@@ -107,106 +580,246 @@ if __name__ == "__main__":
         attr: dict_dtype_convert[dict_attr_valuetype[attr]] for attr in dict_attr_valuetype.keys()
         }
 
-    # prepare queries
-    pattern_rm_thingType = re.compile("^relationships_|_?clean_formatted_?|^nodes-|.csv$")
-    pattern_rm_underscore_prefix = re.compile("^_")
+    if not offline:
+        set_commit_marker(args.commit_marker)
+        # a resumed run adds to the dead letters of the run it continues
+        if args.dead_letters:
+            os.makedirs(os.path.dirname(args.dead_letters) or ".", exist_ok=True)
+            if not args.resume and os.path.exists(args.dead_letters):
+                os.remove(args.dead_letters)
+            end_torn_record(args.dead_letters)
 
+    # checkpoint journal of committed batches; a dry run, export or delta leaves it alone
+    if offline or args.delta:
+        journal = None
+    elif args.resume:
+        journal = load_journal(args.journal, schema_file, args.chunk_size)
+    else:
+        journal = start_journal(args.journal, schema_file, args.chunk_size)
 
-    for file in os.listdir(dir_entities):
-        thingType = re.sub(
-            pattern_rm_thingType, "", file
-            )
-        if thingType == "addresses":
-            thingType = "node_address"
-        elif thingType == "entities":
-            thingType = "org_entity"
-        elif thingType == "intermediaries":
-            thingType = "intermediary"
-        elif thingType == "officers":
-            thingType = "officer"
-        elif thingType == "others":
-            thingType = "other"
-        else:
-            raise ValueError(f"unknown thingType {thingType}")
-        # construct mappings for each column to schema variable
-        
-        df = pd.read_csv(
-            dir_entities+"/"+file, 
-            dtype=dict_attr_dtype
-            )
-        mappings = [f"has {re.sub(pattern_rm_underscore_prefix, '', colname)} <{colname}>" for colname in df.columns if re.sub(pattern_rm_underscore_prefix, '', colname) in dict_attr_valuetype.keys()]
-        print(f"\npreparing {thingType} insert queries")
-        queries = prep_entity_insert_queries(
-            df,
-            thingType,
-            mappings=mappings,
-            dict_attr_valuetype=dict_attr_valuetype
-            )
-        with TypeDB.core_client(
-            address=f"{args.host}:{args.port}",
-            parallelisation=parallellisation
-        ) as client:
-            print(f"\nperforming {thingType} insert queries")
-            insert_data_bulk(
-                client,
-                args.database,
-                queries,
-                num_threads = args.num_threads,
-                batch_size = args.batch_size,
-                typedb_options=None
+    # the files to load, keyed by their path relative to data/preprocessed; a replay reads none of them
+    dict_key_path = {}
+    dict_key_type = {}
+    if not args.replay:
+        for file in sorted(os.listdir(dir_entities)):
+            dict_key_path["entities/"+file] = dir_entities+"/"+file
+            dict_key_type["entities/"+file] = entity_file_type(file)
+    entity_keys = list(dict_key_type)
+    if not args.replay:
+        for file in sorted(os.listdir(dir_relations)):
+            dict_key_path["relations/"+file] = dir_relations+"/"+file
+            dict_key_type["relations/"+file] = re.sub(pattern_rm_thingType, "", file)
+    if args.materialise_rules and not args.replay:
+        # the relations the rules would infer, written as relation files with one per relation type
+        print("\nmaterialising inferred relations")
+        with metrics.stage("materialise_rules"):
+            inferred_paths = materialise_inferred_relations(
+                [dict_key_path[key] for key in entity_keys if dict_key_type[key] in corporate_entity_types],
+                dict_key_path[next(key for key in dict_key_path if dict_key_type[key] == "officer_of")],
+                dict_key_path[next(key for key in dict_key_path if dict_key_type[key] == "intermediary_of")],
+                dir_inferred,
+                max_group_size=args.max_group_size,
+                min_shared_officers=args.min_shared_officers
                 )
-        print(f"\ndone inserting {thingType} entities")
+        for path in inferred_paths:
+            file = os.path.basename(path)
+            dict_key_path["inferred/"+file] = path
+            dict_key_type["inferred/"+file] = re.sub(pattern_rm_thingType, "", file)
 
-    # relations
-    for file in os.listdir(dir_relations):
-        thingType = re.sub(
-            pattern_rm_thingType, "", file
+    # where to read each file's data from: the csv file, or its memory-mapped columnar copy
+    if args.columnar_cache:
+        schema_sha256 = file_sha256(schema_file)
+        dict_key_source = {
+            key: columnar_cache(path, args.cache_dir, key, column_dtypes(path, dict_attr_dtype), schema_sha256)
+            for key, path in dict_key_path.items()
+            }
+    else:
+        dict_key_source = dict(dict_key_path)
+
+    # prepare queries
+    if not args.replay:
+        print("\nindexing entity ids by type")
+        with metrics.stage("id_type_index"):
+            id_type_index = build_id_type_index(
+                (dict_key_source[key], dict_key_type[key])
+                for key in entity_keys
+                )
+
+    # one task per file: entity files are independent of each other, and each relation file
+    # waits only for the entity files whose types can play its roles
+    prepare = {}
+    dependencies = {}
+    for key in entity_keys:
+        prepare[key] = partial(
+            prepare_entity_queries, args, dict_key_path[key], dict_key_source[key], dict_key_type[key],
+            dict_attr_valuetype, dict_attr_dtype
             )
-        # 3. construct mappings for each columns
-        df = pd.read_csv(
-            dir_relations+"/"+file,
-            dtype = dict_attr_dtype
+        dependencies[key] = set()
+    for key in dict_key_path:
+        if key in entity_keys:
+            continue
+        thingType = dict_key_type[key]
+        start_role, end_role = relation_roles(thingType, dict_rel_roles)
+        prepare[key] = partial(
+            prepare_relation_queries, args, dict_key_path[key], dict_key_source[key], thingType, start_role, end_role,
+            dict_attr_valuetype, dict_attr_dtype, id_type_index
             )
-        # relation attribute
-        mappings = [f"has {re.sub(pattern_rm_underscore_prefix, '', colname)} <{colname}>" for colname in df.columns if re.sub(pattern_rm_underscore_prefix, '', colname) in dict_attr_valuetype.keys()]
-
-        if thingType == "registered_address":
-            # directed_relation
-            start_role = [role for role in dict_rel_roles[thingType] if "has_" in role][0]
-            end_role = [role for role in dict_rel_roles[thingType] if "is_" in role][0]
-        elif thingType in ["intermediary_of", "officer_of", "underlying"]:
-            # directed_relation
-            start_role = [role for role in dict_rel_roles[thingType] if "is_" in role][0]
-            end_role = [role for role in dict_rel_roles[thingType] if "has_" in role][0]
-        else:
-            # undirected relation
-            start_role = end_role = dict_rel_roles[thingType][0]
-        source_mapping =  f"$start isa thing; $start has id <_start> ... {start_role} : $start"
-        target_mapping =  f"$end isa thing; $end has id <_end> ... {end_role} : $end"
-        mappings.append(source_mapping)
-        mappings.append(target_mapping)
-        print(f"\npreparing {thingType} insert queries")
-        queries = prep_relation_insert_queries(
-            df,
-            thingType,
-            mappings,
-            dict_attr_valuetype,
+        players = dict_role_players.get((thingType, start_role), set()) | dict_role_players.get((thingType, end_role), set())
+        dependencies[key] = {entity_key for entity_key in entity_keys if dict_key_type[entity_key] in players} or set(entity_keys)
+
+    # the dtypes each file is loaded with, which its rows are fingerprinted in for the manifest
+    dict_key_dtype = {key: column_dtypes(path, dict_attr_dtype) for key, path in dict_key_path.items()}
+    for key in dict_key_path:
+        if key not in entity_keys:
+            dict_key_dtype[key].update(_start=str, _end=str)
+    # the files the manifest of a full load fingerprints, for --delta to diff against
+    dict_manifest_path = dict(dict_key_path)
+
+    # attribute values that many rows share are inserted in a phase of their own, which every file waits for,
+    # so that concurrent writers do not conflict on inserting the same attributes; a delta is too small to need it
+    if args.prepopulate_max_values and not (args.delta or args.replay or args.snapshot):
+        # reading every file for them delays the first insert, so they are kept in the cache for later runs
+        sources = [(dict_key_source[key], dict_key_dtype[key]) for key in dict_key_path]
+        values_dir = os.path.join(args.cache_dir, "attributes")
+        values_metadata = attribute_values_metadata(
+            [source for source, dtype in sources], file_sha256(schema_file),
+            args.prepopulate_max_values, args.prepopulate_min_uses
             )
-        with TypeDB.core_client(
-            address=f"{args.host}:{args.port}",
-            parallelisation=parallellisation
-        ) as client:
-            print(f"\nperforming {thingType} insert queries")
-            insert_data_bulk(
-                client,
-                args.database,
-                queries,
-                num_threads = args.num_threads,
-                batch_size = args.batch_size,
-                typedb_options=None
-                )
-        print(f"\ndone inserting {thingType} relations")
+        df_values = load_attribute_values(values_dir, values_metadata)
+        if df_values is None:
+            print("\ncollecting shared attribute values")
+            with metrics.stage("attribute_values"):
+                df_values = collect_attribute_values(
+                    sources,
+                    dict_attr_valuetype,
+                    max_values=args.prepopulate_max_values,
+                    min_uses=args.prepopulate_min_uses,
+                    chunksize=args.chunk_size
+                    )
+            if not args.dry_run:
+                write_attribute_values(df_values, values_dir, values_metadata)
+        key = "attributes/attribute_values.csv"
+        for deps in dependencies.values():
+            deps.add(key)
+        dict_key_type[key] = "attribute"
+        dependencies[key] = set()
+        if args.dry_run:
+            # nothing to load later, so nothing to write
+            prepare = {key: partial(render_attribute_queries, df_values), **prepare}
+        else:
+            # with the export if there is one, since its queries are replayed from there, else with the cache
+            path = os.path.join(values_dir, "attribute_values.csv")
+            if args.export:
+                path = write_attribute_values(df_values, os.path.join(args.export, "attributes"))
+            dict_key_path[key] = path
+            prepare = {key: partial(prepare_attribute_queries, args, path), **prepare}
+
+    try:
+        if args.delta:
+            print("\ndiffing the preprocessed files against the manifest of the last load")
+            with metrics.stage("delta_diff"):
+                next_manifest, dict_key_delta = diff_against_manifest(
+                    args.manifest, load_manifest(args.manifest, schema_file), schema_file,
+                    dict_key_path, dict_key_type, entity_keys, dict_key_dtype, chunksize=args.chunk_size
+                    )
+            phases = delta_phases(dict_key_delta, dict_rel_roles, dict_attr_valuetype, key_attributes, id_type_index)
+            if args.dry_run:
+                dry_run({phase: partial(chain.from_iterable, queries) for phase, query_type, queries in phases})
+            else:
+                with TypeDB.core_client(
+                    address=f"{args.host}:{args.port}",
+                    parallelisation=args.parallelisation
+                ) as client:
+                    for phase, query_type, queries in phases:
+                        print(f"\n{phase}")
+                        insert_data_bulk(
+                            client,
+                            args.database,
+                            chain.from_iterable(queries),
+                            num_threads = args.num_threads,
+                            batch_size = args.batch_size,
+                            min_batch_size = args.min_batch_size,
+                            max_batch_size = args.max_batch_size,
+                            target_latency = args.target_latency,
+                            max_retries = args.max_retries,
+                            query_type = query_type,
+                            dead_letter_path = args.dead_letters or None,
+                            source = phase,
+                            check_inserted = args.check_inserts
+                            )
+                commit_manifest(args.manifest, next_manifest, args.dead_letters or None)
+        elif args.snapshot:
+            print(f"\nbuilding the graph snapshot in {args.snapshot}")
+            with metrics.stage("snapshot"):
+                build_graph_snapshot(
+                    id_type_index,
+                    [(dict_key_source[key], dict_key_type[key]) for key in dict_key_path if key not in entity_keys],
+                    sorted(dict_rel_roles),
+                    args.snapshot,
+                    chunksize=args.chunk_size
+                    )
+        elif args.export:
+            print(f"\nexporting the insert queries to {args.export}")
+            with metrics.stage("export"):
+                export_queries(
+                    args.export, prepare, dict_key_path, dict_key_type, dependencies, schema_file,
+                    chunk_size=args.chunk_size, materialise_rules=args.materialise_rules,
+                    shard_size=args.shard_size, num_workers=args.shard_workers, concurrent_files=args.concurrent_files
+                    )
+        elif args.replay:
+            export_files = export_manifest["files"]
+            prepare = {key: partial(prepare_replay_queries, args, key, info, journal) for key, info in export_files.items()}
+            if args.dry_run:
+                # reads and checks every shard
+                dry_run(prepare)
+            else:
+                with TypeDB.core_client(
+                    address=f"{args.host}:{args.port}",
+                    parallelisation=args.parallelisation
+                ) as client, start_loader_pool(args) as pool:
+                    tasks = {
+                        key: partial(
+                            load_file, args, key, os.path.join(args.replay, key), info["type"], journal,
+                            client, pool, sha256=info["sha256"], n_rows=info["queries"]
+                            )
+                        for key, info in export_files.items()
+                        }
+                    dependencies = {key: set(deps) for key, deps in export_manifest["dependencies"].items()}
+                    run_dependency_schedule(tasks, dependencies, max_workers=args.concurrent_files, prepare=prepare)
+        elif args.dry_run:
+            dry_run(prepare)
+        else:
+            # one client, or one pool of loader processes, for the whole run
+            with TypeDB.core_client(
+                address=f"{args.host}:{args.port}",
+                parallelisation=args.parallelisation
+            ) as client, start_loader_pool(args) as pool:
+                tasks = {
+                    key: partial(
+                        load_file, args, key, dict_key_path[key], dict_key_type[key], journal, client, pool
+                        )
+                    for key in prepare
+                    }
+                run_dependency_schedule(tasks, dependencies, max_workers=args.concurrent_files, prepare=prepare)
+            # fingerprint what was loaded, for the next --delta to diff against
+            if args.manifest and args.dead_letters and count_dead_letters(args.dead_letters):
+                print(f"\nnot recording the manifest, since some rows failed to load; see {args.dead_letters}. --delta needs a load without dead letters")
+            elif args.manifest:
+                print("\nrecording the loaded rows in the manifest")
+                with metrics.stage("manifest"):
+                    next_manifest, _ = diff_against_manifest(
+                        args.manifest, None, schema_file,
+                        dict_manifest_path, dict_key_type, entity_keys, dict_key_dtype, chunksize=args.chunk_size, keep_rows=False
+                        )
+                commit_manifest(args.manifest, next_manifest, args.dead_letters or None)
+    finally:
+        if metrics.enabled:
+            stop_reporter()
+        if args.profile:
+            metrics.dump_profile(args.profile)
+    if args.dead_letters and not offline:
+        print_dead_letter_summary(args.dead_letters)
             
     end = timer()
     time_in_sec = end - start
-    print("Elapsed time: " + str(time_in_sec) + " seconds.")
\ No newline at end of file
+    print("Elapsed time: " + str(time_in_sec) + " seconds.")
@@ -0,0 +1,10 @@
+# tests run against the in-memory stand-in for the TypeDB server in benchmarks/fake_typedb.py
+# @usage
+# python -m pytest tests
+
+import os
+import sys
+
+dir_repo = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, dir_repo)
+sys.path.insert(0, os.path.join(dir_repo, "benchmarks"))
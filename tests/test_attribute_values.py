@@ -0,0 +1,35 @@
+import os
+
+from typedb_data_offshoreleaks.migrate_helpers import (
+    attribute_values_metadata,
+    collect_attribute_values,
+    load_attribute_values,
+    write_attribute_values
+    )
+
+dict_attr_valuetype = {"status": "STRING", "name": "STRING"}
+
+
+def write_file(path, rows):
+    with open(path, "w") as f:
+        f.write("name,status\n" + "".join(f"{name},{status}\n" for name, status in rows))
+
+
+def test_collected_values_are_reused_until_their_files_change(tmp_path):
+    path = str(tmp_path / "nodes.csv")
+    write_file(path, [("a", "Active"), ("b", "Active"), ("c", "Defaulted")])
+    sources = [(path, {"name": str, "status": str})]
+    df_values = collect_attribute_values(sources, dict_attr_valuetype, max_values=2)
+    assert df_values.values.tolist() == [["status", "'Active'"]]
+
+    values_dir = str(tmp_path / "attributes")
+    metadata = attribute_values_metadata([path], "schema", 2, 2)
+    assert load_attribute_values(values_dir, metadata) is None
+    write_attribute_values(df_values, values_dir, metadata)
+    assert load_attribute_values(values_dir, attribute_values_metadata([path], "schema", 2, 2)).equals(df_values)
+    assert load_attribute_values(values_dir, attribute_values_metadata([path], "schema", 2, 3)) is None
+    assert load_attribute_values(values_dir, attribute_values_metadata([path], "other schema", 2, 2)) is None
+
+    write_file(path, [("a", "Active"), ("b", "Defaulted"), ("c", "Defaulted"), ("d", "Active")])
+    os.utime(path, ns=(1, 1))
+    assert load_attribute_values(values_dir, attribute_values_metadata([path], "schema", 2, 2)) is None
@@ -0,0 +1,61 @@
+import pytest
+from fake_typedb import FakeTypeDBClient
+
+from typedb_data_offshoreleaks.migrate_helpers import (
+    AdaptiveBatchSize,
+    write_batch_with_retry,
+    write_indexed_query_batch
+    )
+
+
+def write(batch, fail_pattern="poison", write_batch=write_indexed_query_batch, **kwargs):
+    '''@usage write one indexed batch to a fresh fake database, returning its client and the dead letters'''
+    client = FakeTypeDBClient(commit_latency=0, per_query_latency=0, fail_pattern=fail_pattern)
+    dead_letters = []
+    with client.session("db") as session:
+        write_batch_with_retry(
+            session, batch, write_batch, AdaptiveBatchSize(len(batch), 1, len(batch)),
+            backoff=0, dead_letter=lambda item, error: dead_letters.append(item), **kwargs
+            )
+    return client, dead_letters
+
+
+def test_one_poison_query_ends_in_exactly_one_dead_letter():
+    batch = [(offset, f"insert $x {offset};") for offset in range(16)]
+    batch[7] = (7, "insert $x poison;")
+    client, dead_letters = write(batch)
+    assert dead_letters == [(7, "insert $x poison;")]
+    assert client.stats.queries == 15
+
+
+def test_every_poison_query_is_dead_lettered_once():
+    batch = [(offset, f"insert $x {'poison' if offset in (0, 5, 6, 12) else offset};") for offset in range(13)]
+    client, dead_letters = write(batch)
+    assert [offset for offset, _ in dead_letters] == [0, 5, 6, 12]
+    assert client.stats.queries == 9
+
+
+def test_conflicts_are_retried_without_bisecting():
+    attempts = []
+
+    def conflict_twice(session, batch):
+        attempts.append(len(batch))
+        if len(attempts) <= 2:
+            raise RuntimeError("[TXN] transaction conflict")
+        write_indexed_query_batch(session, batch)
+
+    batch = [(offset, f"insert $x {offset};") for offset in range(8)]
+    client, dead_letters = write(batch, write_batch=conflict_twice)
+    assert attempts == [8, 8, 8]
+    assert dead_letters == []
+    assert client.stats.queries == 8
+
+
+def test_failure_without_dead_letters_is_raised():
+    client = FakeTypeDBClient(commit_latency=0, per_query_latency=0, fail_pattern="poison")
+    with client.session("db") as session, pytest.raises(RuntimeError, match="invalid query"):
+        write_batch_with_retry(
+            session, [(0, "insert $x 0;"), (1, "insert $x poison;")], write_indexed_query_batch,
+            AdaptiveBatchSize(2, 1, 2), backoff=0
+            )
+    assert client.stats.queries == 0
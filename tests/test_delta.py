@@ -0,0 +1,95 @@
+import pandas as pd
+import pytest
+
+from typedb_data_offshoreleaks.migrate_helpers import (
+    commit_manifest,
+    diff_against_manifest,
+    diff_entity_file,
+    diff_relation_file,
+    load_manifest
+    )
+
+entity_dtype = {"_id": str, "name": str, "countries": str}
+relation_dtype = {"_start": str, "_end": str, "link": str}
+
+
+def write_csv(path, df):
+    df.to_csv(path, index=False)
+    return str(path)
+
+
+def entities(rows):
+    return pd.DataFrame(rows, columns=list(entity_dtype))
+
+
+def relations(rows):
+    return pd.DataFrame(rows, columns=list(relation_dtype))
+
+
+def test_entity_diff(tmp_path):
+    path = write_csv(tmp_path / "nodes.csv", entities([["1", "A", "UK"], ["2", "B", "UK"], ["3", "C", "FR"]]))
+    previous, _, _, _ = diff_entity_file(path, entity_dtype, chunksize=2, keep_rows=False)
+
+    write_csv(tmp_path / "nodes.csv", entities([["1", "A", "UK"], ["2", "B", "DE"], ["4", "D", "FR"]]))
+    fingerprints, added, changed, removed = diff_entity_file(path, entity_dtype, previous, chunksize=2)
+    assert added["_id"].tolist() == ["4"]
+    assert changed.values.tolist() == [["2", "B", "DE"]]
+    assert removed.tolist() == ["3"]
+    assert fingerprints["_id"].tolist() == ["1", "2", "4"]
+    assert fingerprints["fingerprint"][0] == previous["fingerprint"][0]
+
+
+def test_relation_diff_rewrites_only_the_roleplayers_whose_rows_changed(tmp_path):
+    rows = [["1", "2", "officer of"], ["1", "2", "officer of"], ["1", "3", "officer of"], ["4", "5", "officer of"]]
+    path = write_csv(tmp_path / "edges.csv", relations(rows))
+    previous, _, _ = diff_relation_file(path, relation_dtype, chunksize=3, keep_rows=False)
+    assert previous["count"].tolist() == [2, 1, 1]
+
+    # a duplicate edge is gone, one edge changed its attribute, one is new, and one is unchanged
+    rows = [["1", "2", "officer of"], ["1", "3", "director of"], ["4", "5", "officer of"], ["6", "7", "officer of"]]
+    write_csv(tmp_path / "edges.csv", relations(rows))
+    _, deleted, inserted = diff_relation_file(path, relation_dtype, previous, chunksize=3)
+    assert sorted(map(tuple, deleted.values.tolist())) == [("1", "2"), ("1", "3"), ("6", "7")]
+    assert inserted.values.tolist() == [["1", "2", "officer of"], ["1", "3", "director of"], ["6", "7", "officer of"]]
+
+    _, deleted, inserted = diff_relation_file(path, relation_dtype, diff_relation_file(path, relation_dtype, keep_rows=False)[0])
+    assert deleted.empty and inserted.empty
+
+
+def test_diff_against_manifest(tmp_path):
+    schema_file = tmp_path / "schema.tql"
+    schema_file.write_text("define\n")
+    schema_file = str(schema_file)
+    manifest_dir = str(tmp_path / "manifest")
+    dict_key_path = {
+        "entities/nodes.csv": write_csv(tmp_path / "nodes.csv", entities([["1", "A", "UK"], ["2", "B", "UK"]])),
+        "relations/edges.csv": write_csv(tmp_path / "edges.csv", relations([["1", "2", "officer of"]]))
+        }
+    dict_key_type = {"entities/nodes.csv": "entity", "relations/edges.csv": "officer_of"}
+    dict_key_dtype = {"entities/nodes.csv": entity_dtype, "relations/edges.csv": relation_dtype}
+
+    def diff(manifest, keep_rows=True):
+        return diff_against_manifest(
+            manifest_dir, manifest, schema_file, dict_key_path, dict_key_type, ["entities/nodes.csv"], dict_key_dtype,
+            keep_rows=keep_rows
+            )
+
+    manifest, _ = diff(None, keep_rows=False)
+    commit_manifest(manifest_dir, manifest)
+
+    write_csv(tmp_path / "nodes.csv", entities([["1", "A", "UK"], ["2", "B", "DE"]]))
+    next_manifest, dict_key_delta = diff(load_manifest(manifest_dir, schema_file))
+    # the relation file is unchanged, so it is not read again
+    assert list(dict_key_delta) == ["entities/nodes.csv"]
+    assert dict_key_delta["entities/nodes.csv"]["changed"]["_id"].tolist() == ["2"]
+    assert next_manifest["generation"] == manifest["generation"] + 1
+
+    # a load with dead letters does not record the rows they came from as loaded
+    dead_letter_path = tmp_path / "dead_letters.jsonl"
+    dead_letter_path.write_text('{"source": "entities/nodes.csv", "row": 1}\n')
+    with pytest.raises(RuntimeError, match="left at the last load"):
+        commit_manifest(manifest_dir, next_manifest, str(dead_letter_path))
+    assert load_manifest(manifest_dir, schema_file)["generation"] == manifest["generation"]
+    commit_manifest(manifest_dir, next_manifest)
+    _, dict_key_delta = diff(load_manifest(manifest_dir, schema_file))
+    assert dict_key_delta == {}
@@ -0,0 +1,97 @@
+import pytest
+from fake_typedb import FakeTypeDBClient
+
+from typedb_data_offshoreleaks.migrate_helpers import (
+    append_journal_record,
+    count_dead_letters,
+    insert_data_bulk,
+    load_journal,
+    merge_ranges,
+    offsets_to_ranges,
+    register_journal_file,
+    skip_committed_queries,
+    start_journal
+    )
+
+
+@pytest.fixture
+def files(tmp_path):
+    schema_file = tmp_path / "schema.tql"
+    schema_file.write_text("define\n")
+    input_file = tmp_path / "nodes.csv"
+    input_file.write_text("_id\n1\n")
+    return str(tmp_path / "journal.jsonl"), str(schema_file), str(input_file)
+
+
+def load(journal_path, committed, queries, dead_letter_path, fail_pattern=None):
+    '''@usage insert queries into a fresh fake database under the journal, returning the number of queries committed'''
+    client = FakeTypeDBClient(commit_latency=0, per_query_latency=0, fail_pattern=fail_pattern)
+    insert_data_bulk(
+        client, "db", iter(queries), num_threads=2, batch_size=8,
+        journal=(journal_path, "nodes", committed), dead_letter_path=dead_letter_path
+        )
+    return client.stats.queries
+
+
+def test_merge_ranges():
+    assert merge_ranges([[5, 7], [0, 2], [2, 3], [6, 9], [12, 13]]) == [[0, 3], [5, 9], [12, 13]]
+    assert offsets_to_ranges([4, 1, 2, 3, 7]) == [[1, 5], [7, 8]]
+
+
+def test_skip_committed_queries():
+    queries = [f"q{i}" for i in range(12)]
+    kept = list(skip_committed_queries(iter(queries), [[0, 2], [5, 9], [11, 12]]))
+    assert kept == [(2, "q2"), (3, "q3"), (4, "q4"), (9, "q9"), (10, "q10")]
+
+
+def test_resume_writes_only_the_queries_not_yet_committed(files, tmp_path):
+    journal_path, schema_file, input_file = files
+    queries = [f"insert $x {i};" for i in range(100)]
+    journal = start_journal(journal_path, schema_file, chunk_size=50)
+    register_journal_file(journal_path, journal, "nodes", input_file)
+    # batches an interrupted run committed, out of order, then a record torn by the crash
+    for ranges in ([[20, 30]], [[0, 10], [10, 12]], [[25, 40]]):
+        append_journal_record(journal_path, {"type": "batch", "file": "nodes", "ranges": ranges})
+    with open(journal_path, "a") as f:
+        f.write('{"type": "batch", "file": "nod')
+
+    journal = load_journal(journal_path, schema_file, chunk_size=50)
+    committed = register_journal_file(journal_path, journal, "nodes", input_file)
+    assert committed == [[0, 12], [20, 40]]
+    dead_letter_path = str(tmp_path / "dead_letters.jsonl")
+    assert load(journal_path, committed, queries, dead_letter_path) == 100 - 32
+
+    # every query is dealt with now, so resuming again writes nothing
+    journal = load_journal(journal_path, schema_file, chunk_size=50)
+    assert journal["nodes"]["committed"] == [[0, 100]]
+    assert load(journal_path, journal["nodes"]["committed"], queries, dead_letter_path) == 0
+
+
+def test_resume_skips_dead_lettered_queries(files, tmp_path):
+    journal_path, schema_file, input_file = files
+    queries = [f"insert $x {i};" for i in range(40)]
+    queries[17] = "insert $x poison;"
+    dead_letter_path = str(tmp_path / "dead_letters.jsonl")
+    journal = start_journal(journal_path, schema_file)
+    committed = register_journal_file(journal_path, journal, "nodes", input_file)
+    assert load(journal_path, committed, queries, dead_letter_path, fail_pattern="poison") == 39
+    assert count_dead_letters(dead_letter_path) == {"nodes": 1}
+
+    journal = load_journal(journal_path, schema_file)
+    assert journal["nodes"]["committed"] == [[0, 40]]
+
+
+def test_resume_refuses_changed_inputs(files):
+    journal_path, schema_file, input_file = files
+    journal = start_journal(journal_path, schema_file, chunk_size=50)
+    register_journal_file(journal_path, journal, "nodes", input_file)
+    with pytest.raises(ValueError, match="chunk_size"):
+        load_journal(journal_path, schema_file, chunk_size=100)
+    with open(input_file, "a") as f:
+        f.write("2\n")
+    with pytest.raises(ValueError, match="changed since the checkpoint"):
+        register_journal_file(journal_path, load_journal(journal_path, schema_file, chunk_size=50), "nodes", input_file)
+    with open(schema_file, "a") as f:
+        f.write("person sub entity;\n")
+    with pytest.raises(ValueError, match="changed since the checkpoint"):
+        load_journal(journal_path, schema_file, chunk_size=50)
@@ -0,0 +1,50 @@
+from functools import partial
+
+import pytest
+from fake_typedb import FakeTypeDBClient
+
+from typedb_data_offshoreleaks.migrate_helpers import LoaderPool, count_dead_letters
+
+fake_client = partial(FakeTypeDBClient, commit_latency=0.001, per_query_latency=0, fail_pattern="poison")
+
+
+def unreachable_client():
+    raise ConnectionError("no server at localhost:1729")
+
+
+def queries(n, poison=()):
+    return (f"insert $x {'poison' if i in poison else i};" for i in range(n))
+
+
+def pool(**kwargs):
+    return LoaderPool("localhost:1729", "db", num_processes=2, num_threads=2, batch_size=10, **kwargs)
+
+
+def test_failed_file_leaves_the_pool_usable(tmp_path):
+    dead_letter_path = str(tmp_path / "dead_letters.jsonl")
+    with pool(client_factory=fake_client, max_files=2) as loader:
+        with pytest.raises(RuntimeError, match="fake invalid query"):
+            loader.insert(queries(500, poison={250}))
+        # the next file takes the failed one's slot, whose queue was drained
+        loader.insert(queries(500, poison={3, 400}), dead_letter_path=dead_letter_path, source="next")
+        loader.insert(queries(500), dead_letter_path=dead_letter_path, source="last")
+    assert count_dead_letters(dead_letter_path) == {"next": 2}
+
+
+def test_process_that_cannot_connect_fails_the_load():
+    loader = pool(client_factory=unreachable_client)
+    with pytest.raises(RuntimeError, match="no server at localhost:1729"):
+        loader.insert(queries(5000))
+    with pytest.raises(RuntimeError, match="loader process"):
+        loader.close()
+
+
+def test_failure_generating_queries_is_raised_and_ends_the_file():
+    def failing_queries():
+        yield from queries(50)
+        raise ValueError("bad row")
+
+    with pool(client_factory=fake_client) as loader:
+        with pytest.raises(ValueError, match="bad row"):
+            loader.insert(failing_queries())
+        loader.insert(queries(50))
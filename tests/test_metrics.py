@@ -0,0 +1,21 @@
+from typedb_data_offshoreleaks.migrate_helpers.metrics import MigrationMetrics, format_progress, format_prometheus
+
+
+def test_progress_before_the_first_commit():
+    metrics = MigrationMetrics()
+    metrics.enable()
+    assert metrics.commit_latency_quantile(0.5) is None
+    assert "commit p50 n/a" in format_progress(metrics.snapshot(), metrics.commit_latency_quantile(0.5))
+    metrics.record_commit(10, 0.03)
+    assert "commit p50 <=0.05s" in format_progress(metrics.snapshot(), metrics.commit_latency_quantile(0.5))
+
+
+def test_unknown_queue_depth():
+    metrics = MigrationMetrics()
+    metrics.enable()
+    metrics.set_queue_depth("loader_slot_0", None)
+    snapshot = metrics.snapshot()
+    assert "queues [?]" in format_progress(snapshot)
+    assert 'queue_depth{queue="loader_slot_0"} NaN' in format_prometheus(snapshot)
+    metrics.clear_queue_depth("loader_slot_0")
+    assert metrics.snapshot()["queue_depths"] == {}
@@ -0,0 +1,65 @@
+import os
+import re
+
+import pandas as pd
+
+from typedb_data_offshoreleaks.migrate_helpers import (
+    render_relation_delete_queries,
+    render_typed_relation_queries
+    )
+
+path_schema = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "offshoreleaks_schema.tql")
+
+
+def schema_supertypes():
+    '''@usage dict of each type defined in the schema to its supertype'''
+    with open(path_schema) as f:
+        return dict(re.findall(r"^\s*(\w+) sub (\w+)", f.read(), re.MULTILINE))
+
+
+def is_type_or_subtype(
+    thing_type,
+    of_type,
+    supertypes
+    ):
+    while thing_type is not None:
+        if thing_type == of_type:
+            return True
+        thing_type = supertypes.get(thing_type)
+    return False
+
+
+def deleted_relations(
+    query,
+    relations,
+    supertypes
+    ):
+    '''
+    @usage the relations a relation match-delete query would delete, matched by type as TypeDB does:
+        "isa" matches the type and its subtypes, "isa!" only the type itself
+    @param relations: list of (relation type, _start id, _end id) tuples
+    @return list of the deleted relation tuples
+    '''
+    isa, relation_type = re.search(r"\$rel \(.*?\) (isa!?) (\w+);", query).groups()
+    assert re.search(rf"delete \$rel {isa} {relation_type}; $", query)
+    start = re.search(r"\$start has id '([^']*)'", query).group(1)
+    end = re.search(r"\$end has id '([^']*)'", query).group(1)
+    return [
+        relation for relation in relations
+        if relation[1:] == (start, end)
+        and (relation[0] == relation_type if isa == "isa!" else is_type_or_subtype(relation[0], relation_type, supertypes))
+        ]
+
+
+def test_relation_delete_leaves_subtype_relations_between_the_same_nodes():
+    supertypes = schema_supertypes()
+    assert supertypes["same_name_as"] == "same_as"
+    relations = [("same_as", "1", "2"), ("same_name_as", "1", "2"), ("same_id_as", "1", "2"), ("same_as", "1", "3")]
+    id_type_index = pd.Series(["officer", "officer", "officer"], index=["1", "2", "3"], dtype="category")
+    df = pd.DataFrame({"_start": ["1"], "_end": ["2"]})
+    queries = list(render_typed_relation_queries(
+        df, "same_as", [], {"id": "STRING"}, "is_same_as", "is_same_as", id_type_index,
+        templates={}, render=render_relation_delete_queries
+        ))
+    assert len(queries) == 1
+    assert deleted_relations(queries[0], relations, supertypes) == [("same_as", "1", "2")]
@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+from typedb_data_offshoreleaks.migrate_helpers import prefetch, run_dependency_schedule
+
+
+class ProducerTracker:
+    '''@usage prepare functions whose prefetch producers record which of them are running'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.live = set()
+        self.peak = 0
+        self.started = []
+
+    def generate(self, name, n):
+        with self.lock:
+            self.live.add(name)
+            self.started.append(name)
+            self.peak = max(self.peak, len(self.live))
+        try:
+            yield from range(n)
+        finally:
+            with self.lock:
+                self.live.discard(name)
+
+    def prepare(self, names, n=20000):
+        return {name: (lambda name=name: prefetch(self.generate(name, n), buffer_size=10, name=name)) for name in names}
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition() and time.time() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def consume(items):
+    time.sleep(0.02)
+    return sum(1 for _ in items)
+
+
+def test_runs_tasks_after_their_dependencies():
+    finished = []
+    lock = threading.Lock()
+
+    def task(name):
+        def run():
+            time.sleep(0.01)
+            with lock:
+                finished.append(name)
+        return run
+
+    names = ["a", "b", "c", "r1", "r2"]
+    run_dependency_schedule({name: task(name) for name in names}, {"r1": {"a", "b"}, "r2": {"r1", "c"}}, max_workers=2)
+    assert sorted(finished) == sorted(names)
+    assert finished.index("r1") > max(finished.index("a"), finished.index("b"))
+    assert finished.index("r2") > max(finished.index("r1"), finished.index("c"))
+
+
+def test_prepares_no_more_tasks_than_workers():
+    tracker = ProducerTracker()
+    names = ["a", "b", "c", "d", "e", "r1", "r2"]
+    run_dependency_schedule(
+        {name: consume for name in names},
+        {"r1": {"a", "b"}, "r2": {"c"}},
+        max_workers=2,
+        prepare=tracker.prepare(names)
+        )
+    assert sorted(tracker.started) == sorted(names)
+    assert tracker.peak <= 2
+
+
+def test_failure_stops_the_producers_of_prepared_tasks():
+    tracker = ProducerTracker()
+
+    def fail(items):
+        raise RuntimeError("write failed")
+
+    def slow(items):
+        time.sleep(0.2)
+        next(items)
+
+    # b is prepared while a fails, and its successor c is prepared ahead but never runs
+    with pytest.raises(RuntimeError, match="write failed"):
+        run_dependency_schedule(
+            {"a": fail, "b": slow, "c": consume},
+            {"c": {"b"}},
+            max_workers=3,
+            prepare=tracker.prepare(["a", "b", "c"])
+            )
+    assert "c" in tracker.started
+    assert wait_until(lambda: not tracker.live), f"producers still running: {tracker.live}"
+
+
+def test_closing_an_unstarted_prefetch_stops_its_producer():
+    tracker = ProducerTracker()
+    items = prefetch(tracker.generate("a", 100000), buffer_size=10)
+    assert wait_until(lambda: tracker.live)
+    items.close()
+    assert wait_until(lambda: not tracker.live)
+    assert list(items) == []
+
+
+def test_prefetch_raises_the_producer_error():
+    def generate():
+        yield 1
+        raise ValueError("bad row")
+
+    items = prefetch(generate())
+    assert next(items) == 1
+    with pytest.raises(ValueError, match="bad row"):
+        next(items)
+
+
+def test_circular_dependencies():
+    with pytest.raises(ValueError, match="circular"):
+        run_dependency_schedule({"a": lambda: None, "b": lambda: None}, {"a": {"b"}, "b": {"a"}})
@@ -0,0 +1,2 @@
+from .builder import *
+from .snapshot import *
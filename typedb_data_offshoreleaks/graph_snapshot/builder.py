@@ -0,0 +1,144 @@
+import json
+import os
+import time
+
+import numpy as np
+
+from ..migrate_helpers.metrics import metrics
+from ..migrate_helpers.migrate_helpers import read_table_chunks
+
+snapshot_arrays = ["node_ids", "node_types", "indptr", "indices", "edge_types", "edge_outgoing"]
+
+
+def save_array(
+    dir_out,
+    name,
+    array
+    ):
+    '''@usage write an array as dir_out/name.npy, whole or not at all'''
+    path = os.path.join(dir_out, name + ".npy")
+    with open(path + ".tmp", "wb") as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def canonical_integers(ids):
+    '''@usage mask of the id strings that are integers written without leading zeros, which survive a round trip through int64'''
+    return np.char.isdigit(ids) & ((np.char.str_len(ids) == 1) | ~np.char.startswith(ids, "0")) & (np.char.str_len(ids) < 19)
+
+
+def sorted_node_ids(ids):
+    '''
+    @usage sort node ids for lookup by binary search: as int64 if all are integers, as in the ICIJ data, else as bytes
+    @param ids: array-like of id strings
+    @return sorted numpy array of unique ids
+    '''
+    ids = np.unique(np.asarray(ids, dtype=str))
+    if ids.size and canonical_integers(ids).all():
+        return np.unique(ids.astype(np.int64))
+    return ids.astype(np.bytes_)
+
+
+def lookup_node_indices(
+    node_ids,
+    ids
+    ):
+    '''
+    @usage index of each id within the sorted node_ids, or -1 if it is not a node
+    @param node_ids: sorted numpy array of ids, from sorted_node_ids
+    @param ids: array-like of id strings
+    @return numpy int32 array
+    '''
+    ids = np.asarray(ids, dtype=str)
+    if node_ids.dtype.kind == "i":
+        numeric = canonical_integers(ids)
+        keys = np.zeros(ids.size, dtype=np.int64)
+        keys[numeric] = ids[numeric].astype(np.int64)
+    else:
+        numeric = np.ones(ids.size, dtype=bool)
+        keys = ids.astype(node_ids.dtype)
+    positions = np.searchsorted(node_ids, keys).clip(0, max(node_ids.size - 1, 0))
+    found = numeric & (node_ids.size > 0) & (node_ids[positions] == keys)
+    return np.where(found, positions, -1).astype(np.int32)
+
+
+def build_graph_snapshot(
+    id_type_index,
+    relation_sources,
+    relation_types,
+    dir_out,
+    chunksize=50000
+    ):
+    '''
+    @usage write the graph of the preprocessed files as a compressed sparse row (CSR) adjacency of numpy arrays,
+        which GraphSnapshot memory-maps for traversals without a server. Every relation is stored as an edge
+        in both directions, each flagged whether it leaves its node from _start, so traversals may follow
+        relations either way. Relations with an end that is not a node of the entity files are left out.
+    @param id_type_index: pandas.Series of entity types indexed by node id, from build_id_type_index
+    @param relation_sources: list of (path to relation csv file or its columnar cache, relation type) tuples
+    @param relation_types: list of relation type labels, whose positions are the edge type codes, e.g. sorted(dict_rel_roles)
+    @param dir_out: snapshot directory
+    @param chunksize: integer, number of relation rows to read at a time
+    @return snapshot metadata dict
+    '''
+    os.makedirs(dir_out, exist_ok=True)
+    meta_path = os.path.join(dir_out, "snapshot.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    node_ids = sorted_node_ids(id_type_index.index)
+    node_type_labels = sorted(id_type_index.cat.categories)
+    node_type_dtype = np.min_scalar_type(len(node_type_labels))
+    dict_type_code = {label: code for code, label in enumerate(node_type_labels)}
+    node_types = np.zeros(node_ids.size, dtype=node_type_dtype)
+    positions = lookup_node_indices(node_ids, id_type_index.index)
+    node_types[positions] = id_type_index.astype(str).map(dict_type_code).to_numpy(dtype=node_type_dtype)
+    edge_type_dtype = np.min_scalar_type(len(relation_types))
+    list_starts, list_ends, list_types = [], [], []
+    dropped = 0
+    for path, relation_type in relation_sources:
+        if relation_type not in relation_types:
+            raise ValueError(f"relation type {relation_type} of {path} is not in the schema")
+        code = relation_types.index(relation_type)
+        for df in read_table_chunks(path, dtype={"_start": str, "_end": str}, chunksize=chunksize, usecols=["_start", "_end"]):
+            with metrics.stage("snapshot_lookup"):
+                starts = lookup_node_indices(node_ids, df["_start"].fillna(""))
+                ends = lookup_node_indices(node_ids, df["_end"].fillna(""))
+            found = (starts >= 0) & (ends >= 0)
+            dropped += int((~found).sum())
+            list_starts.append(starts[found])
+            list_ends.append(ends[found])
+            list_types.append(np.full(int(found.sum()), code, dtype=edge_type_dtype))
+        print(f"read {relation_type} relations from {path}")
+    starts = np.concatenate(list_starts) if list_starts else np.zeros(0, dtype=np.int32)
+    ends = np.concatenate(list_ends) if list_ends else np.zeros(0, dtype=np.int32)
+    types = np.concatenate(list_types) if list_types else np.zeros(0, dtype=edge_type_dtype)
+    # both directions of every relation, sorted by the node they leave from
+    sources = np.concatenate([starts, ends])
+    order = np.argsort(sources, kind="stable")
+    indptr = np.zeros(node_ids.size + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=node_ids.size), out=indptr[1:])
+    arrays = {
+        "node_ids": node_ids,
+        "node_types": node_types,
+        "indptr": indptr,
+        "indices": np.concatenate([ends, starts])[order],
+        "edge_types": np.concatenate([types, types])[order],
+        "edge_outgoing": np.concatenate([np.ones(starts.size, dtype=bool), np.zeros(ends.size, dtype=bool)])[order]
+        }
+    for name in snapshot_arrays:
+        save_array(dir_out, name, arrays[name])
+    meta = {
+        "nodes": int(node_ids.size),
+        "relations": int(starts.size),
+        "dropped_relations": dropped,
+        "node_type_labels": node_type_labels,
+        "edge_type_labels": list(relation_types),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+    # written last, so that a snapshot interrupted while writing its arrays is not loaded
+    with open(meta_path + ".tmp", "w") as f:
+        json.dump(meta, f, indent=1)
+    os.replace(meta_path + ".tmp", meta_path)
+    print(f"snapshot of {meta['nodes']} nodes and {meta['relations']} relations written to {dir_out}; "
+          f"left out {dropped} relations with an end that is not a node")
+    return meta
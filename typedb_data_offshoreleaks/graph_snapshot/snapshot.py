@@ -0,0 +1,278 @@
+import json
+import os
+
+import numpy as np
+
+from .builder import lookup_node_indices, snapshot_arrays
+
+
+def gather_edges(
+    indptr,
+    nodes
+    ):
+    '''
+    @usage positions in the edge arrays of all edges leaving the given nodes, without a python loop over them
+    @param indptr: CSR row pointer array
+    @param nodes: numpy array of node indices
+    @return (edge positions, node index each edge leaves from) tuple of numpy arrays
+    '''
+    starts = indptr[nodes]
+    counts = indptr[nodes + 1] - starts
+    offsets = np.cumsum(counts) - counts
+    positions = np.arange(counts.sum(), dtype=np.int64) - np.repeat(offsets, counts) + np.repeat(starts, counts)
+    return positions, np.repeat(nodes, counts)
+
+
+class GraphSnapshot:
+    '''
+    @usage offline traversals of the graph snapshot written by build_graph_snapshot: neighbourhoods,
+        k-hop expansion, shortest paths, connected components and degrees.
+        The arrays are memory-mapped, so opening a snapshot is instant and only the pages a traversal touches are read.
+        Functions take and return node ids as strings; relation_types narrows the relations followed
+        to a list of relation type labels, and direction to those leaving a node from "_start" ("out") or "_end" ("in")
+    '''
+
+    def __init__(
+        self,
+        dir_in="data/snapshot"
+        ):
+        '''
+        @param dir_in: snapshot directory
+        '''
+        meta_path = os.path.join(dir_in, "snapshot.json")
+        if not os.path.exists(meta_path):
+            raise FileNotFoundError(f"no graph snapshot at {dir_in}; build one with migrator.py --snapshot {dir_in}")
+        with open(meta_path) as f:
+            self.meta = json.load(f)
+        for name in snapshot_arrays:
+            setattr(self, name, np.load(os.path.join(dir_in, name + ".npy"), mmap_mode="r"))
+        self.node_type_labels = self.meta["node_type_labels"]
+        self.edge_type_labels = self.meta["edge_type_labels"]
+        self.components = None
+
+    def node_indices(self, ids):
+        '''@usage index of each node id, -1 for ids that are not nodes'''
+        return lookup_node_indices(self.node_ids, [ids] if isinstance(ids, str) else list(ids))
+
+    def node_id(self, index):
+        '''@usage id of the node at an index, as a string'''
+        node_id = self.node_ids[index]
+        return node_id.decode() if isinstance(node_id, bytes) else str(node_id)
+
+    def node_type(self, index):
+        return self.node_type_labels[self.node_types[index]]
+
+    def check_nodes(self, ids):
+        '''@usage node indices of ids, raising for any that is not a node'''
+        indices = self.node_indices(ids)
+        if (indices < 0).any():
+            missing = [node_id for node_id, index in zip([ids] if isinstance(ids, str) else ids, indices) if index < 0]
+            raise KeyError(f"not in the snapshot: {missing[:10]}")
+        return indices
+
+    def edge_mask(
+        self,
+        positions,
+        relation_types=None,
+        direction="both"
+        ):
+        '''@usage which of the edges at positions are of relation_types and direction'''
+        mask = np.ones(positions.size, dtype=bool)
+        if relation_types is not None:
+            codes = [self.edge_type_labels.index(relation_type) for relation_type in relation_types]
+            mask &= np.isin(self.edge_types[positions], codes)
+        if direction == "out":
+            mask &= self.edge_outgoing[positions]
+        elif direction == "in":
+            mask &= ~self.edge_outgoing[positions]
+        elif direction != "both":
+            raise ValueError(f"direction must be out, in or both, not {direction}")
+        return mask
+
+    def expand_frontier(
+        self,
+        frontier,
+        relation_types=None,
+        direction="both"
+        ):
+        '''@usage (neighbour, node it was reached from) index arrays of every edge leaving the frontier'''
+        positions, sources = gather_edges(self.indptr, frontier)
+        mask = self.edge_mask(positions, relation_types, direction)
+        return self.indices[positions[mask]], sources[mask]
+
+    def neighbours(
+        self,
+        node_id,
+        relation_types=None,
+        direction="both"
+        ):
+        '''
+        @usage the relations of one node
+        @param node_id: id
+        @return list of {"id": .., "type": .., "relation": .., "outgoing": whether node_id is the relation's _start}
+        '''
+        positions, _ = gather_edges(self.indptr, self.check_nodes(node_id))
+        positions = positions[self.edge_mask(positions, relation_types, direction)]
+        return [
+            {
+                "id": self.node_id(neighbour),
+                "type": self.node_type(neighbour),
+                "relation": self.edge_type_labels[edge_type],
+                "outgoing": bool(outgoing)
+                }
+            for neighbour, edge_type, outgoing in zip(self.indices[positions], self.edge_types[positions], self.edge_outgoing[positions])
+            ]
+
+    def k_hop(
+        self,
+        ids,
+        k=2,
+        relation_types=None,
+        direction="both",
+        max_nodes=None
+        ):
+        '''
+        @usage the nodes within k relations of the given nodes, breadth first, one vectorised step per hop
+        @param ids: id or list of ids
+        @param k: integer, number of hops
+        @param max_nodes: integer, stop expanding once this many nodes are reached
+        @return dict of id to the number of hops it was first reached in, the given nodes included at 0
+        '''
+        hops = np.full(self.node_ids.size, -1, dtype=np.int16)
+        frontier = np.unique(self.check_nodes(ids))
+        hops[frontier] = 0
+        reached = frontier.size
+        for hop in range(1, k + 1):
+            if not frontier.size or (max_nodes and reached >= max_nodes):
+                break
+            neighbours, _ = self.expand_frontier(frontier, relation_types, direction)
+            frontier = np.unique(neighbours[hops[neighbours] < 0])
+            if max_nodes:
+                frontier = frontier[:max_nodes - reached]
+            hops[frontier] = hop
+            reached += frontier.size
+        indices = np.flatnonzero(hops >= 0)
+        return {self.node_id(index): int(hops[index]) for index in indices}
+
+    def shortest_path(
+        self,
+        source_id,
+        target_id,
+        relation_types=None,
+        direction="both",
+        max_hops=None
+        ):
+        '''
+        @usage a shortest path between two nodes, by breadth-first search from source_id
+        @param source_id: id to start from
+        @param target_id: id to reach
+        @param max_hops: integer, give up beyond this many hops
+        @return list of ids from source_id to target_id, or None if there is no path
+        '''
+        source, target = self.check_nodes([source_id, target_id])
+        parents = np.full(self.node_ids.size, -1, dtype=np.int32)
+        parents[source] = source
+        frontier = np.array([source], dtype=np.int32)
+        hop = 0
+        while frontier.size and parents[target] < 0 and (max_hops is None or hop < max_hops):
+            neighbours, sources = self.expand_frontier(frontier, relation_types, direction)
+            new = parents[neighbours] < 0
+            frontier, first = np.unique(neighbours[new], return_index=True)
+            parents[frontier] = sources[new][first]
+            hop += 1
+        if parents[target] < 0:
+            return None
+        path = [target]
+        while path[-1] != source:
+            path.append(parents[path[-1]])
+        return [self.node_id(index) for index in reversed(path)]
+
+    def component_labels(self, relation_types=None):
+        '''
+        @usage label every node with its connected component, following relations either way,
+            by propagating the smallest label over the edges and shortcutting labels to labels of labels,
+            which takes a few passes over the edge arrays. The labels over all relations are kept for later calls
+        @param relation_types: list of relation type labels to connect nodes by; by default all
+        @return numpy int32 array of component labels, by node index: the index of a node of the component
+        '''
+        if relation_types is None and self.components is not None:
+            return self.components
+        sources = np.repeat(np.arange(self.node_ids.size, dtype=np.int32), np.diff(self.indptr))
+        targets = np.asarray(self.indices)
+        if relation_types is not None:
+            mask = self.edge_mask(np.arange(targets.size), relation_types)
+            sources, targets = sources[mask], targets[mask]
+        # sources are sorted, so each node's edges are one run for reduceat
+        runs = np.flatnonzero(np.r_[True, sources[1:] != sources[:-1]]) if sources.size else np.zeros(0, dtype=np.int64)
+        nodes = sources[runs]
+        labels = np.arange(self.node_ids.size, dtype=np.int32)
+        while True:
+            new_labels = labels.copy()
+            if runs.size:
+                new_labels[nodes] = np.minimum(labels[nodes], np.minimum.reduceat(labels[targets], runs))
+            while True:
+                jumped = new_labels[new_labels]
+                if np.array_equal(jumped, new_labels):
+                    break
+                new_labels = jumped
+            if np.array_equal(new_labels, labels):
+                break
+            labels = new_labels
+        if relation_types is None:
+            self.components = labels
+        return labels
+
+    def component(
+        self,
+        node_id,
+        relation_types=None
+        ):
+        '''@usage ids of the nodes in the connected component of a node'''
+        labels = self.component_labels(relation_types)
+        return [self.node_id(index) for index in np.flatnonzero(labels == labels[self.check_nodes(node_id)[0]])]
+
+    def largest_components(
+        self,
+        n=10,
+        relation_types=None
+        ):
+        '''
+        @usage the largest connected components
+        @param n: integer, number of components
+        @return list of (id of a node of the component, number of nodes) tuples, largest first
+        '''
+        labels, sizes = np.unique(self.component_labels(relation_types), return_counts=True)
+        order = np.argsort(-sizes, kind="stable")[:n]
+        return [(self.node_id(labels[i]), int(sizes[i])) for i in order]
+
+    def degrees(
+        self,
+        relation_types=None,
+        direction="both"
+        ):
+        '''@usage number of relations of every node, by node index'''
+        if relation_types is None and direction == "both":
+            return np.diff(self.indptr)
+        sources = np.repeat(np.arange(self.node_ids.size, dtype=np.int32), np.diff(self.indptr))
+        mask = self.edge_mask(np.arange(sources.size), relation_types, direction)
+        return np.bincount(sources[mask], minlength=self.node_ids.size)
+
+    def top_degree(
+        self,
+        n=10,
+        node_type=None,
+        relation_types=None,
+        direction="both"
+        ):
+        '''
+        @usage rank nodes by their number of relations
+        @param n: integer, number of nodes
+        @param node_type: optional entity type to rank, e.g. officer
+        @return list of (id, type, degree) tuples, highest degree first
+        '''
+        degrees = self.degrees(relation_types, direction)
+        candidates = np.arange(self.node_ids.size)
+        if node_type is not None:
+            candidates = np.flatnonzero(np.asarray(self.node_types) == self.node_type_labels.index(node_type))
+        top = candidates[np.argsort(-degrees[candidates], kind="stable")[:n]]
+        return [(self.node_id(index), self.node_type(index), int(degrees[index])) for index in top]
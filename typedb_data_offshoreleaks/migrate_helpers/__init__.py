@@ -1 +1,13 @@
-from .migrate_helpers import *
\ No newline at end of file
+from .migrate_helpers import *
+from .multiprocess_loader import *
+from .journal import *
+from .batch_control import *
+from .scheduler import *
+from .query_builder import *
+from .metrics import *
+from .cache import *
+from .inferred_relations import *
+from .delta import *
+from .dead_letters import *
+from .query_export import *
+from .attribute_values import *
@@ -0,0 +1,157 @@
+import json
+import os
+import re
+from collections import Counter
+
+import pandas as pd
+
+from .metrics import metrics
+from .migrate_helpers import read_table_chunks
+from .query_builder import format_values, missing_mask
+
+pattern_rm_underscore_prefix = re.compile("^_")
+
+
+def collect_attribute_values(
+    sources,
+    dict_attr_valuetype,
+    max_values=50000,
+    min_uses=2,
+    chunksize=50000
+    ):
+    '''
+    @usage find the attribute values that many rows share, such as countries, jurisdictions, statuses and dates,
+        to insert before the entities and relations, see write_attribute_values and render_attribute_queries.
+        Writers then attach existing attributes instead of racing each other to insert the same ones,
+        which TypeDB fails as write conflicts. Values are compared as the TypeQL literals the insert queries render.
+    @param sources: list of (path to csv file or its columnar cache, dict of column to dtype) tuples
+    @param dict_attr_valuetype: attribute valuetype
+    @param max_values: integer, attributes with more distinct values than this are left out, e.g. names and ids
+    @param min_uses: integer, least number of rows a value must occur in to be inserted up front
+    @param chunksize: integer, number of rows to read at a time
+    @return DataFrame with columns attribute, and value as a TypeQL literal
+    '''
+    dict_attr_counts = {}
+    too_many = set()
+    for path, dtype in sources:
+        dict_column_attr = {
+            column: re.sub(pattern_rm_underscore_prefix, "", column) for column in dtype
+            if re.sub(pattern_rm_underscore_prefix, "", column) in dict_attr_valuetype
+            }
+        dict_column_attr = {column: attr for column, attr in dict_column_attr.items() if attr not in too_many}
+        if not dict_column_attr:
+            continue
+        usecols = list(dict_column_attr)
+        for df in read_table_chunks(path, dtype={column: dtype[column] for column in usecols}, chunksize=chunksize, usecols=usecols):
+            for column, attr in dict_column_attr.items():
+                if attr in too_many:
+                    continue
+                series = df[column][~missing_mask(df[column])]
+                counts = dict_attr_counts.setdefault(attr, Counter())
+                counts.update(format_values(series, dict_attr_valuetype[attr]).value_counts().to_dict())
+                if len(counts) > max_values:
+                    too_many.add(attr)
+                    del dict_attr_counts[attr]
+    rows = [
+        (attr, value)
+        for attr, counts in sorted(dict_attr_counts.items())
+        for value, count in sorted(counts.items())
+        if count >= min_uses
+        ]
+    df_values = pd.DataFrame(rows, columns=["attribute", "value"])
+    print(f"found {df_values.shape[0]} shared values of {df_values['attribute'].nunique()} attributes; "
+          f"left out {len(too_many)} attributes with over {max_values} distinct values")
+    return df_values
+
+
+def attribute_values_metadata(
+    paths,
+    schema_sha256,
+    max_values,
+    min_uses
+    ):
+    '''
+    @usage what collect_attribute_values was run on: each input file's size and modification time,
+        the schema hash and the thresholds, for load_attribute_values to tell whether its result is still current
+    @param paths: list of the paths collect_attribute_values read, csv files or their columnar cache
+    @param schema_sha256: hash of the schema the value types were taken from
+    @param max_values: integer, as passed to collect_attribute_values
+    @param min_uses: integer, as passed to collect_attribute_values
+    @return dict, which survives a round trip through json
+    '''
+    files = {}
+    for path in paths:
+        stat = os.stat(path)
+        files[path] = [stat.st_size, stat.st_mtime_ns]
+    return {"files": files, "schema_sha256": schema_sha256, "max_values": max_values, "min_uses": min_uses}
+
+
+def write_attribute_values(
+    df_values,
+    dir_out,
+    metadata=None
+    ):
+    '''
+    @usage write the values from collect_attribute_values to a csv file, for stream_attribute_insert_queries
+    @param df_values: DataFrame of attribute and value
+    @param dir_out: output directory
+    @param metadata: optional dict from attribute_values_metadata, written next to the csv file for load_attribute_values
+    @return path to the written file
+    '''
+    os.makedirs(dir_out, exist_ok=True)
+    path = os.path.join(dir_out, "attribute_values.csv")
+    df_values.to_csv(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    if metadata is not None:
+        with open(path + ".json.tmp", "w") as f:
+            json.dump(metadata, f)
+        os.replace(path + ".json.tmp", re.sub(r"\.csv$", ".json", path))
+    return path
+
+
+def load_attribute_values(
+    dir_out,
+    metadata
+    ):
+    '''
+    @usage the values an earlier run wrote with write_attribute_values, if it collected them from the same files,
+        schema and thresholds, so that this run can skip reading every file before its first insert
+    @param dir_out: directory the earlier run wrote to
+    @param metadata: dict from attribute_values_metadata for this run
+    @return DataFrame of attribute and value, or None if there is none or it is out of date
+    '''
+    path = os.path.join(dir_out, "attribute_values.csv")
+    path_metadata = os.path.join(dir_out, "attribute_values.json")
+    if not (os.path.exists(path) and os.path.exists(path_metadata)):
+        return None
+    with open(path_metadata) as f:
+        if json.load(f) != metadata:
+            return None
+    df_values = pd.read_csv(path, dtype=str, keep_default_na=False)
+    print(f"reusing {df_values.shape[0]} shared values of {df_values['attribute'].nunique()} attributes from {path}")
+    return df_values
+
+
+def render_attribute_queries(df):
+    '''
+    @usage render one insert query per attribute value
+    @param df: data table with columns attribute, and value as a TypeQL literal
+    @return list of TypeQL insert queries
+    '''
+    return ("insert $a " + df["value"] + " isa " + df["attribute"] + ";").tolist()
+
+
+def stream_attribute_insert_queries(
+    path,
+    chunksize=50000
+    ):
+    '''
+    @usage read the file written by collect_attribute_values in chunks and render its insert queries
+    @param path: path to csv file
+    @param chunksize: integer, number of rows per chunk
+    @return an iterator that yields TypeQL insert queries
+    '''
+    for df in read_table_chunks(path, dtype=str, chunksize=chunksize):
+        with metrics.stage("query_build"):
+            queries = render_attribute_queries(df)
+        yield from queries
@@ -0,0 +1,141 @@
+import random
+import re
+import threading
+import time
+
+from .metrics import metrics
+
+# TypeDB reports write-write conflicts between concurrent transactions at commit
+pattern_conflict = re.compile("conflict", re.IGNORECASE)
+
+
+class AdaptiveBatchSize:
+    '''
+    @usage per-writer batch size controller. Grows the batch size while commits are fast,
+        shrinks it when a commit is slower than target_latency or fails, always within [minimum, maximum].
+        With minimum == maximum the batch size is fixed.
+    @param initial: integer, starting batch size
+    @param minimum: integer, smallest batch size
+    @param maximum: integer, largest batch size
+    @param target_latency: seconds per commit to aim for
+    '''
+    grow = 1.25
+    shrink_slow = 0.8
+    shrink_failed = 0.5
+
+    def __init__(self, initial, minimum, maximum, target_latency=2.0):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.size = min(max(initial, minimum), maximum)
+
+    def update(self, latency, failed=False):
+        '''
+        @usage adjust the batch size after a commit attempt
+        @param latency: seconds the commit attempt took
+        @param failed: whether the commit failed
+        @return the new batch size
+        '''
+        if failed:
+            size = self.size * self.shrink_failed
+        elif latency > self.target_latency:
+            size = self.size * self.shrink_slow
+        elif latency < self.target_latency / 2:
+            size = max(self.size * self.grow, self.size + 1)
+        else:
+            size = self.size
+        self.size = min(max(int(size), self.minimum), self.maximum)
+        return self.size
+
+
+def is_conflict_error(
+    exception
+    ):
+    '''
+    @usage whether a failed transaction lost a write conflict, and so may succeed on retry
+    @param exception: exception raised by the transaction
+    @return boolean
+    '''
+    return bool(pattern_conflict.search(str(exception)))
+
+
+def retry_backoff(
+    attempt,
+    backoff=0.5,
+    max_backoff=30
+    ):
+    '''
+    @usage exponential backoff with full jitter, so that conflicting writers do not retry in lockstep
+    @param attempt: integer, 0 for the first retry
+    @param backoff: seconds, base delay
+    @param max_backoff: seconds, largest delay
+    @return seconds to wait
+    '''
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
+
+def locked_next(
+    iterator
+    ):
+    '''
+    @usage make an iterator safe to share between threads
+    @param iterator: any iterator, e.g. a generator
+    @return function that returns the next item, or None once the iterator is exhausted
+    '''
+    lock = threading.Lock()
+
+    def next_item():
+        with lock:
+            return next(iterator, None)
+
+    return next_item
+
+
+def write_batch_with_retry(
+    session,
+    batch,
+    write_batch,
+    controller,
+    max_retries=5,
+    backoff=0.5,
+    dead_letter=None
+    ):
+    '''
+    @usage write one batch, retrying with backoff if the transaction fails on a write conflict,
+        and report each attempt's commit latency to the batch size controller.
+        With dead_letter, a batch that fails for any other reason is bisected and each half written on its own,
+        down to the single queries that fail, which are handed to dead_letter instead of failing the load
+    @param session: a typedb data write session
+    @param batch: a list of queries, in whatever form write_batch takes
+    @param write_batch: function(session, batch) that writes and commits a batch
+    @param controller: AdaptiveBatchSize
+    @param max_retries: integer, number of retries after a conflict before giving up
+    @param backoff: seconds, base delay between retries
+    @param dead_letter: optional function(item, exception) that records a query of the batch that failed on its own
+    @return None
+    '''
+    for attempt in range(max_retries + 1):
+        start_time = time.time()
+        try:
+            write_batch(session, batch)
+        except Exception as e:
+            controller.update(time.time() - start_time, failed=True)
+            if attempt < max_retries and is_conflict_error(e):
+                metrics.record_retry()
+                time.sleep(retry_backoff(attempt, backoff))
+                continue
+            if dead_letter is None:
+                metrics.record_failure()
+                raise
+            if len(batch) == 1:
+                dead_letter(batch[0], e)
+                return
+            half = len(batch) // 2
+            for part in (batch[:half], batch[half:]):
+                write_batch_with_retry(session, part, write_batch, controller, max_retries, backoff, dead_letter)
+            return
+        else:
+            latency = time.time() - start_time
+            controller.update(latency)
+            metrics.record_commit(len(batch), latency)
+            return
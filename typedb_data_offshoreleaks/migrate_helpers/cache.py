@@ -0,0 +1,208 @@
+import json
+import os
+import re
+
+import pandas as pd
+
+from .journal import file_sha256
+from .metrics import metrics
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:
+    # the columnar cache is optional; everything else reads the csv files
+    pa = ipc = None
+
+pattern_rm_underscore_prefix = re.compile("^_")
+
+
+def schema_cache_path(
+    cache_dir,
+    schema_file
+    ):
+    '''@usage path of the cached introspection of a schema file, keyed by the hash of its content'''
+    return os.path.join(cache_dir, f"schema_{file_sha256(schema_file)}.json")
+
+
+def save_schema_cache(
+    cache_dir,
+    schema_file,
+    dict_attr_valuetype,
+    dict_rel_roles,
+    dict_role_players,
+    key_attributes
+    ):
+    '''
+    @usage store the attribute value types, relation roles, role players and key attributes introspected from the database
+    @param cache_dir: cache directory
+    @param schema_file: path to the TypeQL schema they were introspected after defining
+    @param dict_attr_valuetype: dict of attribute type to value type
+    @param dict_rel_roles: dict of relation type to list of its roles
+    @param dict_role_players: dict of (relation type, role) to set of entity types that play it
+    @param key_attributes: set of attribute types owned as @key
+    @return None
+    '''
+    os.makedirs(cache_dir, exist_ok=True)
+    path = schema_cache_path(cache_dir, schema_file)
+    with open(path + ".tmp", "w") as f:
+        json.dump({
+            "attr_valuetype": dict_attr_valuetype,
+            "rel_roles": dict_rel_roles,
+            "role_players": [[reltype, role, sorted(players)] for (reltype, role), players in dict_role_players.items()],
+            "key_attributes": sorted(key_attributes)
+            }, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+
+def load_schema_cache(
+    cache_dir,
+    schema_file
+    ):
+    '''
+    @usage the schema introspection cached for the current content of schema_file, if any
+    @return (dict_attr_valuetype, dict_rel_roles, dict_role_players, key_attributes) tuple, or None
+    '''
+    path = schema_cache_path(cache_dir, schema_file)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        cache = json.load(f)
+    if "key_attributes" not in cache:
+        # cached by an earlier version, which did not introspect the keys
+        return None
+    dict_role_players = {(reltype, role): set(players) for reltype, role, players in cache["role_players"]}
+    return cache["attr_valuetype"], cache["rel_roles"], dict_role_players, set(cache["key_attributes"])
+
+
+def column_dtypes(
+    path,
+    dict_attr_dtype
+    ):
+    '''
+    @usage dtype of every column of a csv file, from the value type of the attribute it maps to; str for the rest
+    @param path: path to csv file, of which only the header is read
+    @param dict_attr_dtype: dict of attribute type to python type
+    @return dict of column to python type
+    '''
+    columns = pd.read_csv(path, nrows=0).columns
+    return {column: dict_attr_dtype.get(re.sub(pattern_rm_underscore_prefix, "", column), str) for column in columns}
+
+
+def require_pyarrow():
+    if pa is None:
+        raise ImportError("the columnar cache needs pyarrow: pip install pyarrow")
+
+
+def arrow_schema(dtype):
+    '''@usage arrow schema for a dict of column to python type'''
+    dict_arrow_type = {int: pa.int64(), float: pa.float64(), bool: pa.bool_(), str: pa.string()}
+    return pa.schema([(column, dict_arrow_type[python_type]) for column, python_type in dtype.items()])
+
+
+def columnar_cache_metadata(
+    path,
+    schema_sha256
+    ):
+    '''@usage what a cached file was converted from: the source file's size and modification time, and the schema hash'''
+    stat = os.stat(path)
+    return {"source_size": str(stat.st_size), "source_mtime_ns": str(stat.st_mtime_ns), "schema_sha256": schema_sha256}
+
+
+def build_columnar_cache(
+    path,
+    cache_path,
+    dtype,
+    schema_sha256,
+    chunksize=500000
+    ):
+    '''
+    @usage convert a csv file to an uncompressed Arrow IPC file, which later runs memory-map instead of parsing the csv
+    @param path: path to csv file
+    @param cache_path: path to the Arrow file to write
+    @param dtype: dict of column to python type, from column_dtypes
+    @param schema_sha256: hash of the schema the dtypes were taken from
+    @param chunksize: integer, csv rows to convert at a time
+    @return None
+    '''
+    require_pyarrow()
+    schema = arrow_schema(dtype).with_metadata(columnar_cache_metadata(path, schema_sha256))
+    os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+    with ipc.new_file(cache_path + ".tmp", schema) as writer:
+        for df in pd.read_csv(path, dtype=dtype, chunksize=chunksize):
+            writer.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False))
+    os.replace(cache_path + ".tmp", cache_path)
+
+
+def columnar_cache_is_fresh(
+    path,
+    cache_path,
+    schema_sha256
+    ):
+    '''@usage whether cache_path was converted from the current version of path, under the current schema'''
+    if not os.path.exists(cache_path):
+        return False
+    with pa.memory_map(cache_path) as source:
+        metadata = ipc.open_file(source).schema.metadata or {}
+    return {key.decode(): value.decode() for key, value in metadata.items()} == columnar_cache_metadata(path, schema_sha256)
+
+
+def columnar_cache(
+    path,
+    cache_dir,
+    key,
+    dtype,
+    schema_sha256
+    ):
+    '''
+    @usage path to the columnar copy of a csv file, converting the file first if it has no fresh copy yet
+    @param path: path to csv file
+    @param cache_dir: cache directory
+    @param key: string identifying the file, e.g. entities/nodes-officers_clean_formatted.csv
+    @param dtype: dict of column to python type, from column_dtypes
+    @param schema_sha256: hash of the schema the dtypes were taken from
+    @return path to Arrow IPC file
+    '''
+    require_pyarrow()
+    cache_path = os.path.join(cache_dir, "columnar", re.sub(r"\.csv$", "", key) + ".arrow")
+    if not columnar_cache_is_fresh(path, cache_path, schema_sha256):
+        print(f"caching {key} in columnar format")
+        with metrics.stage("columnar_cache"):
+            build_columnar_cache(path, cache_path, dtype, schema_sha256)
+    return cache_path
+
+
+def read_columnar_chunks(
+    cache_path,
+    chunksize=None,
+    usecols=None
+    ):
+    '''
+    @usage read a columnar cache file lazily, one chunk of rows at a time, as read_csv_chunks does a csv file.
+        The file is memory-mapped; only the rows of the current chunk are converted to pandas
+    @param cache_path: path to Arrow IPC file
+    @param chunksize: integer, number of rows per chunk. If None or 0, read the whole file as one chunk
+    @param usecols: optional list of the columns to read; by default all
+    @return an iterator that yields pandas DataFrames, each with a fresh RangeIndex
+    '''
+    require_pyarrow()
+    with pa.memory_map(cache_path) as source:
+        table = ipc.open_file(source).read_all()
+        if usecols is not None:
+            table = table.select(usecols)
+        step = chunksize or max(table.num_rows, 1)
+        for offset in range(0, table.num_rows, step):
+            with metrics.stage("columnar_read"):
+                df = table.slice(offset, step).to_pandas()
+            yield df
+
+
+def read_columnar_column(
+    cache_path,
+    column
+    ):
+    '''@usage one column of a columnar cache file, as a pandas Series of strings'''
+    require_pyarrow()
+    with pa.memory_map(cache_path) as source:
+        values = ipc.open_file(source).read_all().column(column).to_pandas()
+    return values.where(values.isna(), values.astype(str))
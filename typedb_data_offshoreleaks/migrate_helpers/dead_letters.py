@@ -0,0 +1,69 @@
+import json
+import os
+import time
+from collections import Counter
+
+from .journal import append_journal_record
+from .metrics import metrics
+
+
+def record_dead_letter(
+    dead_letter_path,
+    source,
+    item,
+    error,
+    journal_path=None
+    ):
+    '''
+    @usage write a query that failed on its own to the dead-letter file, so the load can carry on without it.
+        Records are appended with one write each, so loader processes may share the file.
+    @param dead_letter_path: path to dead-letter file, json lines
+    @param source: string identifying the input, e.g. the journal key of the file the query was generated from
+    @param item: (offset, query) tuple; the offset of a query within its file is the row it was generated from
+    @param error: the exception the server raised
+    @param journal_path: optional path to journal file, in which to mark the query as dealt with, so a resumed run skips it
+    @return None
+    '''
+    offset, query = item
+    append_journal_record(dead_letter_path, {
+        "source": source,
+        "row": offset,
+        "query": query,
+        "error": str(error),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S")
+        })
+    if journal_path:
+        append_journal_record(journal_path, {"type": "dead_letter", "file": source, "ranges": [[offset, offset + 1]]})
+    metrics.record_failure()
+
+
+def count_dead_letters(
+    dead_letter_path
+    ):
+    '''
+    @usage count the dead-lettered queries per source
+    @param dead_letter_path: path to dead-letter file
+    @return collections.Counter of source to number of queries
+    '''
+    counts = Counter()
+    if os.path.exists(dead_letter_path):
+        with open(dead_letter_path) as f:
+            for line in f:
+                try:
+                    counts[json.loads(line)["source"]] += 1
+                except json.JSONDecodeError:
+                    continue
+    return counts
+
+
+def print_dead_letter_summary(
+    dead_letter_path
+    ):
+    '''@usage report how many queries failed and where they were written, if any'''
+    counts = count_dead_letters(dead_letter_path)
+    if not counts:
+        print("\nno queries failed")
+        return
+    print(f"\n{sum(counts.values())} queries failed and were written to {dead_letter_path}:")
+    for source, count in sorted(counts.items()):
+        print(f"  {source}: {count}")
@@ -0,0 +1,253 @@
+import json
+import os
+import re
+import shutil
+
+import pandas as pd
+
+from .dead_letters import count_dead_letters
+from .journal import file_sha256
+from .migrate_helpers import read_csv_chunks
+
+
+def manifest_file(
+    manifest_dir,
+    generation,
+    key
+    ):
+    '''@usage path of the fingerprints of one input file within a manifest generation'''
+    return os.path.join(manifest_dir, str(generation), re.sub(r"\.csv$", "", key) + ".csv.gz")
+
+
+def load_manifest(
+    manifest_dir,
+    schema_file
+    ):
+    '''
+    @usage read the manifest of the last load, to diff the current preprocessed files against it
+    @param manifest_dir: manifest directory
+    @param schema_file: path to the TypeQL schema, which must be unchanged since that load
+    @return manifest dict: schema hash, generation, and per input file key its hash, type and kind
+    '''
+    path = os.path.join(manifest_dir, "manifest.json")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"no manifest at {path}; load the database in full first")
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest["schema_sha256"] != file_sha256(schema_file):
+        raise ValueError(f"{schema_file} changed since the load recorded in {manifest_dir}; rerun with --force")
+    return manifest
+
+
+def commit_manifest(
+    manifest_dir,
+    manifest,
+    dead_letter_path=None
+    ):
+    '''
+    @usage make a manifest generation, whose files are already written, the current one, and remove the previous one.
+        The manifest fingerprints every row of the files, so it is not committed while any of their queries
+        are dead-lettered: the next --delta would take those rows to be in the database
+    @param manifest_dir: manifest directory
+    @param manifest: manifest dict
+    @param dead_letter_path: path to the dead-letter file of the load, if any
+    @return None
+    '''
+    if dead_letter_path:
+        n_failed = sum(count_dead_letters(dead_letter_path).values())
+        if n_failed:
+            raise RuntimeError(
+                f"{n_failed} queries failed and were written to {dead_letter_path}, so the manifest in {manifest_dir} "
+                "was left at the last load; fix the rows they came from and run --delta again"
+                )
+    path = os.path.join(manifest_dir, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(path + ".tmp", path)
+    for entry in os.listdir(manifest_dir):
+        if entry.isdigit() and int(entry) != manifest["generation"]:
+            shutil.rmtree(os.path.join(manifest_dir, entry))
+
+
+def fingerprint_rows(df):
+    '''@usage 64-bit hash of every row of a data table, over all its columns, as strings'''
+    return pd.util.hash_pandas_object(df, index=False).astype(str)
+
+
+def read_previous(
+    path,
+    dtype=None
+    ):
+    '''@usage read a manifest file, with its data columns typed as the input file was, or as strings if dtype is None'''
+    return pd.read_csv(path, dtype=str if dtype is None else dict(dtype, fingerprint=str))
+
+
+def diff_entity_file(
+    path,
+    dtype=None,
+    previous=None,
+    id_column="_id",
+    chunksize=50000,
+    keep_rows=True
+    ):
+    '''
+    @usage fingerprint every row of an entity file, by id, and compare the fingerprints with those of the last load
+    @param path: path to entity csv file
+    @param dtype: dict of column to dtype, as the file is loaded with
+    @param previous: DataFrame of id_column and fingerprint from the last load, or None if the file is new
+    @param id_column: column holding the id
+    @param chunksize: integer, number of rows to read at a time
+    @param keep_rows: if False, only fingerprint the file
+    @return (fingerprints, added rows, changed rows, removed ids) tuple
+    '''
+    if previous is None:
+        previous = pd.DataFrame({id_column: pd.Series(dtype=str), "fingerprint": pd.Series(dtype=str)})
+    previous_fingerprints = previous.drop_duplicates(id_column).set_index(id_column)["fingerprint"]
+    list_fingerprints = []
+    list_added = []
+    list_changed = []
+    for df in read_csv_chunks(path, dtype=dtype, chunksize=chunksize):
+        fingerprints = fingerprint_rows(df)
+        list_fingerprints.append(pd.DataFrame({id_column: df[id_column], "fingerprint": fingerprints}))
+        if keep_rows:
+            fingerprints_before = df[id_column].map(previous_fingerprints)
+            list_added.append(df[fingerprints_before.isna()])
+            list_changed.append(df[fingerprints_before.notna() & (fingerprints_before != fingerprints)])
+    fingerprints = pd.concat(list_fingerprints, ignore_index=True)
+    if not keep_rows:
+        return fingerprints, None, None, None
+    removed = previous[id_column][~previous[id_column].isin(fingerprints[id_column])].drop_duplicates()
+    return fingerprints, pd.concat(list_added, ignore_index=True), pd.concat(list_changed, ignore_index=True), removed
+
+
+def diff_relation_file(
+    path,
+    dtype=None,
+    previous=None,
+    chunksize=50000,
+    keep_rows=True,
+    roleplayer_columns=("_start", "_end")
+    ):
+    '''
+    @usage fingerprint every row of a relation file, by its roleplayers, type and attributes together,
+        and compare the fingerprints with those of the last load. The file is read in chunks, and only the
+        fingerprints are kept, counted, since an edge may recur, with the roleplayers of each.
+        Where a count differs, every relation of the file's type between the same roleplayers is deleted,
+        and those of the current rows between them are inserted; this takes a second pass over the file
+    @param path: path to relation csv file
+    @param dtype: dict of column to dtype, as the file is loaded with
+    @param previous: DataFrame of roleplayers, fingerprint and count from the last load, or None if the file is new
+    @param chunksize: integer, number of rows to read at a time
+    @param keep_rows: if False, only fingerprint the file
+    @param roleplayer_columns: columns holding the ids of the roleplayers
+    @return (fingerprints with roleplayers and counts, roleplayers to delete the relations between, rows to insert) tuple
+    '''
+    roleplayer_columns = list(roleplayer_columns)
+    group_columns = ["fingerprint"] + roleplayer_columns
+    list_counts = []
+    for df in read_csv_chunks(path, dtype=dtype, chunksize=chunksize):
+        fingerprints = df[roleplayer_columns].assign(fingerprint=fingerprint_rows(df))
+        list_counts.append(fingerprints.groupby(group_columns, sort=False, dropna=False).size().rename("count"))
+    current = pd.DataFrame(columns=group_columns + ["count"])
+    if list_counts:
+        current = pd.concat(list_counts).groupby(level=group_columns, sort=False, dropna=False).sum().reset_index()
+    current = current[group_columns + ["count"]]
+    if not keep_rows:
+        return current, None, None
+    if previous is None:
+        previous = current.iloc[:0]
+    elif "count" not in previous.columns:
+        # a manifest written before fingerprints were counted holds every row
+        previous = previous.groupby(group_columns, sort=False, dropna=False).size().rename("count").reset_index()
+    counts = pd.concat([
+        previous.groupby("fingerprint")["count"].sum().rename("previous"),
+        current.set_index("fingerprint")["count"].rename("current")
+        ], axis=1).fillna(0)
+    stale = counts.index[counts["previous"] != counts["current"]]
+    # the roleplayers of the rows about to be inserted are deleted between too, which makes rerunning an interrupted delta safe
+    deleted = pd.concat([
+        previous.loc[previous["fingerprint"].isin(stale), roleplayer_columns],
+        current.loc[current["fingerprint"].isin(stale), roleplayer_columns]
+        ]).drop_duplicates(ignore_index=True)
+    stale_pairs = pd.MultiIndex.from_frame(deleted)
+    list_inserted = []
+    if deleted.shape[0]:
+        for df in read_csv_chunks(path, dtype=dtype, chunksize=chunksize):
+            list_inserted.append(df[pd.MultiIndex.from_frame(df[roleplayer_columns]).isin(stale_pairs)])
+    inserted = pd.concat(list_inserted, ignore_index=True) if list_inserted else pd.DataFrame(columns=roleplayer_columns)
+    return current, deleted, inserted
+
+
+def diff_against_manifest(
+    manifest_dir,
+    manifest,
+    schema_file,
+    dict_key_path,
+    dict_key_type,
+    entity_keys,
+    dict_key_dtype,
+    chunksize=50000,
+    keep_rows=True
+    ):
+    '''
+    @usage diff every input file against the manifest of the last load, and write the fingerprints of the
+        current files as the manifest's next generation. Files whose hash is unchanged are not read.
+        The new generation only becomes current with commit_manifest, once the changes are written
+    @param manifest_dir: manifest directory
+    @param manifest: manifest dict from load_manifest, or None to fingerprint every file as new
+    @param schema_file: path to the TypeQL schema
+    @param dict_key_path: dict of input file key to csv path
+    @param dict_key_type: dict of input file key to the type it holds
+    @param entity_keys: keys of the entity files; the others are relation files
+    @param dict_key_dtype: dict of input file key to dict of column to dtype
+    @param chunksize: integer, number of rows to read at a time
+    @param keep_rows: if False, only fingerprint the files, e.g. after a full load
+    @return (next manifest dict, dict of input file key to the changes) tuple, only for files that changed.
+        Changes are a dict of the "type" and "kind" of the file, and DataFrames: "added", "changed" and "removed"
+        for entity files, "deleted" roleplayers and "inserted" rows for relation files
+    '''
+    previous_files = manifest["files"] if manifest else {}
+    # a new generation never reuses the directory of the current one, nor of any left by an interrupted run
+    generations = [int(entry) for entry in os.listdir(manifest_dir) if entry.isdigit()] if os.path.isdir(manifest_dir) else []
+    generation = max(generations, default=-1) + 1
+    next_manifest = {"schema_sha256": file_sha256(schema_file), "generation": generation, "files": {}}
+    dict_key_delta = {}
+    for key, path in dict_key_path.items():
+        kind = "entity" if key in entity_keys else "relation"
+        sha256 = file_sha256(path)
+        next_manifest["files"][key] = {"sha256": sha256, "type": dict_key_type[key], "kind": kind}
+        path_out = manifest_file(manifest_dir, generation, key)
+        os.makedirs(os.path.dirname(path_out), exist_ok=True)
+        if key in previous_files and previous_files[key]["sha256"] == sha256:
+            os.link(manifest_file(manifest_dir, manifest["generation"], key), path_out)
+            continue
+        print(f"fingerprinting {key}")
+        previous = None
+        if key in previous_files:
+            previous = read_previous(manifest_file(manifest_dir, manifest["generation"], key), dict_key_dtype[key])
+        if kind == "entity":
+            fingerprints, added, changed, removed = diff_entity_file(
+                path, dict_key_dtype[key], previous, chunksize=chunksize, keep_rows=keep_rows
+                )
+            dict_key_delta[key] = {"added": added, "changed": changed, "removed": removed}
+        else:
+            fingerprints, deleted, inserted = diff_relation_file(
+                path, dict_key_dtype[key], previous, chunksize=chunksize, keep_rows=keep_rows
+                )
+            dict_key_delta[key] = {"deleted": deleted, "inserted": inserted}
+        dict_key_delta[key].update(type=dict_key_type[key], kind=kind)
+        fingerprints.to_csv(path_out + ".tmp", index=False, compression="gzip")
+        os.replace(path_out + ".tmp", path_out)
+    # files gone since the last load: everything they held is removed
+    for key, state in previous_files.items():
+        if key in dict_key_path or not keep_rows:
+            continue
+        print(f"{key} is gone; removing what it held")
+        previous = read_previous(manifest_file(manifest_dir, manifest["generation"], key))
+        if state["kind"] == "entity":
+            dict_key_delta[key] = {"added": previous.iloc[:0], "changed": previous.iloc[:0], "removed": previous["_id"]}
+        else:
+            roleplayers = previous[["_start", "_end"]]
+            dict_key_delta[key] = {"deleted": roleplayers.drop_duplicates(), "inserted": roleplayers.iloc[:0]}
+        dict_key_delta[key].update(type=state["type"], kind=state["kind"])
+    return next_manifest, dict_key_delta
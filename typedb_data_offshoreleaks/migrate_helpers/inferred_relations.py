@@ -0,0 +1,144 @@
+import os
+import re
+
+import pandas as pd
+
+# entity types that play the roles of the inferred relations, i.e. the subtypes of corporate_entity
+corporate_entity_types = ["org_entity", "other", "officer", "intermediary"]
+
+# inferred relation to the attribute types (subtypes of date_start or date_stop) its rule joins on
+dict_rule_date_attributes = {
+    "same_date_start": ["start_date", "incorporation_date"],
+    "same_date_stop": ["end_date", "inactivation_date", "struck_off_date", "dorm_date", "closed_date"]
+    }
+
+pattern_rule = re.compile(r"\brule\s+([\w-]+)\s*:")
+
+
+def split_schema_rules(query_define):
+    '''
+    @usage separate the rules from a TypeQL define query, to define the types without them
+    @param query_define: string, TypeQL define query
+    @return (define query without rules, list of rule labels) tuple
+    '''
+    labels = []
+    while True:
+        match = pattern_rule.search(query_define)
+        if match is None:
+            return query_define, labels
+        labels.append(match.group(1))
+        # a rule ends with the ";" after its second top-level block: when { .. } then { .. };
+        depth = blocks = 0
+        end = match.end()
+        while blocks < 2 or query_define[end] != ";":
+            if query_define[end] == "{":
+                depth += 1
+            elif query_define[end] == "}":
+                depth -= 1
+                blocks += depth == 0
+            end += 1
+        query_define = query_define[:match.start()] + query_define[end + 1:]
+
+
+def shared_key_pairs(
+    df,
+    member_column,
+    key_columns,
+    max_group_size=1000
+    ):
+    '''
+    @usage hash self-join: the distinct pairs of members that share a key, and how many keys each pair shares.
+        Groups with more than max_group_size members are skipped, since they would add pairs quadratically
+    @param df: pandas DataFrame
+    @param member_column: column of the members to pair, e.g. entity ids
+    @param key_columns: list of columns to join on, e.g. an officer id
+    @param max_group_size: integer, largest group of members sharing a key to pair up
+    @return pandas DataFrame with columns _start, _end and shared, with _start < _end
+    '''
+    df = df[[member_column] + key_columns].dropna().drop_duplicates()
+    sizes = df.groupby(key_columns)[member_column].transform("size")
+    skipped = (sizes > max_group_size).groupby([df[column] for column in key_columns]).any().sum()
+    if skipped:
+        print(f"skipping {skipped} groups of more than {max_group_size} sharing {', '.join(key_columns)}")
+    df = df[(sizes > 1) & (sizes <= max_group_size)]
+    pairs = df.merge(df, on=key_columns, suffixes=("_1", "_2"))
+    pairs = pairs[pairs[member_column + "_1"] < pairs[member_column + "_2"]]
+    pairs = pairs.groupby([member_column + "_1", member_column + "_2"]).size().reset_index()
+    pairs.columns = ["_start", "_end", "shared"]
+    return pairs
+
+
+def same_date_pairs(
+    entity_paths,
+    attributes,
+    max_group_size=1000
+    ):
+    '''
+    @usage the pairs of entities that own the same date attribute, as same_date_start_rule and same_date_stop_rule infer.
+        TypeDB attributes are identified by type and value, so pairs share a column as well as a date
+    @param entity_paths: list of paths to corporate entity csv files
+    @param attributes: list of date attribute types, which are also the column names
+    @param max_group_size: integer, largest number of entities sharing a date to pair up
+    @return pandas DataFrame with columns _start, _end and shared
+    '''
+    list_df = []
+    for path in entity_paths:
+        columns = [column for column in pd.read_csv(path, nrows=0).columns if column in attributes]
+        if columns:
+            df = pd.read_csv(path, usecols=["_id"] + columns, dtype=str)
+            list_df.append(df.melt(id_vars="_id", var_name="attribute", value_name="value"))
+    if not list_df:
+        return pd.DataFrame(columns=["_start", "_end", "shared"])
+    return shared_key_pairs(pd.concat(list_df), "_id", ["attribute", "value"], max_group_size)
+
+
+def shared_neighbour_pairs(
+    edge_path,
+    max_group_size=1000
+    ):
+    '''
+    @usage the pairs of edge targets (_end) that share an edge source (_start), e.g. entities that share an officer
+    @param edge_path: path to relation csv file with _start and _end columns
+    @param max_group_size: integer, largest number of targets of one source to pair up
+    @return pandas DataFrame with columns _start, _end and shared: the number of sources they share
+    '''
+    edges = pd.read_csv(edge_path, usecols=["_start", "_end"], dtype=str)
+    return shared_key_pairs(edges, "_end", ["_start"], max_group_size)
+
+
+def materialise_inferred_relations(
+    entity_paths,
+    officer_of_path,
+    intermediary_of_path,
+    dir_out,
+    max_group_size=1000,
+    min_shared_officers=1
+    ):
+    '''
+    @usage compute the relations that the schema's rules infer, and write them as relation csv files
+        with _start and _end columns, to be loaded like any other relation file.
+        share_multiple_officers_rule does not require its two officers to differ, so by default
+        one shared officer is enough, as for the rule; set min_shared_officers to 2 for distinct officers
+    @param entity_paths: list of paths to corporate entity csv files
+    @param officer_of_path: path to the officer_of relation csv file
+    @param intermediary_of_path: path to the intermediary_of relation csv file
+    @param dir_out: output directory
+    @param max_group_size: integer, largest group of entities sharing a date, officer or intermediary to pair up
+    @param min_shared_officers: integer, officers a pair must share to share_multiple_officers
+    @return list of paths to the written files
+    '''
+    os.makedirs(dir_out, exist_ok=True)
+    dict_pairs = {}
+    for relation, attributes in dict_rule_date_attributes.items():
+        dict_pairs[relation] = same_date_pairs(entity_paths, attributes, max_group_size)
+    officer_pairs = shared_neighbour_pairs(officer_of_path, max_group_size)
+    intermediary_pairs = shared_neighbour_pairs(intermediary_of_path, max_group_size)
+    dict_pairs["share_multiple_officers"] = officer_pairs[officer_pairs["shared"] >= min_shared_officers]
+    dict_pairs["share_officer_and_intermediary"] = officer_pairs[["_start", "_end"]].merge(intermediary_pairs[["_start", "_end"]])
+    paths = []
+    for relation, pairs in dict_pairs.items():
+        path = os.path.join(dir_out, relation + ".csv")
+        pairs[["_start", "_end"]].to_csv(path, index=False)
+        print(f"materialised {pairs.shape[0]} {relation} relations")
+        paths.append(path)
+    return paths
@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+
+
+def file_sha256(
+    path,
+    block_size=1 << 20
+    ):
+    '''
+    @usage hash a file's content, to detect whether it changed since a checkpoint
+    @param path: path to file
+    @param block_size: integer, bytes to read at a time
+    @return hex digest, string
+    '''
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def append_journal_record(
+    journal_path,
+    record
+    ):
+    '''
+    @usage append one json record to the journal and flush it to disk.
+        A single O_APPEND write per line keeps records whole when several threads
+        or loader processes append to the same journal at once.
+    @param journal_path: path to journal file
+    @param record: dict
+    @return None
+    '''
+    line = (json.dumps(record) + "\n").encode()
+    fd = os.open(journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def end_torn_record(
+    path
+    ):
+    '''
+    @usage end a line of json records that a crash cut off mid-write, if there is one, before appending to the file again.
+        Otherwise the next record would run on from the torn one, and be skipped with it when the file is read
+    @param path: path to a file written with append_journal_record
+    @return None
+    '''
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+
+def start_journal(
+    journal_path,
+    schema_file,
+    chunk_size=None
+    ):
+    '''
+    @usage start a new, empty journal, discarding any previous one
+    @param journal_path: path to journal file
+    @param schema_file: path to the TypeQL schema, whose hash is recorded
+    @param chunk_size: integer, csv chunk size; relation queries are grouped per chunk, so this also sets their order
+    @return journal state: dict of input file key to {"sha256": .., "committed": list of [start, stop) query offset ranges}
+    '''
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+    append_journal_record(journal_path, {
+        "type": "header",
+        "schema_sha256": file_sha256(schema_file),
+        "chunk_size": chunk_size
+        })
+    return {}
+
+
+def load_journal(
+    journal_path,
+    schema_file,
+    chunk_size=None
+    ):
+    '''
+    @usage read a journal written by an earlier run, to resume it.
+        Committed queries are recorded by their offset within their input file, so the batch size may differ between runs.
+    @param journal_path: path to journal file
+    @param schema_file: path to the TypeQL schema, which must be unchanged since the checkpoint
+    @param chunk_size: integer, which must equal the csv chunk size of the checkpointed run
+    @return journal state: dict of input file key to {"sha256": .., "committed": list of [start, stop) query offset ranges}
+    '''
+    if not os.path.exists(journal_path):
+        raise FileNotFoundError(f"no journal to resume from at {journal_path}")
+    end_torn_record(journal_path)
+    journal = {}
+    with open(journal_path, "r") as f:
+        lines = f.read().splitlines()
+    header = json.loads(lines[0])
+    if header["schema_sha256"] != file_sha256(schema_file):
+        raise ValueError(f"{schema_file} changed since the checkpoint in {journal_path}; rerun with --force")
+    if header.get("chunk_size") != chunk_size:
+        raise ValueError(f"checkpoint in {journal_path} was written with chunk_size {header.get('chunk_size')}, not {chunk_size}")
+    for line in lines[1:]:
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError:
+            # a record torn by a crash mid-write was never acknowledged
+            continue
+        if record["type"] == "file":
+            journal[record["file"]] = {"sha256": record["sha256"], "committed": []}
+        elif record["type"] in ("batch", "dead_letter"):
+            # dead-lettered queries are dealt with too: they are in the dead-letter file, not to be retried on resume
+            journal[record["file"]]["committed"].extend(record["ranges"])
+    for state in journal.values():
+        state["committed"] = merge_ranges(state["committed"])
+    return journal
+
+
+def register_journal_file(
+    journal_path,
+    journal,
+    key,
+    path,
+    sha256=None
+    ):
+    '''
+    @usage check an input file against the journal before loading it, recording it if it is new
+    @param journal_path: path to journal file
+    @param journal: journal state, as returned by start_journal or load_journal
+    @param key: string identifying the input file in the journal
+    @param path: path to the input file
+    @param sha256: hash of the input file, if already known, e.g. from an export manifest; by default path is hashed
+    @return list of [start, stop) query offset ranges already committed for this file
+    '''
+    sha256 = sha256 or file_sha256(path)
+    if key in journal:
+        if journal[key]["sha256"] != sha256:
+            raise ValueError(f"{path} changed since the checkpoint in {journal_path}; rerun with --force")
+    else:
+        journal[key] = {"sha256": sha256, "committed": []}
+        append_journal_record(journal_path, {"type": "file", "file": key, "sha256": sha256})
+    n_committed = sum(stop - start for start, stop in journal[key]["committed"])
+    if n_committed:
+        print(f"resuming {key}: skipping {n_committed} committed queries")
+    return journal[key]["committed"]
+
+
+def merge_ranges(
+    ranges
+    ):
+    '''
+    @usage sort and merge overlapping or adjacent [start, stop) ranges
+    @param ranges: iterable of [start, stop) pairs
+    @return list of disjoint [start, stop) pairs, in ascending order
+    '''
+    merged = []
+    for start, stop in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], stop)
+        else:
+            merged.append([start, stop])
+    return merged
+
+
+def offsets_to_ranges(
+    offsets
+    ):
+    '''
+    @usage compress query offsets into [start, stop) ranges of consecutive offsets
+    @param offsets: iterable of integers
+    @return list of [start, stop) pairs
+    '''
+    return merge_ranges([offset, offset + 1] for offset in offsets)
+
+
+def skip_committed_queries(
+    queries,
+    committed
+    ):
+    '''
+    @usage number the queries by their offset in the input and drop those already committed
+    @param queries: list or iterator of queries
+    @param committed: list of disjoint, ascending [start, stop) offset ranges
+    @return an iterator that yields (offset, query) tuples
+    '''
+    ranges = iter(committed)
+    current = next(ranges, None)
+    for offset, query in enumerate(queries):
+        while current is not None and offset >= current[1]:
+            current = next(ranges, None)
+        if current is not None and offset >= current[0]:
+            continue
+        yield offset, query
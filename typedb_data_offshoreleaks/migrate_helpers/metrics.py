@@ -0,0 +1,311 @@
+import bisect
+import contextlib
+import cProfile
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+
+# upper bounds of the commit latency histogram buckets, in seconds
+commit_latency_buckets = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float("inf")]
+
+
+class MigrationMetrics:
+    '''
+    @usage process-wide registry of migration metrics: per-stage timers, a commit latency histogram,
+        rows and commits per writer, queue depths, retries and failures.
+        Disabled by default; every recording method returns at once until enable() is called,
+        so the instrumentation costs one attribute check when switched off.
+    '''
+
+    def __init__(self):
+        self.enabled = False
+        self.forward_queue = None
+        self.profiler_enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.start_time = time.time()
+        self.stages = {}
+        self.histogram = [0] * len(commit_latency_buckets)
+        self.latency_sum = 0.0
+        self.writers = {}
+        self.queue_depths = {}
+        self.retries = 0
+        self.failures = 0
+        self.rows_expected = 0
+        self.rows_committed = 0
+        self.profiles = {}
+
+    def enable(self, forward_queue=None):
+        '''
+        @usage switch recording on
+        @param forward_queue: optional multiprocessing queue; if given, commit, retry and failure events are sent
+            to it, for a parent process to absorb, instead of being recorded here
+        '''
+        self.forward_queue = forward_queue
+        self.enabled = True
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        '''@usage context manager timing one pass through a pipeline stage, e.g. "csv_read" or "query_build"'''
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                count, total = self.stages.get(name, (0, 0.0))
+                self.stages[name] = (count + 1, total + elapsed)
+
+    def expect_rows(self, n):
+        '''@usage add n rows to the total that progress and ETA are reported against'''
+        if not self.enabled:
+            return
+        with self.lock:
+            self.rows_expected += n
+
+    def record_commit(self, n_queries, latency, writer=None):
+        '''@usage record a committed transaction of n_queries that took latency seconds'''
+        if not self.enabled:
+            return
+        writer = writer or f"{os.getpid()}/{threading.current_thread().name}"
+        if self.forward_queue is not None:
+            self.forward_queue.put(("commit", n_queries, latency, writer))
+            return
+        with self.lock:
+            self.histogram[bisect.bisect_left(commit_latency_buckets, latency)] += 1
+            self.latency_sum += latency
+            self.rows_committed += n_queries
+            rows, commits, first = self.writers.get(writer, (0, 0, time.time()))
+            self.writers[writer] = (rows + n_queries, commits + 1, first)
+
+    def record_retry(self):
+        '''@usage record a transaction retried after a write conflict'''
+        if not self.enabled:
+            return
+        if self.forward_queue is not None:
+            self.forward_queue.put(("retry",))
+            return
+        with self.lock:
+            self.retries += 1
+
+    def record_failure(self):
+        '''@usage record a transaction that failed for good'''
+        if not self.enabled:
+            return
+        if self.forward_queue is not None:
+            self.forward_queue.put(("failure",))
+            return
+        with self.lock:
+            self.failures += 1
+
+    def absorb(self, event):
+        '''@usage record an event forwarded from a loader process'''
+        if event[0] == "commit":
+            self.record_commit(*event[1:])
+        elif event[0] == "retry":
+            self.record_retry()
+        elif event[0] == "failure":
+            self.record_failure()
+
+    def set_queue_depth(self, name, depth):
+        '''@usage record the current depth of a queue feeding the writers; None if the platform cannot tell'''
+        if not self.enabled:
+            return
+        with self.lock:
+            self.queue_depths[name] = depth
+
+    def clear_queue_depth(self, name):
+        '''@usage stop reporting a queue once it is done with'''
+        with self.lock:
+            self.queue_depths.pop(name, None)
+
+    @contextlib.contextmanager
+    def profiled(self):
+        '''@usage context manager that runs the enclosed code under a per-thread cProfile profiler, if profiling is on'''
+        if not self.profiler_enabled:
+            yield
+            return
+        ident = threading.get_ident()
+        with self.lock:
+            if ident not in self.profiles:
+                self.profiles[ident] = cProfile.Profile()
+            profile = self.profiles[ident]
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+
+    def dump_profile(self, path):
+        '''@usage merge the per-thread profiles and write them to path, for pstats or snakeviz'''
+        profiles = list(self.profiles.values())
+        if not profiles:
+            return
+        stats = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            stats.add(profile)
+        stats.dump_stats(path)
+
+    def snapshot(self):
+        '''@usage current values of all metrics, as a json-serialisable dict'''
+        with self.lock:
+            elapsed = time.time() - self.start_time
+            now = time.time()
+            rate = self.rows_committed / elapsed if elapsed > 0 else 0.0
+            remaining = self.rows_expected - self.rows_committed
+            return {
+                "time": now,
+                "elapsed_seconds": elapsed,
+                "rows_expected": self.rows_expected,
+                "rows_committed": self.rows_committed,
+                "rows_per_second": rate,
+                "eta_seconds": remaining / rate if rate > 0 and remaining > 0 else None,
+                "stages": {name: {"count": count, "seconds": total} for name, (count, total) in self.stages.items()},
+                "commit_latency_buckets": dict(zip([str(b) for b in commit_latency_buckets], self.histogram)),
+                "commit_latency_sum": self.latency_sum,
+                "writers": {
+                    writer: {"rows": rows, "commits": commits, "rows_per_second": rows / max(now - first, 1e-9)}
+                    for writer, (rows, commits, first) in self.writers.items()
+                    },
+                "queue_depths": dict(self.queue_depths),
+                "retries": self.retries,
+                "failures": self.failures
+                }
+
+    def commit_latency_quantile(self, q):
+        '''@usage approximate commit latency quantile: the upper bound of the histogram bucket it falls in'''
+        with self.lock:
+            histogram = list(self.histogram)
+        total = sum(histogram)
+        if not total:
+            return None
+        cumulative = 0
+        for bound, count in zip(commit_latency_buckets, histogram):
+            cumulative += count
+            if cumulative >= q * total:
+                return bound
+        return None
+
+
+metrics = MigrationMetrics()
+
+
+def format_seconds(seconds):
+    '''@usage 3725 -> 1h02m05s'''
+    if seconds is None:
+        return "?"
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def format_progress(snapshot, p50=None):
+    '''@usage one-line progress and ETA summary of a metrics snapshot'''
+    expected = snapshot["rows_expected"]
+    committed = snapshot["rows_committed"]
+    percent = f" ({100 * committed / expected:.1f}%)" if expected else ""
+    depths = ",".join("?" if depth is None else str(depth) for depth in snapshot["queue_depths"].values())
+    # no commit yet, e.g. throughout a dry run
+    latency = "commit p50 n/a" if p50 is None else f"commit p50 <={p50}s"
+    return (f"[progress] {committed:,}/{expected:,} rows{percent} "
+            f"{snapshot['rows_per_second']:,.0f} rows/s ETA {format_seconds(snapshot['eta_seconds'])} | "
+            f"{latency} | writers {len(snapshot['writers'])} queues [{depths}] | "
+            f"retries {snapshot['retries']} failures {snapshot['failures']}")
+
+
+def format_prometheus(snapshot, prefix="offshoreleaks_migration"):
+    '''@usage render a metrics snapshot in the Prometheus text exposition format'''
+    lines = [
+        f"# TYPE {prefix}_rows_committed_total counter",
+        f"{prefix}_rows_committed_total {snapshot['rows_committed']}",
+        f"# TYPE {prefix}_rows_expected gauge",
+        f"{prefix}_rows_expected {snapshot['rows_expected']}",
+        f"# TYPE {prefix}_retries_total counter",
+        f"{prefix}_retries_total {snapshot['retries']}",
+        f"# TYPE {prefix}_failures_total counter",
+        f"{prefix}_failures_total {snapshot['failures']}",
+        f"# TYPE {prefix}_stage_seconds_total counter",
+        ]
+    for name, stage in snapshot["stages"].items():
+        lines.append(f'{prefix}_stage_seconds_total{{stage="{name}"}} {stage["seconds"]}')
+    lines.append(f"# TYPE {prefix}_writer_rows_total counter")
+    for writer, stats in snapshot["writers"].items():
+        lines.append(f'{prefix}_writer_rows_total{{writer="{writer}"}} {stats["rows"]}')
+    lines.append(f"# TYPE {prefix}_queue_depth gauge")
+    for name, depth in snapshot["queue_depths"].items():
+        lines.append(f'{prefix}_queue_depth{{queue="{name}"}} {"NaN" if depth is None else depth}')
+    lines.append(f"# TYPE {prefix}_commit_latency_seconds histogram")
+    cumulative = 0
+    for bound, count in snapshot["commit_latency_buckets"].items():
+        cumulative += count
+        le = "+Inf" if bound == "inf" else bound
+        lines.append(f'{prefix}_commit_latency_seconds_bucket{{le="{le}"}} {cumulative}')
+    lines.append(f"{prefix}_commit_latency_seconds_sum {snapshot['commit_latency_sum']}")
+    lines.append(f"{prefix}_commit_latency_seconds_count {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+def write_metrics(path, metrics_format="jsonl"):
+    '''
+    @usage dump the current metrics: append a json line, or rewrite a Prometheus textfile
+    @param path: output file
+    @param metrics_format: "jsonl" or "prometheus"
+    @return None
+    '''
+    snapshot = metrics.snapshot()
+    if metrics_format == "prometheus":
+        # write then rename, so that a scraper never reads a half-written file
+        with open(path + ".tmp", "w") as f:
+            f.write(format_prometheus(snapshot))
+        os.replace(path + ".tmp", path)
+    else:
+        with open(path, "a") as f:
+            f.write(json.dumps(snapshot) + "\n")
+
+
+def start_reporter(interval=5, progress=True, metrics_file=None, metrics_format="jsonl"):
+    '''
+    @usage report metrics every interval seconds from a background thread: a live progress line on stderr,
+        and/or a dump to metrics_file
+    @return function that stops the reporter after a final report
+    '''
+    stop = threading.Event()
+
+    def report():
+        if progress:
+            line = format_progress(metrics.snapshot(), metrics.commit_latency_quantile(0.5))
+            sys.stderr.write("\r" + line)
+            sys.stderr.flush()
+        if metrics_file:
+            write_metrics(metrics_file, metrics_format)
+
+    def loop():
+        while not stop.wait(interval):
+            report()
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+
+    def stop_reporter():
+        stop.set()
+        thread.join()
+        report()
+        if progress:
+            sys.stderr.write("\n")
+
+    return stop_reporter
+
+
+def count_csv_rows(path):
+    '''@usage number of data rows in a csv file, by counting lines; for progress reporting'''
+    with open(path, "rb") as f:
+        return max(sum(block.count(b"\n") for block in iter(lambda: f.read(1 << 20), b"")) - 1, 0)
@@ -1,9 +1,22 @@
+import os
 import pandas as pd
 import time 
-from multiprocessing.dummy import Pool as ThreadPool
+import threading
 from functools import partial
 from typedb.client import SessionType, TransactionType, TypeDBOptions
 
+from .cache import read_columnar_chunks, read_columnar_column
+from .batch_control import AdaptiveBatchSize, locked_next, write_batch_with_retry
+from .dead_letters import record_dead_letter
+from .journal import append_journal_record, offsets_to_ranges, skip_committed_queries
+from .metrics import metrics
+from .query_builder import (
+    compile_entity_template,
+    compile_relation_template,
+    render_entity_queries,
+    render_relation_queries
+    )
+
 def prep_entity_insert_queries(
     df,
     isa_type,
@@ -11,44 +24,17 @@ def prep_entity_insert_queries(
     dict_attr_valuetype
     ):
     '''
-    @usage: subroutine to convert a typedb entity subtype and list of string
+    @usage subroutine to convert a typedb entity subtype and list of string
         containing column-to-schematype mappings into a list of TypeQL insert queries
-        everything is vectorized using pandas.Series.str.cat for speed
+        the mappings are compiled into a template, see query_builder.compile_entity_template
     @param df: data table
     @param isa_type: typedb_type, string
     @param mappings: list of string: "has {rel_attr_type} <{column_selected}>"
     @param valuetype: attribute valuetype
     @return list of TypeQL insert queries: ["insert $x isa cardealer, has name Lisette;", "insert $x isa ... "]
     '''
-    
-    list_attr = [mapping.split(" <")[0].split("has ")[1].strip() for mapping in mappings]
-    pattern_missing = "|".join([f" has {attr} ?,|has {attr} '',| has {attr} 'nan',| has {attr} nan," for attr in list_attr])
-    list_series_stump = []
-    # for each input attribute, prepare series of string like ["$x has age 24", "$x has age 64", .. ]
-    for mapping in mappings:
-        mapping = str(mapping)
-        column_selected = mapping.split("<")[1].rstrip(">")
-        data = pd.Series(data=df[column_selected], dtype=str)
-        attr = mapping.split(" <")[0].split("has ")[1].strip()
-        if dict_attr_valuetype[attr]=="STRING":
-            stump = " has " + attr + " '"
-        else:
-            stump =" has " + attr + " "
-        list_stump = [stump]*df.shape[0]
-        series_stump = pd.Series(data=list_stump, dtype = str)
-        # # concatenate with values and the second quotation mark
-        series_stump = series_stump.str.cat(others = [data])
-        if dict_attr_valuetype[attr] == "STRING":
-            series_stump = series_stump.str.cat(others = [pd.Series(data=["'"]*df.shape[0], dtype=str)])
-        list_series_stump.append(series_stump)
-    # Now concatenate the lists of query stumps onto the initial "insert $x isa plumber; "
-    series_queries_init = pd.Series(data=[f"insert $x isa {isa_type}" for i in range(df.shape[0])], dtype=str)
-    # concatenate all the above lists to it element-wise; add a final semicolon to complete each query
-    series_queries_out = series_queries_init.str.cat(others=list_series_stump, sep=",")
-    # remove clauses with missing value attribute
-    series_queries_out = series_queries_out.str.replace(pat=pattern_missing, repl="", case=False, regex=True)
-    series_queries_out = series_queries_out.str.cat(others=pd.Series(data=["; "]*df.shape[0], dtype=str))
-    return list(series_queries_out)
+    template = compile_entity_template(isa_type, mappings, dict_attr_valuetype)
+    return render_entity_queries(template, df)
 
 
 def prep_relation_insert_queries(
@@ -58,9 +44,9 @@ def prep_relation_insert_queries(
     dict_attr_valuetype,
     ):
     '''
-    @usage: subroutine to convert a typedb relation subtype and list of string
+    @usage subroutine to convert a typedb relation subtype and list of string
         containing column-to-schematype mappings into a list of TypeQL insert queries
-        everything is vectorized using pandas.Series.str.cat for speed
+        the mappings are compiled into a template, see query_builder.compile_relation_template
     @param df: data table
     @param isa_type: typedb_type, string
     @param mappings:
@@ -71,135 +57,402 @@ def prep_relation_insert_queries(
     @return list of TypeQL insert queries:
         ["match $company isa company, has name 'Telecom'; $customer isa person, has phone-number '+00 091 xxx'; insert (provider: $company, customer: $customer) isa contract;', ... ]
     '''
-    
-    list_attr = [mapping.split(" <")[0].split("has ")[1].strip() for mapping in mappings]
-    pattern_missing = "|".join([f" ?has {attr} ?,| ?has {attr} '',| ?has {attr} 'nan',| ?has {attr} nan," for attr in list_attr])
-    series_stump_match_init = pd.Series(data=["match "] * df.shape[0], dtype=str)
-    list_series_stump_rp_isa_has = []
-    series_stump_insert_init = pd.Series(["insert ("] * df.shape[0], dtype=str)
-    list_series_stump_role_rp = []
-    series_stump_insert_rel_isa = pd.Series([f") isa {isa_type}" for i in range(df.shape[0])], dtype=str)
-    list_series_stump_rel_has = []
-    for mapping in mappings:
-        if " ... " in mapping:
-            # roleplayer attribute
-            # "${0} isa {1}, has {2} <{3}>, has {} <{}>, has {} <{}> ... {4} : {5}".format(rp_var, rp_type, rp_attr_type, column_selected, role, rp_var)
-            # prepare the isa / has part of the query
-            
-            series_stump_rp_isa = pd.Series(data=[mapping.split("; ")[0]]*df.shape[0], dtype=str) if "isa" in mapping else None
-            list_series_stump_rp_has = []
-            list_stump_rp_has = mapping.split(" ... ")[0].split(";")[1:] if type(series_stump_rp_isa) is pd.Series else mapping.split(" ... ")[0].split(";")
-            if not list_stump_rp_has:
-                raise ValueError(f"role player {mapping.split(' ')[0]} must have unique attributes but has none")
-            for stump_rp_has in list_stump_rp_has:
-                column_selected = stump_rp_has.split("<")[1].rstrip(">")
-
-                attr = stump_rp_has.split(" <")[0].split("has ")[1].strip()
-                if dict_attr_valuetype[attr]=="STRING":
-                    stump = f"{mapping.split(' ')[0]} has " + attr + " '"
-                else:
-                    stump = f"{mapping.split(' ')[0]} has " + attr + " "
-                series_stump_rp_has = pd.Series(data=[stump]*df.shape[0], dtype=str)
-                # # concatenate with values and the second quotation mark
-                data = pd.Series(data=df[column_selected], dtype=str)
-                series_stump_rp_has = series_stump_rp_has.str.cat(others = [data])
-                if dict_attr_valuetype[attr]=="STRING":
-                    series_stump_rp_has = series_stump_rp_has.str.cat(others=[pd.Series(data=["'"]*df.shape[0], dtype=str)])
-                list_series_stump_rp_has.append(series_stump_rp_has)
-            # concat the isa and the has parts for this roleplayer
-            if type(series_stump_rp_isa) is pd.Series:
-                series_stump_rp_isa_has = series_stump_rp_isa.str.cat(others=list_series_stump_rp_has, sep="; ") 
-            else:
-                series_stump_rp_isa_has = list_series_stump_rp_has[0].str.cat(others=list_series_stump_rp_has[1:], sep="; ")  if len(list_series_stump_rp_has)>1 else list_series_stump_rp_has[0]
-            # if attr value missing, remove clause
-            series_stump_rp_isa_has = series_stump_rp_isa_has.str.replace(pat=pattern_missing, repl="",regex=True)
-
-            list_series_stump_rp_isa_has.append(series_stump_rp_isa_has)
-
-            # append the the (role:$roleplayer) stump to list
-            series_stump_role_rp = pd.Series(data=[mapping.split(" ... ")[1]]*df.shape[0], dtype=str)
-            list_series_stump_role_rp.append(series_stump_role_rp)
+    template = compile_relation_template(isa_type, mappings, dict_attr_valuetype)
+    return render_relation_queries(template, df)
+
+
+def read_csv_chunks(
+    path,
+    dtype=None,
+    chunksize=None,
+    usecols=None
+    ):
+    '''
+    @usage read a delimited file lazily, one chunk of rows at a time
+        each chunk gets a fresh RangeIndex, i.e. row positions within the chunk
+    @param path: path to csv file
+    @param dtype: dict of column to dtype, passed on to pandas.read_csv
+    @param chunksize: integer, number of rows per chunk. If None or 0, read the whole file as one chunk
+    @param usecols: optional list of the columns to read; by default all
+    @return an iterator that yields pandas DataFrames
+    '''
+    if not chunksize:
+        with metrics.stage("csv_read"):
+            df = pd.read_csv(path, dtype=dtype, usecols=usecols)
+        yield df
+        return
+    with pd.read_csv(path, dtype=dtype, chunksize=chunksize, usecols=usecols) as reader:
+        reader = iter(reader)
+        while True:
+            with metrics.stage("csv_read"):
+                df = next(reader, None)
+            if df is None:
+                return
+            yield df.reset_index(drop=True)
+
+
+def read_table_chunks(
+    path,
+    dtype=None,
+    chunksize=None,
+    usecols=None
+    ):
+    '''
+    @usage read_csv_chunks for a csv file, read_columnar_chunks for its columnar cache (.arrow)
+    @param path: path to csv file or Arrow IPC file
+    @param dtype: dict of column to dtype, for csv files; the columnar cache stores its own
+    @param chunksize: integer, number of rows per chunk. If None or 0, read the whole file as one chunk
+    @param usecols: optional list of the columns to read; by default all
+    @return an iterator that yields pandas DataFrames
+    '''
+    if path.endswith(".arrow"):
+        return read_columnar_chunks(path, chunksize=chunksize, usecols=usecols)
+    return read_csv_chunks(path, dtype=dtype, chunksize=chunksize, usecols=usecols)
+
+
+def stream_entity_insert_queries(
+    path,
+    isa_type,
+    mappings,
+    dict_attr_valuetype,
+    dtype=None,
+    chunksize=50000
+    ):
+    '''
+    @usage generator version of prep_entity_insert_queries which reads the csv in chunks,
+        so that peak memory is set by chunksize rather than by the size of the file
+    @param path: path to csv file, or to its columnar cache
+    @param isa_type: typedb_type, string
+    @param mappings: list of string: "has {rel_attr_type} <{column_selected}>"
+    @param dict_attr_valuetype: attribute valuetype
+    @param dtype: dict of column to dtype, passed on to pandas.read_csv
+    @param chunksize: integer, number of rows per chunk
+    @return an iterator that yields TypeQL insert queries
+    '''
+    template = compile_entity_template(isa_type, mappings, dict_attr_valuetype)
+    for df in read_table_chunks(path, dtype=dtype, chunksize=chunksize):
+        with metrics.stage("query_build"), metrics.profiled():
+            queries = render_entity_queries(template, df)
+        yield from queries
 
+
+def stream_relation_insert_queries(
+    path,
+    isa_type,
+    mappings,
+    dict_attr_valuetype,
+    dtype=None,
+    chunksize=50000
+    ):
+    '''
+    @usage generator version of prep_relation_insert_queries which reads the csv in chunks,
+        so that peak memory is set by chunksize rather than by the size of the file
+    @param path: path to csv file, or to its columnar cache
+    @param isa_type: typedb_type, string
+    @param mappings: see prep_relation_insert_queries
+    @param dict_attr_valuetype: attribute valuetype
+    @param dtype: dict of column to dtype, passed on to pandas.read_csv
+    @param chunksize: integer, number of rows per chunk
+    @return an iterator that yields TypeQL match-insert queries
+    '''
+    template = compile_relation_template(isa_type, mappings, dict_attr_valuetype)
+    for df in read_table_chunks(path, dtype=dtype, chunksize=chunksize):
+        with metrics.stage("query_build"), metrics.profiled():
+            queries = render_relation_queries(template, df)
+        yield from queries
+
+
+def build_id_type_index(
+    paths_types,
+    id_column="_id"
+    ):
+    '''
+    @usage build an index from node id to concrete entity type, reading only the id column of each entity file,
+        so that relation queries can match their roleplayers against the narrowest type instead of thing
+    @param paths_types: iterable of (path to entity csv or its columnar cache, entity type) tuples
+    @param id_column: column holding the id that relation files refer to in _start and _end
+    @return pandas.Series of categorical entity types, indexed by id as string
+    '''
+    list_series = []
+    for path, isa_type in paths_types:
+        if path.endswith(".arrow"):
+            ids = read_columnar_column(path, id_column)
         else:
-            # relation attribute
-            column_selected = mapping.split("<")[1].rstrip(">")
-            attr = mapping.split(" <")[0].split("has ")[1].strip()
-            if dict_attr_valuetype[attr]=="STRING":
-                stump = "has " + attr + " '"
-            else:
-                stump = "has " + attr + " "
-            series_stump = pd.Series(data=[stump]*df.shape[0], dtype=str)
-            # # concatenate with values and the second quotation mark
-            data = pd.Series(data=df[column_selected], dtype=str)
-            series_stump = series_stump.str.cat(others = [pd.Series(data=data,dtype=str)])
-            if dict_attr_valuetype[attr]=="STRING":
-                series_stump = series_stump.str.cat(others = [pd.Series(data=["'"]*df.shape[0], dtype=str)])
-            list_series_stump_rel_has.append(series_stump)
-
-    # put everything together
-    # first concat those lists of series that are separated by commas
-    if len(list_series_stump_rp_isa_has)>1:
-        series_stump_rp_isa_has = list_series_stump_rp_isa_has[0].str.cat(others=list_series_stump_rp_isa_has[1:], sep="; ")
-        series_stump_role_rp = list_series_stump_role_rp[0].str.cat(others=list_series_stump_role_rp[1:], sep=", ")
-    elif len(list_series_stump_rp_isa_has)==1:
-        series_stump_rp_isa_has = list_series_stump_rp_isa_has[0]
-        series_stump_role_rp = list_series_stump_role_rp[0]
-    else:
-        raise ValueError("relation insert queries must match roleplayers to roles")
-
-    if len(list_series_stump_rel_has)>1:
-        series_stump_rel_has = list_series_stump_rel_has[0].str.cat(others=list_series_stump_rel_has[1:], sep=", ")
-    elif len(list_series_stump_rel_has)==1:
-        series_stump_rel_has = list_series_stump_rel_has[0]
-    else:
-        series_stump_rel_has = None
-
-    if type(series_stump_rel_has) is pd.Series: # i.e. not None. cannot check the usual way.
-        # if attr value missing, remove clause
-        series_stump_rel_has = series_stump_rel_has.str.replace(pat=pattern_missing, repl="",regex=True)
-    # cat "match" and "$employer isa person, has address '23 Rose Crescent'; ..."
-    series_queries_out = series_stump_match_init.str.cat(others=series_stump_rp_isa_has, sep = "")
-
-    # cat "insert (" and "employer: $employer, employee: $employee ... " and ")"
-    series_queries_insert = series_stump_insert_init.str.cat(others=[series_stump_role_rp, series_stump_insert_rel_isa], sep="")
-
-    series_queries_out = series_queries_out.str.cat(others=series_queries_insert, sep="; ")
-    if type(series_stump_rel_has) is pd.Series:
-        series_queries_out = series_queries_out.str.cat(others=[series_stump_rel_has], sep=", ")
-    series_queries_out = series_queries_out.str.cat(others=pd.Series(data=["; "]*df.shape[0], dtype=str))
-    return list(series_queries_out)
+            ids = pd.read_csv(path, usecols=[id_column], dtype={id_column: str})[id_column]
+        list_series.append(pd.Series(data=isa_type, index=ids.values, dtype=str))
+    id_type_index = pd.concat(list_series)
+    # id is a key per type; should it recur across types, the first type wins
+    id_type_index = id_type_index[~id_type_index.index.duplicated()]
+    return id_type_index.astype("category")
+
+
+def render_typed_relation_queries(
+    df,
+    isa_type,
+    mappings,
+    dict_attr_valuetype,
+    start_role,
+    end_role,
+    id_type_index,
+    templates,
+    fallback_type="node",
+    render=render_relation_queries
+    ):
+    '''
+    @usage look up the entity type of each _start and _end id of a data table and render its queries
+        grouped by (start type, end type), so that every query matches its roleplayers
+        with e.g. "$start isa officer; $start has id '..'" rather than "$start isa thing; .."
+    @param df: data table with _start and _end id columns
+    @param isa_type: typedb relation type, string
+    @param mappings: list of string: "has {rel_attr_type} <{column_selected}>" for RELATION attributes only
+    @param dict_attr_valuetype: attribute valuetype
+    @param start_role: role played by the _start node
+    @param end_role: role played by the _end node
+    @param id_type_index: pandas.Series from build_id_type_index
+    @param templates: dict of (start type, end type) to compiled template, filled in on first use of each pair
+    @param fallback_type: type to match ids that are missing from id_type_index
+    @param render: render_relation_queries, or render_relation_delete_queries
+    @return an iterator that yields TypeQL queries, one per row in the order of df,
+        so that the offset of a query is the row it was rendered from
+    '''
+    df = df.reset_index(drop=True)
+    with metrics.stage("id_type_lookup"):
+        start_types = df["_start"].astype(str).map(id_type_index).astype(object).fillna(fallback_type)
+        end_types = df["_end"].astype(str).map(id_type_index).astype(object).fillna(fallback_type)
+    queries = [None] * len(df)
+    for (start_type, end_type), df_group in df.groupby([start_types, end_types], sort=True):
+        if not (start_type, end_type) in templates:
+            templates[(start_type, end_type)] = compile_relation_template(
+                isa_type,
+                mappings + [
+                    f"$start isa {start_type}; $start has id <_start> ... {start_role} : $start",
+                    f"$end isa {end_type}; $end has id <_end> ... {end_role} : $end"
+                    ],
+                dict_attr_valuetype
+                )
+        with metrics.stage("query_build"), metrics.profiled():
+            group_queries = render(templates[(start_type, end_type)], df_group)
+        for row, query in zip(df_group.index, group_queries):
+            queries[row] = query
+    yield from queries
+
+
+def stream_typed_relation_insert_queries(
+    path,
+    isa_type,
+    mappings,
+    dict_attr_valuetype,
+    start_role,
+    end_role,
+    id_type_index,
+    dtype=None,
+    chunksize=50000,
+    fallback_type="node"
+    ):
+    '''
+    @usage like stream_relation_insert_queries, but matches each chunk's roleplayers by their entity type,
+        see render_typed_relation_queries
+    @param path: path to relation csv file, or to its columnar cache, with _start and _end id columns
+    @param isa_type: typedb relation type, string
+    @param mappings: list of string: "has {rel_attr_type} <{column_selected}>" for RELATION attributes only
+    @param dict_attr_valuetype: attribute valuetype
+    @param start_role: role played by the _start node
+    @param end_role: role played by the _end node
+    @param id_type_index: pandas.Series from build_id_type_index
+    @param dtype: dict of column to dtype, passed on to pandas.read_csv
+    @param chunksize: integer, number of rows per chunk
+    @param fallback_type: type to match ids that are missing from id_type_index
+    @return an iterator that yields TypeQL match-insert queries
+    '''
+    # one template per (start type, end type) pair, compiled on first use
+    templates = {}
+    for df in read_table_chunks(path, dtype=dtype, chunksize=chunksize):
+        yield from render_typed_relation_queries(
+            df, isa_type, mappings, dict_attr_valuetype, start_role, end_role, id_type_index, templates, fallback_type
+            )
+
+
+# marker file whose modification time every commit bumps, for readers to invalidate their caches by
+commit_marker = {"path": None}
+
+
+def set_commit_marker(
+    path
+    ):
+    '''
+    @usage have every commit made by this process bump the modification time of the file at path
+    @param path: path to marker file, or None to stop
+    @return None
+    '''
+    if path and os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    commit_marker["path"] = path
+
+
+def touch_commit_marker():
+    '''@usage bump the modification time of the commit marker, if one is set'''
+    path = commit_marker["path"]
+    if path:
+        with open(path, "a"):
+            os.utime(path)
 
 
 def write_query_batch(
     session,
-    batch
+    batch,
+    query_type="insert",
+    check_inserted=False
     ):
     '''@usage open a write transaction and write all queries in batch
     @param session: a typedb data write session
     @param batch: a list of write queries
+    @param query_type: "insert" for insert and match-insert queries, "delete" for match-delete queries,
+        "update" for (match-delete, match-insert or None) pairs, each written in this order, see render_entity_update_queries
+    @param check_inserted: if True, fail the batch if an insert query matched nothing, e.g. a relation
+        whose roleplayer is missing. The answers are checked once every query is sent
     @return None
     '''
     tx = session.transaction(TransactionType.WRITE)
-    for query in batch:
-        tx.query().insert(query)
-    tx.commit()
+    try:
+        if query_type == "update":
+            for delete_query, insert_query in batch:
+                tx.query().delete(delete_query)
+                if insert_query:
+                    tx.query().insert(insert_query)
+            answers = []
+        else:
+            write = getattr(tx.query(), query_type)
+            answers = [write(query) for query in batch]
+        if check_inserted and query_type == "insert":
+            for query, answer in zip(batch, answers):
+                if next(iter(answer), None) is None:
+                    raise ValueError(f"nothing inserted, the match found no data: {query}")
+        tx.commit()
+    except Exception:
+        if tx.is_open():
+            tx.close()
+        raise
+    touch_commit_marker()
+
+
+def write_indexed_query_batch(
+    session,
+    indexed_batch,
+    **write_options
+    ):
+    '''@usage write a batch of (offset, query) tuples as write_query_batch does
+    @param session: a typedb data write session
+    @param indexed_batch: a list of (offset, query) tuples
+    @param write_options: keyword arguments to write_query_batch
+    @return None
+    '''
+    write_query_batch(session, [query for _, query in indexed_batch], **write_options)
+
+
+def write_journaled_query_batch(
+    session,
+    indexed_batch,
+    journal_path,
+    key,
+    **write_options
+    ):
+    '''@usage write a batch as write_query_batch does, then record its queries as committed in the journal
+    @param session: a typedb data write session
+    @param indexed_batch: a list of (offset, query) tuples, as from skip_committed_queries
+    @param journal_path: path to journal file
+    @param key: string identifying the input file in the journal
+    @param write_options: keyword arguments to write_query_batch
+    @return None
+    '''
+    write_indexed_query_batch(session, indexed_batch, **write_options)
+    ranges = offsets_to_ranges(offset for offset, _ in indexed_batch)
+    append_journal_record(journal_path, {"type": "batch", "file": key, "ranges": ranges})
+
+
+def select_write_batch(
+    journal_path=None,
+    key=None,
+    indexed=False,
+    **write_options
+    ):
+    '''
+    @usage the function with which writers write each batch: journaled, indexed or plain
+    @param journal_path: optional path to journal file; batches are then lists of (offset, query) tuples
+    @param key: string identifying the input file in the journal
+    @param indexed: if True, batches are lists of (offset, query) tuples even without a journal
+    @param write_options: keyword arguments to write_query_batch
+    @return function(session, batch)
+    '''
+    if journal_path:
+        return partial(write_journaled_query_batch, journal_path=journal_path, key=key, **write_options)
+    if indexed:
+        return partial(write_indexed_query_batch, **write_options)
+    return partial(write_query_batch, **write_options)
 
 
 def multi_thread_write_query_batches(
     session,
     query_batches,
-    num_threads=4
+    num_threads=4,
+    write_batch=write_query_batch,
+    batch_size=1,
+    min_batch_size=None,
+    max_batch_size=None,
+    target_latency=2.0,
+    max_retries=5,
+    dead_letter=None
     ):
-    '''@usage call write_query_batch in parallel on num_threads
+    '''@usage call write_query_batch in parallel on num_threads.
+        Each thread joins consecutive lists from query_batches into transactions of at least its current
+        batch size, which an AdaptiveBatchSize controller per thread tunes between min_batch_size and
+        max_batch_size from commit latency and failures. Transactions that fail on a write conflict are retried.
     @param session: a typedb data write session
     @param query_batches: an iterator of lists of queries
     @param num_threads integer, max number of threads
+    @param write_batch: function(session, batch) that writes one transaction's worth of queries
+    @param batch_size: integer, initial number of queries per transaction; the default of 1 commits each list on its own
+    @param min_batch_size: integer, smallest batch size; defaults to batch_size
+    @param max_batch_size: integer, largest batch size; defaults to batch_size
+    @param target_latency: seconds per commit the controllers aim for
+    @param max_retries: integer, number of retries after a write conflict
+    @param dead_letter: optional function(item, exception); if given, failed batches are bisected
+        and the queries that fail on their own are handed to it, see write_batch_with_retry
     @return None
     '''
-    pool = ThreadPool(num_threads)
-    pool.map(partial(write_query_batch, session), query_batches)
-    pool.close()
-    pool.join()
+    next_batch = locked_next(iter(query_batches))
+    stop = threading.Event()
+    errors = []
+
+    def writer():
+        controller = AdaptiveBatchSize(
+            batch_size,
+            min_batch_size or batch_size,
+            max_batch_size or batch_size,
+            target_latency
+            )
+        try:
+            while not stop.is_set():
+                batch = []
+                with metrics.stage("writer_wait"):
+                    while len(batch) < controller.size:
+                        shard = next_batch()
+                        if shard is None:
+                            break
+                        batch.extend(shard)
+                if not batch:
+                    return
+                write_batch_with_retry(session, batch, write_batch, controller, max_retries, dead_letter=dead_letter)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+
+    threads = [threading.Thread(target=writer, daemon=True) for _ in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
 
 
 def generate_query_batches(
@@ -207,16 +460,16 @@ def generate_query_batches(
     batch_size
     ):
     '''@usage
-    @param queries: a list of queries
+    @param queries: a list or iterator of queries
     @param batch_size integer, max number of queries to commit in one transaction;
         see https://dev.typedb.ai/docs/examples/phone-calls-migration-python,
         recommended max 500
     @return an iterator that yields batches (lists) of queries
     '''
     batch = []
-    for index, data_entry in enumerate(queries):
+    for data_entry in queries:
         batch.append(data_entry)
-        if index % batch_size == 0 and index != 0:
+        if len(batch) == batch_size:
             yield batch
             batch = []
     if batch:
@@ -229,28 +482,76 @@ def insert_data_bulk(
     queries,
     num_threads = 4,
     batch_size = 100,
-    typedb_options=None
+    typedb_options=None,
+    journal=None,
+    min_batch_size=None,
+    max_batch_size=None,
+    target_latency=2.0,
+    max_retries=5,
+    query_type="insert",
+    dead_letter_path=None,
+    source=None,
+    check_inserted=False
     ):
     '''
     @usage Carry out insert queries in bulk, for migration
     @param client: open typedb client
     @param database: database
     @param typedb_options: as returned by TypeDBOptions.core() or TypeDBOptions.cluster()
-    @param queries: list of string
+    @param queries: list or iterator of string, e.g. from stream_entity_insert_queries
     @param num_threads integer, max number of threads
-    @param batch_size integer, max number of queries to commit in one transaction;
+    @param batch_size integer, initial number of queries to commit in one transaction;
             see https://dev.typedb.ai/docs/examples/phone-calls-migration-python,
             recommended max 500
+    @param journal: optional (journal_path, key, committed) tuple; queries in the committed offset ranges
+            are skipped and newly committed queries are recorded in the journal under key
+    @param min_batch_size: integer, smallest batch size the writers may shrink to; defaults to batch_size
+    @param max_batch_size: integer, largest batch size the writers may grow to; defaults to batch_size
+    @param target_latency: seconds per commit the writers aim for
+    @param max_retries: integer, number of retries after a write conflict
+    @param query_type: "insert" for insert and match-insert queries, "delete" for match-delete queries;
+            journaled queries must be inserts
+    @param dead_letter_path: optional path to dead-letter file; if given, failed batches are bisected and the
+            queries that fail on their own are written to it, with their source and offset, rather than raised
+    @param source: string identifying the queries in the dead-letter file; defaults to the journal key
+    @param check_inserted: if True, a match-insert query that matches nothing fails, see write_query_batch
     @return None
     '''
     if not typedb_options:
         typedb_options = TypeDBOptions.core()
+    min_batch_size = min_batch_size or batch_size
+    journal_path = key = None
+    if journal:
+        journal_path, key, committed = journal
+        source = source or key
+        queries = skip_committed_queries(queries, committed)
+    elif dead_letter_path:
+        # number the queries, for the dead letters to say which row of the source each came from
+        queries = enumerate(queries)
+    write_batch = select_write_batch(
+        journal_path, key, indexed=bool(dead_letter_path), query_type=query_type, check_inserted=check_inserted
+        )
+    dead_letter = None
+    if dead_letter_path:
+        dead_letter = partial(record_dead_letter, dead_letter_path, source, journal_path=journal_path)
     with client.session(database, session_type = SessionType.DATA, options=typedb_options) as session:
         # carry out write transaction
         # source https://stackoverflow.com/questions/59822987/how-best-to-parallelize-typedb-queries-with-python/59823286#59823286
         start_time = time.time()
-        batches = generate_query_batches(queries,  batch_size)
-        multi_thread_write_query_batches(session, batches, num_threads)
+        # writers assemble their transactions from batches of the smallest size
+        batches = generate_query_batches(queries, min_batch_size)
+        multi_thread_write_query_batches(
+            session,
+            batches,
+            num_threads,
+            write_batch,
+            batch_size=batch_size,
+            min_batch_size=min_batch_size,
+            max_batch_size=max_batch_size,
+            target_latency=target_latency,
+            max_retries=max_retries,
+            dead_letter=dead_letter
+            )
         elapsed = time.time() - start_time
         print(f'Time elapsed {elapsed:.1f} seconds')
     return None
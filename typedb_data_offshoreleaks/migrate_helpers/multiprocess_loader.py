@@ -0,0 +1,399 @@
+import multiprocessing
+import queue
+import threading
+import time
+import traceback
+from functools import partial
+from typedb.client import TypeDB, SessionType, TypeDBOptions
+
+from .dead_letters import record_dead_letter
+from .journal import skip_committed_queries
+from .metrics import metrics
+from .migrate_helpers import (
+    commit_marker,
+    set_commit_marker,
+    generate_query_batches,
+    multi_thread_write_query_batches,
+    select_write_batch
+    )
+
+
+def write_file_batches_worker(
+    session,
+    batch_queue,
+    done_queue,
+    num_threads=1,
+    batch_control=None,
+    journal_path=None,
+    journal_key=None,
+    dead_letter_path=None,
+    source=None,
+    check_inserted=False
+    ):
+    '''
+    @usage write one file's batches, taken off batch_queue on num_threads threads until a None sentinel arrives,
+        then report on done_queue: None once they are written, or a formatted traceback
+    @param session: the loader process's data session
+    @param batch_queue: multiprocessing queue of lists of queries, terminated by None
+    @param done_queue: multiprocessing queue to report on
+    @param num_threads: integer, number of writer threads
+    @param batch_control: dict of batch size and retry keyword arguments to multi_thread_write_query_batches
+    @param journal_path: optional path to journal file; if given, or if dead_letter_path is,
+        the queue holds lists of (offset, query) tuples
+    @param journal_key: string identifying the input file in the journal
+    @param dead_letter_path: optional path to dead-letter file, see insert_data_bulk
+    @param source: string identifying the queries in the dead-letter file
+    @param check_inserted: if True, a match-insert query that matches nothing fails, see write_query_batch
+    @return None
+    '''
+    write_batch = select_write_batch(journal_path, journal_key, indexed=bool(dead_letter_path), check_inserted=check_inserted)
+    dead_letter = None
+    if dead_letter_path:
+        dead_letter = partial(record_dead_letter, dead_letter_path, source, journal_path=journal_path)
+    batches = iter(batch_queue.get, None)
+    try:
+        multi_thread_write_query_batches(
+            session,
+            batches,
+            num_threads,
+            write_batch,
+            dead_letter=dead_letter,
+            **(batch_control or {})
+            )
+        done_queue.put(None)
+    except Exception:
+        done_queue.put(traceback.format_exc())
+        # drain the file's remaining batches up to its sentinel, so the queue is empty for the next file
+        for _ in batches:
+            pass
+
+
+def loader_process_worker(
+    address,
+    database,
+    control_queue,
+    batch_queues,
+    done_queues,
+    error_queue,
+    num_threads=1,
+    parallelisation=1,
+    batch_control=None,
+    metrics_queue=None,
+    commit_marker_path=None,
+    client_factory=None
+    ):
+    '''
+    @usage body of each loader process: open a client and data session once, then write the batches of each file
+        that control_queue announces, on a thread of its own per file, until a None sentinel arrives
+    @param address: typedb server address, "host:port"
+    @param database: database
+    @param control_queue: multiprocessing queue of (slot, dict of keyword arguments to write_file_batches_worker) tuples
+    @param batch_queues: list of multiprocessing queues of batches, one per slot
+    @param done_queues: list of multiprocessing queues to report each file's outcome on, one per slot
+    @param error_queue: multiprocessing queue on which to report a formatted traceback if the process fails
+    @param num_threads: integer, number of writer threads per file
+    @param parallelisation: integer, client parallelisation
+    @param batch_control: dict of batch size and retry keyword arguments to multi_thread_write_query_batches
+    @param metrics_queue: optional multiprocessing queue to forward commit metrics to the parent on
+    @param commit_marker_path: optional path to the commit marker, see set_commit_marker
+    @param client_factory: optional function without arguments that opens the client, see LoaderPool
+    @return None
+    '''
+    if metrics_queue is not None:
+        metrics.enable(forward_queue=metrics_queue)
+    set_commit_marker(commit_marker_path)
+    try:
+        if client_factory is not None:
+            client = client_factory()
+        else:
+            client = TypeDB.core_client(address=address, parallelisation=parallelisation)
+        with client:
+            with client.session(database, session_type=SessionType.DATA, options=TypeDBOptions.core()) as session:
+                threads = []
+                for slot, options in iter(control_queue.get, None):
+                    thread = threading.Thread(
+                        target=write_file_batches_worker,
+                        args=(session, batch_queues[slot], done_queues[slot], num_threads, batch_control),
+                        kwargs=options,
+                        daemon=True
+                        )
+                    thread.start()
+                    threads = [thread for thread in threads if thread.is_alive()] + [thread]
+                for thread in threads:
+                    thread.join()
+    except Exception:
+        # the parent stops feeding the pool once any loader process has exited
+        error_queue.put(traceback.format_exc())
+
+
+def absorb_metrics(
+    metrics_queue
+    ):
+    '''
+    @usage record the metrics events that loader processes forwarded so far
+    @param metrics_queue: multiprocessing queue, or None
+    @return None
+    '''
+    if metrics_queue is None:
+        return
+    while True:
+        try:
+            metrics.absorb(metrics_queue.get_nowait())
+        except queue.Empty:
+            return
+
+
+def queue_size(q):
+    '''@usage approximate size of a multiprocessing queue, or None where qsize is not implemented, as on macOS'''
+    try:
+        return q.qsize()
+    except NotImplementedError:
+        return None
+
+
+class LoaderPool:
+    '''
+    @usage a pool of loader processes, each with its own client and data session, so that query serialisation
+        and response handling are not bound by one GIL. The processes are started once and load every file
+        handed to insert, up to max_files at once: each file takes a free slot, whose queue of batches every
+        process takes from, and is announced to every process, which writes it on num_threads threads of its own.
+        Batches of min_batch_size are fed over the bounded queue, so the queries may be a lazy iterator;
+        each writer thread joins them into transactions of its own adaptive batch size.
+    '''
+
+    def __init__(
+        self,
+        address,
+        database,
+        num_processes=4,
+        num_threads=1,
+        parallelisation=1,
+        max_files=1,
+        batch_size=250,
+        min_batch_size=None,
+        max_batch_size=None,
+        target_latency=2.0,
+        max_retries=5,
+        client_factory=None
+        ):
+        '''
+        @param address: typedb server address, "host:port"
+        @param database: database
+        @param num_processes: integer, number of loader processes
+        @param num_threads: integer, number of writer threads per process and file
+        @param parallelisation: integer, client parallelisation in each process
+        @param max_files: integer, number of files that may be loaded at once
+        @param batch_size: integer, initial number of queries to commit in one transaction
+        @param min_batch_size: integer, smallest batch size; defaults to batch_size
+        @param max_batch_size: integer, largest batch size; defaults to batch_size
+        @param target_latency: seconds per commit the writers aim for
+        @param max_retries: integer, number of retries after a write conflict
+        @param client_factory: optional picklable function without arguments that opens the client of each process
+            instead of TypeDB.core_client, e.g. the stand-in that benchmarks and tests use
+        '''
+        self.min_batch_size = min_batch_size or batch_size
+        batch_control = {
+            "batch_size": batch_size,
+            "min_batch_size": self.min_batch_size,
+            "max_batch_size": max_batch_size,
+            "target_latency": target_latency,
+            "max_retries": max_retries
+            }
+        # keep enough small batches queued for every writer to assemble its largest transaction
+        shards_per_writer = 2 + (max_batch_size or batch_size) // self.min_batch_size
+        # spawn rather than fork: the parent may already hold open gRPC channels
+        ctx = multiprocessing.get_context("spawn")
+        self.batch_queues = [ctx.Queue(maxsize=num_processes * num_threads * shards_per_writer) for _ in range(max_files)]
+        self.done_queues = [ctx.Queue() for _ in range(max_files)]
+        self.control_queues = [ctx.Queue() for _ in range(num_processes)]
+        self.error_queue = ctx.Queue()
+        # tracebacks taken off error_queue, kept for every later error to report, e.g. on close
+        self.errors = []
+        self.metrics_queue = ctx.Queue() if metrics.enabled else None
+        self.free_slots = queue.Queue()
+        for slot in range(max_files):
+            self.free_slots.put(slot)
+        self.processes = [
+            ctx.Process(
+                target=loader_process_worker,
+                args=(address, database, control_queue, self.batch_queues, self.done_queues, self.error_queue,
+                      num_threads, parallelisation, batch_control, self.metrics_queue, commit_marker["path"], client_factory),
+                daemon=True
+                )
+            for control_queue in self.control_queues
+            ]
+        for process in self.processes:
+            process.start()
+
+    def raise_process_errors(self):
+        '''@usage raise with the tracebacks the loader processes reported, or their exit codes if any failed without one'''
+        while True:
+            try:
+                self.errors.append(self.error_queue.get(timeout=0.1))
+            except queue.Empty:
+                break
+        if self.errors:
+            raise RuntimeError("loader process failed:\n" + "\n".join(self.errors))
+        if any(process.exitcode not in (None, 0) for process in self.processes):
+            raise RuntimeError(f"loader process exit codes: {[process.exitcode for process in self.processes]}")
+
+    def check_processes(self):
+        '''@usage raise if any loader process has exited before close'''
+        if all(process.is_alive() for process in self.processes):
+            return
+        self.raise_process_errors()
+        raise RuntimeError(f"loader process exit codes: {[process.exitcode for process in self.processes]}")
+
+    def put(
+        self,
+        batch_queue,
+        item,
+        timeout=1
+        ):
+        '''@usage put an item on a bounded queue, checking on the loader processes while it is full'''
+        while True:
+            absorb_metrics(self.metrics_queue)
+            try:
+                batch_queue.put(item, timeout=timeout)
+                return
+            except queue.Full:
+                self.check_processes()
+
+    def insert(
+        self,
+        queries,
+        journal=None,
+        dead_letter_path=None,
+        source=None,
+        check_inserted=False
+        ):
+        '''
+        @usage carry out one file's insert queries on the pool, waiting for a free slot first
+        @param queries: list or iterator of string
+        @param journal: optional (journal_path, key, committed) tuple, see insert_data_bulk
+        @param dead_letter_path: optional path to dead-letter file, see insert_data_bulk
+        @param source: string identifying the queries in the dead-letter file; defaults to the journal key
+        @param check_inserted: if True, a match-insert query that matches nothing fails, see write_query_batch
+        @return None
+        '''
+        journal_path, journal_key, committed = journal if journal else (None, None, None)
+        options = {
+            "journal_path": journal_path,
+            "journal_key": journal_key,
+            "dead_letter_path": dead_letter_path,
+            "source": source or journal_key,
+            "check_inserted": check_inserted
+            }
+        slot = self.free_slots.get()
+        batch_queue, done_queue = self.batch_queues[slot], self.done_queues[slot]
+        outcomes = []
+        start_time = time.time()
+        for control_queue in self.control_queues:
+            control_queue.put((slot, options))
+        try:
+            if journal:
+                queries = skip_committed_queries(queries, committed)
+            elif dead_letter_path:
+                queries = enumerate(queries)
+            for batch in generate_query_batches(queries, self.min_batch_size):
+                self.put(batch_queue, batch)
+                if metrics.enabled:
+                    metrics.set_queue_depth(f"loader_slot_{slot}", queue_size(batch_queue))
+                # stop feeding a file that failed in any process
+                try:
+                    outcomes.append(done_queue.get_nowait())
+                except queue.Empty:
+                    pass
+                if any(outcomes):
+                    break
+        finally:
+            # one sentinel per process ends the file, also if generating its queries failed
+            for _ in self.processes:
+                self.put(batch_queue, None)
+            try:
+                while len(outcomes) < len(self.processes):
+                    absorb_metrics(self.metrics_queue)
+                    try:
+                        outcomes.append(done_queue.get(timeout=0.1))
+                    except queue.Empty:
+                        self.check_processes()
+            finally:
+                absorb_metrics(self.metrics_queue)
+                metrics.clear_queue_depth(f"loader_slot_{slot}")
+            # a slot is only reused once every process is done with it
+            self.free_slots.put(slot)
+        errors = [outcome for outcome in outcomes if outcome]
+        if errors:
+            raise RuntimeError("loader process failed:\n" + "\n".join(errors))
+        elapsed = time.time() - start_time
+        print(f'Time elapsed {elapsed:.1f} seconds')
+
+    def close(self):
+        '''@usage stop the loader processes once they are done, raising if any failed'''
+        for control_queue in self.control_queues:
+            control_queue.put(None)
+        while any(process.is_alive() for process in self.processes):
+            absorb_metrics(self.metrics_queue)
+            for process in self.processes:
+                process.join(timeout=0.1)
+        absorb_metrics(self.metrics_queue)
+        self.raise_process_errors()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def insert_data_bulk_multiprocess(
+    address,
+    database,
+    queries,
+    num_processes=4,
+    num_threads=1,
+    batch_size=250,
+    parallelisation=1,
+    journal=None,
+    min_batch_size=None,
+    max_batch_size=None,
+    target_latency=2.0,
+    max_retries=5,
+    dead_letter_path=None,
+    source=None,
+    check_inserted=False
+    ):
+    '''
+    @usage Carry out insert queries in bulk on a LoaderPool of its own, started for the call and stopped after.
+        To load several files, start one LoaderPool for them all instead
+    @param address: typedb server address, "host:port"
+    @param database: database
+    @param queries: list or iterator of string
+    @param num_processes: integer, number of loader processes
+    @param num_threads: integer, number of writer threads per process
+    @param batch_size: integer, initial number of queries to commit in one transaction
+    @param parallelisation: integer, client parallelisation in each process
+    @param journal: optional (journal_path, key, committed) tuple, see insert_data_bulk
+    @param min_batch_size: integer, smallest batch size; defaults to batch_size
+    @param max_batch_size: integer, largest batch size; defaults to batch_size
+    @param target_latency: seconds per commit the writers aim for
+    @param max_retries: integer, number of retries after a write conflict
+    @param dead_letter_path: optional path to dead-letter file, see insert_data_bulk
+    @param source: string identifying the queries in the dead-letter file; defaults to the journal key
+    @param check_inserted: if True, a match-insert query that matches nothing fails, see write_query_batch
+    @return None
+    '''
+    with LoaderPool(
+        address,
+        database,
+        num_processes=num_processes,
+        num_threads=num_threads,
+        parallelisation=parallelisation,
+        batch_size=batch_size,
+        min_batch_size=min_batch_size,
+        max_batch_size=max_batch_size,
+        target_latency=target_latency,
+        max_retries=max_retries
+    ) as pool:
+        pool.insert(queries, journal=journal, dead_letter_path=dead_letter_path, source=source, check_inserted=check_inserted)
+    return None
@@ -0,0 +1,253 @@
+import pandas as pd
+
+
+def parse_attribute_mapping(
+    mapping,
+    dict_attr_valuetype
+    ):
+    '''
+    @usage parse one "has {attr} <{column}>" mapping
+    @param mapping: string, optionally prefixed by a roleplayer variable: "$x has {attr} <{column}>"
+    @param dict_attr_valuetype: attribute valuetype
+    @return (column, attr, valuetype) tuple
+    '''
+    column = mapping.split("<")[1].rstrip(">").strip()
+    attr = mapping.split(" <")[0].split("has ")[1].strip()
+    return column, attr, dict_attr_valuetype[attr]
+
+
+def compile_entity_template(
+    isa_type,
+    mappings,
+    dict_attr_valuetype
+    ):
+    '''
+    @usage compile entity insert mappings once, to render any number of data chunks with render_entity_queries
+    @param isa_type: typedb_type, string
+    @param mappings: list of string: "has {attr} <{column_selected}>"
+    @param dict_attr_valuetype: attribute valuetype
+    @return template dict
+    '''
+    return {
+        "head": f"insert $x isa {isa_type}",
+        "attributes": [parse_attribute_mapping(mapping, dict_attr_valuetype) for mapping in mappings]
+        }
+
+
+def compile_relation_template(
+    isa_type,
+    mappings,
+    dict_attr_valuetype
+    ):
+    '''
+    @usage compile relation insert mappings once, to render any number of data chunks with render_relation_queries
+    @param isa_type: typedb_type, string
+    @param mappings:
+        "has {0} <{1}>".format(select_sub,column_selected) for RELATION attributes
+        "{0} isa {1}; {0} has {2} <{3}> ... {4} : {0}".format(rp_var, rp_type, rp_attr_type, column_selected, role) for ROLEPLAYER attributes
+    @param dict_attr_valuetype: attribute valuetype
+    @return template dict
+    '''
+    roleplayers = []
+    attributes = []
+    for mapping in mappings:
+        if " ... " in mapping:
+            match_part, role_part = mapping.split(" ... ")
+            stumps = [stump.strip() for stump in match_part.split(";")]
+            isa = stumps[0] if " isa " in stumps[0] else None
+            list_stump_has = stumps[1:] if isa else stumps
+            if not list_stump_has:
+                raise ValueError(f"role player {mapping.split(' ')[0]} must have unique attributes but has none")
+            roleplayers.append({
+                "var": mapping.split(" ")[0],
+                "isa": isa,
+                "attributes": [parse_attribute_mapping(stump, dict_attr_valuetype) for stump in list_stump_has],
+                "role": role_part.strip()
+                })
+        else:
+            attributes.append(parse_attribute_mapping(mapping, dict_attr_valuetype))
+    if not roleplayers:
+        raise ValueError("relation insert queries must match roleplayers to roles")
+    return {
+        "isa_type": isa_type,
+        "roleplayers": roleplayers,
+        "tail": "; insert (" + ", ".join(rp["role"] for rp in roleplayers) + f") isa {isa_type}",
+        "attributes": attributes
+        }
+
+
+def format_values(
+    series,
+    valuetype
+    ):
+    '''
+    @usage render a column of attribute values as TypeQL literals, e.g. 'O\\'Brien' for strings
+    @param series: pandas.Series of values
+    @param valuetype: attribute valuetype, e.g. STRING
+    @return pandas.Series of strings
+    '''
+    values = series.astype(str)
+    if valuetype == "STRING":
+        values = values.str.replace("\\", "\\\\", regex=False).str.replace("'", "\\'", regex=False)
+        return "'" + values + "'"
+    if valuetype == "BOOLEAN":
+        return values.str.lower()
+    return values
+
+
+def missing_mask(
+    series
+    ):
+    '''
+    @usage null mask of a column: missing values and empty strings
+    @param series: pandas.Series
+    @return numpy boolean array
+    '''
+    return (series.isna() | (series.astype(str) == "")).to_numpy()
+
+
+def render_attribute_clauses(
+    df,
+    attributes,
+    prefix,
+    keep_missing=False
+    ):
+    '''
+    @usage render one attribute clause column per attribute mapping, with "" where the value is missing
+    @param df: data table
+    @param attributes: list of (column, attr, valuetype) tuples
+    @param prefix: string to put before "has", e.g. ", " or "; $start "
+    @param keep_missing: if True, render missing values as empty literals rather than dropping the clause
+    @return list of lists of strings, one list per attribute
+    '''
+    list_clauses = []
+    for column, attr, valuetype in attributes:
+        series = df[column]
+        mask = missing_mask(series)
+        if keep_missing:
+            series = series.where(~mask, "")
+        clauses = f"{prefix}has {attr} " + format_values(series, valuetype)
+        if not keep_missing:
+            clauses = clauses.where(~mask, "")
+        list_clauses.append(clauses.tolist())
+    return list_clauses
+
+
+def render_entity_queries(
+    template,
+    df
+    ):
+    '''
+    @usage render TypeQL insert queries, one per row of df, from a template compiled by compile_entity_template.
+        Attribute clauses whose value is missing are left out, using null masks computed per column up front.
+    @param template: template dict
+    @param df: data table
+    @return list of TypeQL insert queries: ["insert $x isa officer, has name 'Lisette'; ", ...]
+    '''
+    head = template["head"]
+    list_clauses = render_attribute_clauses(df, template["attributes"], ", ")
+    if not list_clauses:
+        return [head + "; "] * df.shape[0]
+    return [head + "".join(clauses) + "; " for clauses in zip(*list_clauses)]
+
+
+def render_relation_queries(
+    template,
+    df
+    ):
+    '''
+    @usage render TypeQL match-insert queries, one per row of df, from a template compiled by compile_relation_template.
+        Relation attribute clauses whose value is missing are left out. Roleplayer attribute clauses are always kept,
+        since a match without them would hit every instance of the roleplayer type.
+    @param template: template dict
+    @param df: data table
+    @return list of TypeQL match-insert queries
+    '''
+    list_clauses = []
+    for rp in template["roleplayers"]:
+        if rp["isa"]:
+            list_clauses.append(["; " + rp["isa"]] * df.shape[0])
+        list_clauses.extend(render_attribute_clauses(df, rp["attributes"], f"; {rp['var']} ", keep_missing=True))
+    tail = template["tail"]
+    list_clauses.append([tail] * df.shape[0])
+    list_clauses.extend(render_attribute_clauses(df, template["attributes"], ", "))
+    # every roleplayer clause starts with "; ", the first of which is dropped after "match"
+    return ["match " + "".join(clauses)[2:] + "; " for clauses in zip(*list_clauses)]
+
+
+def render_relation_delete_queries(
+    template,
+    df
+    ):
+    '''
+    @usage render TypeQL match-delete queries, one per row of df, that delete the relations render_relation_queries
+        would insert for the same rows: those between the same roleplayers with the same attribute values.
+        Relations are matched by their exact type with isa!, since e.g. a same_as delete would otherwise also
+        delete the same_name_as and other relations between the same nodes whose types are subtypes of same_as
+    @param template: template dict, from compile_relation_template
+    @param df: data table
+    @return list of TypeQL match-delete queries
+    '''
+    isa_type = template["isa_type"]
+    tail = template["tail"].replace("; insert (", "; $rel (", 1).replace(f") isa {isa_type}", f") isa! {isa_type}", 1)
+    return [query + f"delete $rel isa! {isa_type}; " for query in render_relation_queries(dict(template, tail=tail), df)]
+
+
+def render_entity_delete_queries(
+    isa_type,
+    ids,
+    id_valuetype="STRING",
+    id_attr="id"
+    ):
+    '''
+    @usage render TypeQL match-delete queries, one per id, that delete the entity of type isa_type with that id
+    @param isa_type: typedb entity type, string
+    @param ids: pandas.Series of ids
+    @param id_valuetype: valuetype of the id attribute
+    @param id_attr: key attribute type
+    @return list of TypeQL match-delete queries
+    '''
+    return [
+        f"match $x isa {isa_type}, has {id_attr} {value}; delete $x isa {isa_type}; "
+        for value in format_values(ids, id_valuetype)
+        ]
+
+
+def render_entity_update_queries(
+    template,
+    df,
+    key_attributes,
+    id_column="_id",
+    id_attr="id"
+    ):
+    '''
+    @usage render the TypeQL queries that bring the attributes of existing entities to those of the rows of df,
+        as (match-delete, match-insert) pairs, one per row and attribute, to be written together in one transaction:
+        the delete removes the attribute's values that differ from the row's, and the insert adds the row's value
+        unless the entity has it already; it is None where the row has no value. Key attributes are left alone,
+        since TypeDB rejects a commit that leaves an entity without its key. The entity keeps its relations.
+    @param template: template dict, from compile_entity_template
+    @param df: data table
+    @param key_attributes: attribute types owned as @key, from introspect_schema
+    @param id_column: column holding the id
+    @param id_attr: key attribute type to match entities by
+    @return list of (match-delete query, match-insert query or None) tuples
+    '''
+    isa_type = template["head"].split(" isa ")[1]
+    id_valuetype = next(valuetype for column, attr, valuetype in template["attributes"] if attr == id_attr)
+    matches = [f"match $x isa {isa_type}, has {id_attr} {value}" for value in format_values(df[id_column], id_valuetype)]
+    pairs = []
+    for column, attr, valuetype in template["attributes"]:
+        if attr in key_attributes:
+            continue
+        mask = missing_mask(df[column])
+        values = format_values(df[column], valuetype)
+        for match, value, missing in zip(matches, values, mask):
+            if missing:
+                pairs.append((f"{match}, has {attr} $a; delete $x has $a; ", None))
+            else:
+                pairs.append((
+                    f"{match}, has {attr} $a; $a != {value}; delete $x has $a; ",
+                    f"{match}; not {{ $x has {attr} {value}; }}; insert $x has {attr} {value}; "
+                    ))
+    return pairs
@@ -0,0 +1,235 @@
+import gzip
+import hashlib
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice, repeat
+
+from .journal import file_sha256
+from .metrics import metrics
+
+export_manifest_name = "manifest.json"
+
+
+def shard_file(
+    key,
+    index
+    ):
+    '''@usage path of a shard of an input file's queries, relative to the export directory'''
+    return os.path.splitext(key)[0] + f"-{index:05d}.jsonl.gz"
+
+
+def write_shard(
+    dir_out,
+    file,
+    first,
+    queries,
+    compresslevel=6
+    ):
+    '''
+    @usage compress and write one shard of queries, one json string per line, since values may span lines
+    @param dir_out: export directory
+    @param file: path of the shard, relative to dir_out
+    @param first: offset of the shard's first query within its input file
+    @param queries: list of queries
+    @param compresslevel: integer, gzip compression level
+    @return shard dict: file, first, number of queries and sha256 of the compressed bytes
+    '''
+    data = gzip.compress("".join(json.dumps(query) + "\n" for query in queries).encode(), compresslevel)
+    path = os.path.join(dir_out, file)
+    with open(path + ".tmp", "wb") as f:
+        f.write(data)
+    os.replace(path + ".tmp", path)
+    return {"file": file, "first": first, "queries": len(queries), "sha256": hashlib.sha256(data).hexdigest()}
+
+
+def export_file_queries(
+    queries,
+    dir_out,
+    key,
+    executor,
+    shard_size=50000,
+    compresslevel=6
+    ):
+    '''
+    @usage cut one input file's queries into shards, compressed and written on the executor's threads
+        while the next shard's queries are generated
+    @param queries: iterator of queries
+    @param dir_out: export directory
+    @param key: string identifying the input file
+    @param executor: concurrent.futures executor to write the shards on
+    @param shard_size: integer, number of queries per shard
+    @param compresslevel: integer, gzip compression level
+    @return list of shard dicts, see write_shard, in order
+    '''
+    os.makedirs(os.path.dirname(os.path.join(dir_out, shard_file(key, 0))), exist_ok=True)
+    queries = iter(queries)
+    pending = deque()
+    shards = []
+    first = 0
+    while True:
+        shard_queries = list(islice(queries, shard_size))
+        if not shard_queries:
+            break
+        pending.append(executor.submit(write_shard, dir_out, shard_file(key, len(shards) + len(pending)), first, shard_queries, compresslevel))
+        first += len(shard_queries)
+        # keep at most two shards per file in memory awaiting compression
+        while len(pending) > 2:
+            shards.append(pending.popleft().result())
+    shards.extend(future.result() for future in pending)
+    return shards
+
+
+def export_queries(
+    dir_out,
+    prepare,
+    dict_key_path,
+    dict_key_type,
+    dependencies,
+    schema_file,
+    chunk_size=None,
+    materialise_rules=False,
+    shard_size=50000,
+    num_workers=4,
+    concurrent_files=2,
+    compresslevel=6
+    ):
+    '''
+    @usage generate every input file's queries and write them as sharded, gzipped json lines, with a manifest
+        of the shards, for replay_shard_queries to load later or elsewhere without the csv files or pandas.
+        The manifest is only written once every shard is, so an interrupted export cannot be replayed.
+    @param dir_out: export directory
+    @param prepare: dict of input file key to function that starts generating its queries
+    @param dict_key_path: dict of input file key to path, to record the hash of
+    @param dict_key_type: dict of input file key to the type it inserts
+    @param dependencies: dict of input file key to the set of keys that must be loaded before it
+    @param schema_file: path to the TypeQL schema the queries were generated against
+    @param chunk_size: integer, csv chunk size, which sets the order of relation queries
+    @param materialise_rules: whether the queries include materialised inferred relations
+    @param shard_size: integer, number of queries per shard
+    @param num_workers: integer, number of threads compressing and writing shards
+    @param concurrent_files: integer, number of files to generate queries for at once
+    @param compresslevel: integer, gzip compression level
+    @return export manifest dict
+    '''
+    manifest_path = os.path.join(dir_out, export_manifest_name)
+    os.makedirs(dir_out, exist_ok=True)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    with ThreadPoolExecutor(num_workers) as shard_executor, ThreadPoolExecutor(concurrent_files) as file_executor:
+        futures = {
+            key: file_executor.submit(
+                lambda key: export_file_queries(prepare[key](), dir_out, key, shard_executor, shard_size, compresslevel), key
+                )
+            for key in prepare
+            }
+        files = {}
+        for key, future in futures.items():
+            shards = future.result()
+            files[key] = {
+                "type": dict_key_type[key],
+                "sha256": file_sha256(dict_key_path[key]),
+                "queries": sum(shard["queries"] for shard in shards),
+                "shards": shards
+                }
+            print(f"{key}: {files[key]['queries']} queries in {len(shards)} shards")
+    manifest = {
+        "schema_sha256": file_sha256(schema_file),
+        "chunk_size": chunk_size,
+        "materialise_rules": materialise_rules,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "files": files,
+        "dependencies": {key: sorted(dependencies.get(key, ())) for key in files}
+        }
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1)
+    os.replace(manifest_path + ".tmp", manifest_path)
+    return manifest
+
+
+def load_export_manifest(
+    dir_in,
+    schema_file
+    ):
+    '''
+    @usage read the manifest of an export, to replay it
+    @param dir_in: export directory
+    @param schema_file: path to the TypeQL schema, which must be the one the queries were generated against
+    @return export manifest dict, see export_queries
+    '''
+    path = os.path.join(dir_in, export_manifest_name)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"no export manifest at {path}; export the queries with --export, and let it finish")
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest["schema_sha256"] != file_sha256(schema_file):
+        raise ValueError(f"{schema_file} changed since the queries in {dir_in} were exported; export them again")
+    return manifest
+
+
+def read_shard(
+    dir_in,
+    shard
+    ):
+    '''
+    @usage read one shard's queries, checking it against the checksum and count in the manifest
+    @param dir_in: export directory
+    @param shard: shard dict from the export manifest
+    @return list of queries
+    '''
+    with open(os.path.join(dir_in, shard["file"]), "rb") as f:
+        data = f.read()
+    if hashlib.sha256(data).hexdigest() != shard["sha256"]:
+        raise ValueError(f"{shard['file']} does not match the checksum in the export manifest")
+    queries = [json.loads(line) for line in gzip.decompress(data).decode().splitlines()]
+    if len(queries) != shard["queries"]:
+        raise ValueError(f"{shard['file']} has {len(queries)} queries, not the {shard['queries']} in the export manifest")
+    return queries
+
+
+def shard_committed(
+    shard,
+    committed
+    ):
+    '''@usage whether a journal's committed [start, stop) ranges cover a whole shard'''
+    first, stop = shard["first"], shard["first"] + shard["queries"]
+    return any(start <= first and stop <= end for start, end in committed)
+
+
+def replay_shard_queries(
+    dir_in,
+    shards,
+    committed=(),
+    read_ahead=4
+    ):
+    '''
+    @usage stream an input file's exported queries in their original order, reading, checking and
+        decompressing up to read_ahead shards at once ahead of the writers.
+        Shards the journal records as committed in full are not read: a None stands in for each of their
+        queries, to keep the offsets of the rest, and is then skipped with the other committed queries.
+    @param dir_in: export directory
+    @param shards: list of shard dicts from the export manifest
+    @param committed: list of [start, stop) query offset ranges already committed, from the journal
+    @param read_ahead: integer, number of shards to read at once
+    @return an iterator that yields queries
+    '''
+    with ThreadPoolExecutor(read_ahead) as executor:
+        pending = deque()
+        shards = iter(shards)
+        while True:
+            for shard in islice(shards, read_ahead - len(pending)):
+                if shard_committed(shard, committed):
+                    pending.append((shard, None))
+                else:
+                    pending.append((shard, executor.submit(read_shard, dir_in, shard)))
+            if not pending:
+                return
+            shard, future = pending.popleft()
+            if future is None:
+                yield from repeat(None, shard["queries"])
+                continue
+            with metrics.stage("shard_read"):
+                queries = future.result()
+            yield from queries
@@ -0,0 +1,165 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from .metrics import metrics
+
+_end_of_items = object()
+
+
+class PrefetchedIterator:
+    '''
+    @usage iterator over the items that a prefetch thread puts in a buffer. Closing it stops the thread,
+        also if it was never iterated, e.g. when a task it was prepared for does not run
+    '''
+
+    def __init__(
+        self,
+        buffer,
+        stop,
+        errors,
+        name
+        ):
+        # only the thread's buffer, stop event and errors are shared, so that an iterator given up on
+        # is garbage collected, and closed, while the thread still runs
+        self.buffer = buffer
+        self.stop = stop
+        self.errors = errors
+        self.name = name
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.stop.is_set():
+            raise StopIteration
+        item = self.buffer.get()
+        if item is _end_of_items:
+            self.close()
+            if self.errors:
+                raise self.errors[0]
+            raise StopIteration
+        if metrics.enabled:
+            metrics.set_queue_depth(self.name, self.buffer.qsize())
+        return item
+
+    def close(self):
+        '''@usage stop the thread, e.g. when the consumer gives up early because a write failed'''
+        self.stop.set()
+        metrics.clear_queue_depth(self.name)
+
+    def __del__(self):
+        self.close()
+
+
+def prefetch(
+    iterator,
+    buffer_size=10000,
+    name="prefetch"
+    ):
+    '''
+    @usage start advancing an iterator in a background thread right away, so that e.g. csv parsing and
+        query generation for one file run ahead while another file is still inserting
+    @param iterator: any iterator, e.g. from stream_entity_insert_queries
+    @param buffer_size: integer, max number of items to run ahead by
+    @param name: name under which the buffer depth is reported to metrics
+    @return a PrefetchedIterator over the same items
+    '''
+    buffer = queue.Queue(maxsize=buffer_size)
+    stop = threading.Event()
+    errors = []
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def producer():
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+        except Exception as e:
+            errors.append(e)
+        put(_end_of_items)
+
+    threading.Thread(target=producer, daemon=True).start()
+    return PrefetchedIterator(buffer, stop, errors, name)
+
+
+def close_items(items):
+    '''@usage close an iterator prepared for a task, if it can be closed, to stop any thread producing its items'''
+    close = getattr(items, "close", None)
+    if close is not None:
+        close()
+
+
+def run_dependency_schedule(
+    tasks,
+    dependencies,
+    max_workers=2,
+    prepare=None
+    ):
+    '''
+    @usage run tasks concurrently, starting each one as soon as all the tasks it depends on have completed
+        and a worker is free, so that the wall-clock time approaches that of the critical path.
+        Tasks are prepared only for free workers: a task when it starts, or ahead of time, while a worker is free
+        but no task can start, once everything it depends on is running, e.g. to generate its queries while
+        its dependencies are still inserting. What prepare returned is closed once its task completes,
+        and, should a task fail, also for the tasks that will not run
+    @param tasks: dict of task name to function; called without arguments, or with the result of prepare
+    @param dependencies: dict of task name to set of task names it must wait for
+    @param max_workers: integer, max number of tasks to run, or to prepare, at once
+    @param prepare: optional dict of task name to function without arguments, whose result is passed to the task
+    @return None. Raises the first task failure, after letting running tasks finish
+    '''
+    prepare = prepare or {}
+    unknown = {dep for deps in dependencies.values() for dep in deps} - set(tasks)
+    if unknown:
+        raise ValueError(f"dependencies on unknown tasks: {unknown}")
+    waiting = {name: set(dependencies.get(name, ())) for name in tasks}
+    running = {}
+    prepared = {}
+    errors = []
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            while waiting or running:
+                if not errors:
+                    for name in [name for name, deps in waiting.items() if not deps]:
+                        if len(running) >= max_workers:
+                            break
+                        del waiting[name]
+                        if name in prepare:
+                            items = prepared.pop(name) if name in prepared else prepare[name]()
+                            running[executor.submit(tasks[name], items)] = (name, items)
+                        else:
+                            running[executor.submit(tasks[name])] = (name, None)
+                    # look ahead: on workers that are still free, prepare tasks that can start as soon as running tasks complete
+                    names_running = {name for name, items in running.values()}
+                    for name, deps in waiting.items():
+                        if len(running) + len(prepared) >= max_workers:
+                            break
+                        if name in prepare and name not in prepared and deps <= names_running:
+                            prepared[name] = prepare[name]()
+                if not running:
+                    if waiting and not errors:
+                        raise ValueError(f"circular dependencies between tasks: {set(waiting)}")
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, items = running.pop(future)
+                    close_items(items)
+                    if future.exception() is not None:
+                        errors.append(future.exception())
+                        continue
+                    for deps in waiting.values():
+                        deps.discard(name)
+    finally:
+        for items in prepared.values():
+            close_items(items)
+    if errors:
+        raise errors[0]
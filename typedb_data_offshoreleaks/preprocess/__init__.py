@@ -0,0 +1,2 @@
+from .format_data import *
+from .preprocess import *
@@ -0,0 +1,21 @@
+# format dates, names and corporate abbreviations of the raw csv files, and split relationships by type
+# @usage
+# python3 -m typedb_data_offshoreleaks.preprocess --dir_raw data/raw --dir_out data/preprocessed
+
+import sys
+from timeit import default_timer as timer
+
+from .preprocess import check_fixtures, preprocess_parser, run_preprocessing
+
+if __name__ == "__main__":
+    args = preprocess_parser().parse_args()
+    if args.check:
+        failures = check_fixtures()
+        for file, chunksize in failures:
+            print(f"{file}: output differs from the expected output at chunk size {chunksize}")
+        print("fixtures match" if not failures else f"{len(failures)} fixture checks failed")
+        sys.exit(1 if failures else 0)
+    start = timer()
+    for path in run_preprocessing(args.dir_raw, args.dir_out, args.num_processes, args.chunk_size):
+        print(f"wrote {path}")
+    print(f"preprocessing done in {timer() - start:.1f} seconds")
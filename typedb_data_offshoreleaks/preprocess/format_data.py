@@ -0,0 +1,578 @@
+import io
+import os
+import re
+import warnings
+from functools import lru_cache
+
+import pandas as pd
+
+# raw date patterns, in the order in which they are reformatted to yyyy-mm-dd. As in format_data.R,
+# a pattern is applied only if it appears verbatim in the date_entry_regex option
+pattern_date_dd_mon_yyyy = r"^\d\d-\D\D\D-\d\d\d\d$"  # 30-MAY-1991
+pattern_date_numeric = r"^\d\d?[/.-]\d\d?[/.-]\d\d\d?\d?$"  # 04[/.-]02[/.-]2005
+pattern_date_ddmmyyyy = r"^\d\d\d\d\d\d\d\d$"  # 02121999
+pattern_date_mon_dd_yyyy = r"^\D\D\D \d\d \d\d\d\d$"  # Sep 25 2012
+pattern_date_yyyy = r"^\d\d\d\d$"  # 2012
+default_date_entry_regex = "|".join([
+    pattern_date_dd_mon_yyyy,
+    pattern_date_numeric,
+    pattern_date_ddmmyyyy,
+    pattern_date_mon_dd_yyyy,
+    pattern_date_yyyy
+    ])
+pattern_date_typeql = re.compile(r"^(\d\d\d\d)-(\d\d)-(\d\d)$")
+month_names = ["JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"]
+days_in_month = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+
+# a word, as delimited by the ICU word break rules that R's str_to_title follows: letters, digits and
+# underscores, joined by . : or ' between letters, and by . , ; or ' between digits
+pattern_word = re.compile(r"(?:\w|(?<=[^\W\d_])[.:'](?=[^\W\d_])|(?<=\d)[.,;'](?=\d))+")
+# where words differ from those of Python's str.title: letters following a digit or underscore, or joined to a letter
+pattern_title_differs = r"[\d_][^\W\d_]|[^\W\d_][.:'][^\W\d_]"
+
+# https://en.wikipedia.org/wiki/List_of_legal_entity_types_by_country#
+# Purpose: TypeDB rules require exact matches (case-sensitive) to identify e.g. identically named entities
+# NB: only most prevalent company forms, not exhaustive. Patterns are matched case-insensitively,
+# in this order, after title casing; copied verbatim from format_data.R
+company_replacement = [
+    # UK, commonwealth
+    (" Ltd.", r" Limited$| Ltd$"),
+    (" PLC", r" P\.?L\.?C\.?$"),
+    (" LP", r" L\.?P\.?$"),
+    (" LLP", r" L\.?L\.?P\.?$"),  # NB: must be replaced after LP
+    (" SLP", r" S\.?L\.?P\.?$"),  # Scottish limited partnership
+    # US
+    (" Inc.", r" Incorporated$| Inc$| Corp\.?$| Corporation$"),
+    (" LP", r" L\.?P\.?$"),
+    (" LLC", r" L\.?L\.?C\.?$| L\.?C\.?$| Ltd\.? Co\.?$"),
+    (" PLLC", r" P\.?L\.?L\.?C\.?$"),  # NB: must be replaced after LLC
+    (" PC", r" P\.?C\.?$"),  # professional corporation
+    # Latin
+    (" Ltda.", r" Ltda\.?$"),
+    (" S.A.", r" S\.?A\.?$"),  # societé anonyme / Sociedade anônima / Sociedad Anonima
+    (" S.A.S.", r" S\.?A\.?S\.?$"),  # Sociedad Anonima Simplificada
+    # Francophone
+    (" SPRL", r" S\.?P\.?R\.?L\.?$"),  # société privée à responsabilité limitée
+    (" SRL", r" S\.?R\.?L\.?$"),  # société responsabilité limitée
+    # Dutch
+    (" N.V.", r" Naamloze vennootschap$| N\.?V\.?$"),
+    (" B.V.", r" besloten vennootschap$| B\.?V\.?$"),
+    # Germanophone
+    (" AG", r" A\.?G\.?$"),  # Aktiengesellschaft
+    (" GmbH", r" G\.?m\.?b\.?H\.?$"),  # Gesellschaft mit beschränkter Haftung
+    # Nordic
+    (" I/S", r" I\.?S\.?$"),
+    (" IVS", r" I\.?V\.?S\.?$"),
+    (" ApS", r" A\.?P\.?S\.?$"),
+    (" A/S", r" A\.?S\.?$"),
+    (" K/S", r" Kommanditselskab$|K\.?S\.?$"),
+    # Aruba
+    (" A.V.V.", r" A\.?V\.?V\.?$"),
+    # Aruba and Barbados
+    (" I.L.", r" I\.L\.?$")
+    ]
+pattern_company_form = re.compile("|".join(f"(?:{pattern})" for abbreviation, pattern in company_replacement), re.IGNORECASE)
+
+# column types, as data.table::fread infers them, from the narrowest
+column_type_order = ["logical", "integer", "double", "character"]
+logical_values = {
+    "TRUE": "TRUE", "True": "TRUE", "true": "TRUE", "T": "TRUE",
+    "FALSE": "FALSE", "False": "FALSE", "false": "FALSE", "F": "FALSE"
+    }
+pattern_integer = r"[-+]?\d{1,18}"
+pattern_double = r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?"
+quote_needed = [",", '"', "\n", "\r"]
+# at a quote: a quoted field of nothing or only blanks, the blanks after an opening quote, both only where a field may start,
+# or a closing quote after blanks. Which of these quotes open or close a field, rather than being within one,
+# is told by the number of quotes before them
+pattern_quoted_blanks = re.compile(
+    r'"(?:(?<![^,\n \t]")(?:(?P<empty>[ \t]*")(?=,|\r?$)|(?P<leading>[ \t]+))|(?<=[ \t]")(?P<trailing>)(?=,|\r?$))',
+    re.MULTILINE
+    )
+# stands in for quoted empty fields while pandas parses, which would read them as missing like unquoted ones
+quoted_empty_marker = "\ue000"
+# stand in for the blanks padding quoted fields, which fread keeps, while the unquoted fields are stripped
+quoted_blank_markers = str.maketrans({" ": "\ue001", "\t": "\ue002"})
+unmark_quoted_blanks = str.maketrans({"\ue001": " ", "\ue002": "\t"})
+
+
+def starts_field(
+    text,
+    position
+    ):
+    '''@usage whether a position in csv text starts a field, past any blanks before it'''
+    while position and text[position - 1] in " \t":
+        position -= 1
+    return not position or text[position - 1] in ",\n"
+
+
+def mark_quoted_blanks(text):
+    '''
+    @usage replace quoted empty fields, and quoted fields of only blanks, which str_squish empties, with a quoted marker,
+        since fread reads them as empty strings, and ,, as missing; and the blanks padding other quoted fields
+        with markers, since fread strips only unquoted fields
+    @param text: csv text of whole records
+    @return csv text
+    '''
+    parts = []
+    written = counted = quotes = 0
+    for match in pattern_quoted_blanks.finditer(text):
+        quotes += text.count('"', counted, match.start())
+        counted = match.start()
+        start = match.start()
+        if match.lastgroup == "trailing":
+            # an odd number of quotes before the match: it closes a quoted field, after the blanks to mark
+            if quotes % 2 == 0:
+                continue
+            while start > written and text[start - 1] in " \t":
+                start -= 1
+        # an even number of quotes before the match: it is not within a quoted field
+        elif quotes % 2 or not starts_field(text, start):
+            continue
+        parts.append(text[written:start])
+        parts.append(f'"{quoted_empty_marker}"' if match.lastgroup == "empty" else text[start:match.end()].translate(quoted_blank_markers))
+        written = match.end()
+    if not parts:
+        return text
+    parts.append(text[written:])
+    return "".join(parts)
+
+
+def read_csv_records(
+    f,
+    chunksize=None
+    ):
+    '''
+    @usage read the text of csv records, about chunksize lines at a time, never splitting a quoted field across chunks
+    @param f: file opened for reading text, with newline=""
+    @param chunksize: integer, lines per chunk; None or 0 for the rest of the file at once
+    @return iterator of strings
+    '''
+    if not chunksize:
+        yield f.read()
+        return
+    lines = []
+    quotes = 0
+    for line in f:
+        lines.append(line)
+        quotes += line.count('"')
+        # an even number of quotes so far: the chunk ends outside a quoted field
+        if len(lines) >= chunksize and quotes % 2 == 0:
+            yield "".join(lines)
+            lines = []
+            quotes = 0
+    if lines:
+        yield "".join(lines)
+
+
+def read_raw_csv(
+    path,
+    chunksize=None,
+    usecols=None
+    ):
+    '''
+    @usage read a raw csv as strings, the way data.table::fread(fill=TRUE) is documented to see it: unquoted fields stripped
+        of whitespace, quoted fields kept as they are, unquoted empty and "NA" fields missing, quoted empty fields empty strings,
+        short rows padded with missing values
+    @param path: path to csv file
+    @param chunksize: integer, rows per chunk; None or 0 to read the whole file at once
+    @param usecols: optional list of columns to read
+    @return iterator of pandas DataFrames of strings, with NaN for missing values
+    '''
+    with open(path, newline="", encoding="utf-8") as f:
+        header = next(read_csv_records(f, 1), "")
+        for text in read_csv_records(f, chunksize):
+            text = mark_quoted_blanks(text)
+            chunk = pd.read_csv(
+                io.StringIO(header + text),
+                dtype=str,
+                keep_default_na=False,
+                na_filter=False,
+                skipinitialspace=True,
+                usecols=usecols
+                )
+            chunk = chunk.fillna("").apply(lambda values: values.str.strip(" \t"))
+            if "\ue001" in text or "\ue002" in text:
+                chunk = chunk.apply(lambda values: values.str.translate(unmark_quoted_blanks))
+            chunk = chunk.where(~chunk.isin(["", "NA"]))
+            yield chunk.replace(quoted_empty_marker, "")
+
+
+def infer_column_type(values):
+    '''
+    @usage the narrowest type that data.table::fread would read all of a column's values as.
+        Empty strings, from quoted empty fields, are missing values in any but a character column
+    @param values: pandas Series of strings, with NaN for missing values
+    @return one of column_type_order, or None if all values are missing
+    '''
+    values = values.dropna()
+    values = values[values != ""]
+    if values.empty:
+        return None
+    # most columns are text: try each type on the first value before all of them
+    first = values.iloc[:1]
+    if first.isin(logical_values.keys()).all() and values.isin(logical_values.keys()).all():
+        return "logical"
+    if first.str.fullmatch(pattern_integer).all() and values.str.fullmatch(pattern_integer).all():
+        return "integer"
+    if first.str.fullmatch(pattern_double).all() and values.str.fullmatch(pattern_double).all():
+        return "double"
+    return "character"
+
+
+def combine_column_types(
+    column_type,
+    other
+    ):
+    '''
+    @usage type of a column whose values have, in parts, the two given types
+    @return one of column_type_order, or None
+    '''
+    if column_type is None or column_type == other:
+        return other
+    if other is None:
+        return column_type
+    if {column_type, other} <= {"integer", "double"}:
+        return "double"
+    return "character"
+
+
+def r_double_string(value):
+    '''
+    @usage render a number as R's as.character does for a double: 15 significant digits,
+        in fixed notation unless scientific notation is shorter
+    @param value: string parsable as a float
+    @return string
+    '''
+    number = float(value)
+    if number == 0:
+        return "0"
+    mantissa, exponent = f"{number:.14e}".split("e")
+    mantissa = mantissa.rstrip("0").rstrip(".")
+    exponent = int(exponent)
+    scientific = f"{mantissa}e{'-' if exponent < 0 else '+'}{abs(exponent):02d}"
+    digits = len(mantissa.lstrip("-").replace(".", ""))
+    fixed = f"{number:.{max(digits - 1 - exponent, 0)}f}"
+    return fixed if len(fixed) <= len(scientific) else scientific
+
+
+def render_column(
+    values,
+    column_type
+    ):
+    '''
+    @usage render a column's values as R prints them once fread has typed the column,
+        e.g. dropping the leading zeros of integers
+    @param values: pandas Series of strings, with NaN for missing values
+    @param column_type: one of column_type_order, or None
+    @return pandas Series of strings
+    '''
+    if column_type not in (None, "character"):
+        values = values.where(values != "")
+    if column_type == "logical":
+        return values.map(logical_values)
+    if column_type == "integer":
+        noncanonical = values.str.contains(r"^(?:\+|-?0\d|-0$)", na=False)
+        if noncanonical.any():
+            values = values.copy()
+            values[noncanonical] = values[noncanonical].map(lambda value: str(int(value)))
+        return values
+    if column_type == "double":
+        return values.map({value: r_double_string(value) for value in values.dropna().unique()})
+    return values
+
+
+@lru_cache(maxsize=None)
+def month_number(month):
+    '''
+    @usage month abbreviation to its number, as format_data.R does: the first month name that the entry,
+        used as a case-insensitive regex, matches; the entry is returned unchanged if none does
+    @param month: string, e.g. "May"
+    @return string, e.g. "05"
+    '''
+    for i, name in enumerate(month_names):
+        if re.search(month, name, re.IGNORECASE):
+            return f"{i + 1:02d}"
+    return month
+
+
+def format_date_dd_mon_yyyy(value):
+    parts = value.split("-")
+    parts[1] = month_number(parts[1])
+    return "-".join(reversed(parts))
+
+
+def format_date_numeric(value):
+    year, month, day = reversed(re.split(r"[/.-]", value))
+    if len(year) != 4:
+        year = ("19" if int(year) > 17 else "20") + year
+    return "-".join([year, month.rjust(2, "0"), day.rjust(2, "0")])
+
+
+def format_date_ddmmyyyy(value):
+    return "-".join([value[4:8], value[2:4], value[0:2]])
+
+
+def format_date_mon_dd_yyyy(value):
+    parts = value.split(" ")
+    return "-".join([parts[2], month_number(parts[0]), parts[1]])
+
+
+def format_date_yyyy(value):
+    return value + "-01-01"
+
+
+date_formatters = [
+    (pattern_date_dd_mon_yyyy, format_date_dd_mon_yyyy),
+    (pattern_date_numeric, format_date_numeric),
+    (pattern_date_ddmmyyyy, format_date_ddmmyyyy),
+    (pattern_date_mon_dd_yyyy, format_date_mon_dd_yyyy),
+    (pattern_date_yyyy, format_date_yyyy)
+    ]
+
+
+def format_date(
+    value,
+    date_entry_regex=default_date_entry_regex
+    ):
+    '''
+    @usage reformat one date entry to yyyy-mm-dd, trying each enabled raw pattern in turn
+    @param value: string
+    @param date_entry_regex: string, containing the raw date patterns to reformat
+    @return string, unchanged if no pattern applies
+    '''
+    for pattern, formatter in date_formatters:
+        if pattern in date_entry_regex and re.search(pattern, value):
+            value = formatter(value)
+    return value
+
+
+def is_bad_date(value):
+    '''
+    @usage whether an entry longer than two characters is not a possible date in yyyy-mm-dd format
+    @param value: string
+    @return boolean
+    '''
+    if len(value) <= 2:
+        return False
+    match = pattern_date_typeql.search(value)
+    if not match:
+        return True
+    year, month, day = (int(group) for group in match.groups())
+    if not 1 <= month <= 12:
+        return True
+    leap = month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+    return not 1 <= day <= days_in_month[month - 1] + leap
+
+
+def format_date_columns(
+    df,
+    columns,
+    date_entry_regex=default_date_entry_regex,
+    date_else=None
+    ):
+    '''
+    @usage reformat date columns in place to yyyy-mm-dd. Each distinct entry is formatted once
+    @param df: pandas DataFrame of strings
+    @param columns: list of date columns
+    @param date_entry_regex: string, containing the raw date patterns to reformat
+    @param date_else: what to put in entries that are still not dates; if None, raise an error instead
+    @return None
+    '''
+    all_good = True
+    for column in columns:
+        formatted = {value: format_date(value, date_entry_regex) for value in df[column].dropna().unique()}
+        df[column] = df[column].map(formatted).astype(object)
+        problems = df[column].isin([value for value in set(formatted.values()) if is_bad_date(value)])
+        if problems.any():
+            print(f"column {column}: {problems.sum()} remaining date formatting problem rows: "
+                  f"{','.join(str(i + 1) for i in problems.to_numpy().nonzero()[0][:6])}..")
+            if date_else is not None:
+                print(f"replacing problem date entries with '{date_else}'")
+                df.loc[problems, column] = date_else
+            else:
+                all_good = False
+    if not all_good:
+        raise ValueError("some dates not formatted correctly")
+
+
+def title_word(match):
+    word = match.group()
+    i = len(word) - len(word.lstrip("_"))
+    return word[:i] + word[i:i + 1].title() + word[i + 1:]
+
+
+def to_title(values):
+    '''
+    @usage Title Case, as R's str_to_title: within each word, title case the first letter or digit and lower case the rest
+    @param values: pandas Series of strings
+    @return pandas Series of strings
+    '''
+    values = values.str.title()
+    differs = values.str.contains(pattern_title_differs, na=False)
+    if differs.any():
+        values[differs] = values[differs].str.lower().str.replace(pattern_word, title_word, regex=True)
+    return values
+
+
+def squish(values):
+    '''@usage remove padding and repeated whitespace, as R's str_squish'''
+    # as object, since pandas infers float for a chunk whose values are all missing
+    return values.map(lambda value: " ".join(value.split()), na_action="ignore").astype(object)
+
+
+def standardise_company_forms(values):
+    '''
+    @usage replace company forms at the end of names with their abbreviation, e.g. Limited -> Ltd.
+    @param values: pandas Series of strings in Title Case
+    @return pandas Series of strings
+    '''
+    # a name that matches none of the patterns is left unchanged by all of them
+    candidates = values.str.contains(pattern_company_form, na=False)
+    if not candidates.any():
+        return values
+    forms = values[candidates]
+    for abbreviation, pattern in company_replacement:
+        forms = forms.str.replace(pattern, abbreviation, regex=True, flags=re.IGNORECASE)
+    values = values.copy()
+    values[candidates] = forms
+    return values
+
+
+def format_frame(
+    df,
+    column_types,
+    date_column_regex="date",
+    date_entry_regex=default_date_entry_regex,
+    date_else=None,
+    to_title_column_regex=None,
+    company_form_column_regex=None
+    ):
+    '''
+    @usage port of format_data.R: reformat dates to yyyy-mm-dd, put names in Title Case,
+        remove padding and repeated whitespace, and standardise company forms to their abbreviations
+    @param df: pandas DataFrame of strings, as read by read_raw_csv
+    @param column_types: dict of column to its fread type over the whole file
+    @param date_column_regex: regex to identify columns that may contain dates to reformat
+    @param date_entry_regex: string, containing the raw date patterns to reformat
+    @param date_else: what to put in entries if all date formatting fails; if None, raise an error instead
+    @param to_title_column_regex: regex to identify columns to change to Title Case
+    @param company_form_column_regex: regex to identify columns that may contain company types to reformat
+    @return pandas DataFrame of strings, with NaN for missing values
+    '''
+    df = pd.DataFrame({column: render_column(df[column], column_types.get(column)) for column in df.columns}, dtype=object)
+    columns_dates = [column for column in df.columns if re.search(date_column_regex, column)]
+    format_date_columns(df, columns_dates, date_entry_regex, date_else)
+    if to_title_column_regex is not None:
+        for column in df.columns:
+            if re.search(to_title_column_regex, column):
+                df[column] = to_title(df[column])
+    for column in df.columns:
+        df[column] = squish(df[column])
+    if company_form_column_regex is not None:
+        for column in df.columns:
+            if re.search(company_form_column_regex, column):
+                df[column] = standardise_company_forms(df[column])
+    return df
+
+
+def csv_fields(values):
+    '''
+    @usage quote fields as data.table::fwrite does: only when they contain a delimiter, quote or line break,
+        or are empty strings, to tell them apart from missing values, which are written empty
+    @param values: pandas Series of strings, with NaN for missing values
+    @return pandas Series of strings
+    '''
+    values = values.astype(object)
+    quote = values == ""
+    for character in quote_needed:
+        quote |= values.str.contains(character, regex=False, na=False)
+    if quote.any():
+        values = values.copy()
+        values[quote] = '"' + values[quote].str.replace('"', '""', regex=False) + '"'
+    return values.fillna("")
+
+
+def write_csv(
+    df,
+    f,
+    header=True
+    ):
+    '''
+    @usage append a DataFrame of strings to an open text file as csv, the way data.table::fwrite writes it
+    @param df: pandas DataFrame of strings, with NaN for missing values
+    @param f: file opened for writing text
+    @param header: boolean, whether to write the header first
+    @return None
+    '''
+    if header:
+        f.write(",".join(csv_fields(pd.Series(df.columns, dtype=object))) + "\n")
+    if df.empty:
+        return
+    fields = [csv_fields(df[column]) for column in df.columns]
+    rows = fields[0].str.cat(fields[1:], sep=",") if len(fields) > 1 else fields[0]
+    f.write("\n".join(rows) + "\n")
+
+
+def track_column_types(
+    column_types,
+    df,
+    path
+    ):
+    '''
+    @usage update the column types seen so far in a file with those of the next chunk.
+        Rows already written keep the type they were written with: warn if it changes from a non-character type,
+        as these rows may then differ from a whole-file read
+    @param column_types: dict of column to type, updated in place
+    @param df: pandas DataFrame of strings, the next chunk
+    @param path: path to the file, for the warning
+    @return None
+    '''
+    for column in df.columns:
+        column_type = column_types.get(column)
+        combined = combine_column_types(column_type, infer_column_type(df[column]))
+        if column_type not in (None, "character") and combined != column_type:
+            warnings.warn(f"{path}: column {column} changed from {column_type} to {combined} after rows were written; "
+                          "rerun with chunk_size 0 for output identical to a whole-file read")
+        column_types[column] = combined
+
+
+def output_path(
+    file,
+    dir_out=None,
+    file_out_suffix="_formatted"
+    ):
+    '''@usage path of the formatted file: file_out_suffix appended to the file name, in dir_out or next to the file'''
+    file_out = re.sub(r"\.csv$", file_out_suffix + ".csv", os.path.basename(file))
+    return os.path.join(dir_out if dir_out is not None else os.path.dirname(file), file_out)
+
+
+def format_file(
+    file,
+    dir_out=None,
+    file_out_suffix="_formatted",
+    chunksize=500000,
+    **format_options
+    ):
+    '''
+    @usage format a csv file, chunk by chunk, following format_data.R
+    @param file: path to csv file
+    @param dir_out: output directory, if different from file location
+    @param file_out_suffix: suffix for output files
+    @param chunksize: integer, rows per chunk; 0 to read the whole file at once
+    @param format_options: keyword arguments to format_frame
+    @return path to the formatted file
+    '''
+    path_out = output_path(file, dir_out, file_out_suffix)
+    column_types = {}
+    header = True
+    # write then rename, so that an interrupted run leaves no partial output
+    with open(path_out + ".tmp", "w", newline="") as f:
+        for chunk in read_raw_csv(file, chunksize):
+            track_column_types(column_types, chunk, file)
+            write_csv(format_frame(chunk, column_types, **format_options), f, header)
+            header = False
+        if header:
+            write_csv(pd.read_csv(file, nrows=0), f)
+    os.replace(path_out + ".tmp", path_out)
+    return path_out
@@ -0,0 +1,199 @@
+import argparse
+import multiprocessing
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from .format_data import (
+    format_file,
+    format_frame,
+    output_path,
+    read_raw_csv,
+    render_column,
+    infer_column_type,
+    track_column_types,
+    write_csv
+    )
+
+date_entry_regex_entities = r"^\d\d-\D\D\D-\d\d\d\d$|^\d\d?[/.-]\d\d?[/.-]\d\d\d?\d?$|^\d\d\d\d\d\d\d\d$|^\D\D\D \d\d \d\d\d\d$"
+date_entry_regex_relationships = date_entry_regex_entities + r"|^\d\d\d\d$"
+
+# format_data options per raw file, as preprocess.sh passes them to format_data.R
+dict_file_options = {
+    "nodes-entities_clean.csv": {
+        "date_column_regex": ".*date$",
+        "date_entry_regex": date_entry_regex_entities,
+        "date_else": "",
+        "to_title_column_regex": "name|original_name|formner_name|address",
+        "company_form_column_regex": "name|original_name|former_name"
+        },
+    "nodes-officers_clean.csv": {
+        "to_title_column_regex": "name|address",
+        "company_form_column_regex": "name"
+        },
+    "nodes-intermediaries_clean.csv": {
+        "to_title_column_regex": "name|address",
+        "company_form_column_regex": "name"
+        },
+    "nodes-addresses_clean.csv": {
+        "to_title_column_regex": "name|address",
+        "company_form_column_regex": "name"
+        },
+    "nodes-others_clean.csv": {
+        "date_column_regex": ".*date$",
+        "to_title_column_regex": "name|address",
+        "company_form_column_regex": "name"
+        }
+    }
+relationships_file = "relationships_clean.csv"
+relationships_options = {
+    "date_column_regex": ".*date$",
+    "date_entry_regex": date_entry_regex_relationships,
+    "date_else": ""
+    }
+org_entity_file = "nodes-entities_clean.csv"
+# raw files, named as the raw files whose options they are formatted with, and the output expected for them,
+# written by hand from data.table's documentation rather than by running format_data.R
+dir_fixtures = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+def read_entity_ids(
+    path,
+    id_column="_id"
+    ):
+    '''
+    @usage the ids of a node file, rendered as they are written to its formatted version
+    @param path: path to raw node csv file
+    @param id_column: string, id column
+    @return set of strings
+    '''
+    ids = next(read_raw_csv(path, usecols=[id_column]))[id_column]
+    return set(render_column(ids, infer_column_type(ids)).dropna())
+
+
+def format_split_relationships(
+    file,
+    dir_out,
+    bad_start_ids=frozenset(),
+    bad_start_type="officer_of",
+    column_edge_type="_type",
+    file_out_suffix="_formatted",
+    chunksize=500000,
+    **format_options
+    ):
+    '''
+    @usage format the relationships file, split it by edge type and drop bad role players, in a single pass:
+        the combined work of format_data.R, split_edges_by_type.R and remove_bad_role_players.R
+    @param file: path to raw relationships csv file
+    @param dir_out: output directory for one csv file per edge type
+    @param bad_start_ids: ids that may not start an edge of bad_start_type, e.g. org_entity ids for officer_of
+    @param bad_start_type: edge type from which to remove bad role players
+    @param column_edge_type: column containing the edge type
+    @param file_out_suffix: suffix for the formatted file name, before the edge type
+    @param chunksize: integer, rows per chunk; 0 to read the whole file at once
+    @param format_options: keyword arguments to format_frame
+    @return list of paths to the split files
+    '''
+    prefix = output_path(file, dir_out, file_out_suffix)[:-len(".csv")] + "_"
+    column_types = {}
+    files_out = {}
+    try:
+        for chunk in read_raw_csv(file, chunksize):
+            track_column_types(column_types, chunk, file)
+            df = format_frame(chunk, column_types, **format_options)
+            is_bad = (df[column_edge_type] == bad_start_type) & df["_start"].isin(bad_start_ids)
+            df = df[~is_bad]
+            # rows without an edge type go nowhere, but split_edges_by_type.R still wrote an empty _NA file
+            edge_types = df[column_edge_type].fillna("NA")
+            for edge_type, df_type in df.groupby(edge_types, sort=False):
+                if edge_type not in files_out:
+                    path_out = prefix + re.sub(r"/| ", "_", edge_type) + ".csv"
+                    files_out[edge_type] = (path_out, open(path_out + ".tmp", "w", newline=""))
+                    write_csv(df.iloc[:0], files_out[edge_type][1])
+                write_csv(df_type[df_type[column_edge_type].notna()], files_out[edge_type][1], header=False)
+    finally:
+        for path_out, f in files_out.values():
+            f.close()
+    for path_out, f in files_out.values():
+        os.replace(path_out + ".tmp", path_out)
+    return [path_out for path_out, f in files_out.values()]
+
+
+def run_preprocessing(
+    dir_raw="data/raw",
+    dir_out="data/preprocessed",
+    num_processes=None,
+    chunksize=500000
+    ):
+    '''
+    @usage format all node files and the relationships file, each in its own process
+    @param dir_raw: directory with the raw csv files, after clean_characters.sh
+    @param dir_out: output directory, with entities and relations subdirectories
+    @param num_processes: integer, number of worker processes; defaults to one per file, up to the number of cores
+    @param chunksize: integer, rows per chunk; 0 to read each file at once
+    @return list of paths to the preprocessed files
+    '''
+    dir_entities = os.path.join(dir_out, "entities")
+    dir_relations = os.path.join(dir_out, "relations")
+    os.makedirs(dir_entities, exist_ok=True)
+    os.makedirs(dir_relations, exist_ok=True)
+    num_processes = num_processes or min(len(dict_file_options) + 1, os.cpu_count())
+    with ProcessPoolExecutor(num_processes, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [
+            executor.submit(format_file, os.path.join(dir_raw, file), dir_entities, chunksize=chunksize, **options)
+            for file, options in dict_file_options.items()
+            ]
+        futures.append(executor.submit(
+            format_split_relationships,
+            os.path.join(dir_raw, relationships_file),
+            dir_relations,
+            bad_start_ids=read_entity_ids(os.path.join(dir_raw, org_entity_file)),
+            chunksize=chunksize,
+            **relationships_options
+            ))
+        paths = []
+        for future in futures:
+            result = future.result()
+            paths.extend(result if isinstance(result, list) else [result])
+    return paths
+
+
+def check_fixtures(
+    dir_fixtures=dir_fixtures,
+    chunksizes=(0, 1, 2)
+    ):
+    '''
+    @usage format each raw fixture file, at several chunk sizes, and compare the output with the expected one
+    @param dir_fixtures: directory with raw and expected subdirectories
+    @param chunksizes: chunk sizes to format at
+    @return list of (file, chunksize) tuples whose output differs
+    '''
+    failures = []
+    with tempfile.TemporaryDirectory() as dir_out:
+        for file in sorted(os.listdir(os.path.join(dir_fixtures, "raw"))):
+            with open(os.path.join(dir_fixtures, "expected", os.path.basename(output_path(file))), newline="") as f:
+                expected = f.read()
+            for chunksize in chunksizes:
+                path_out = format_file(os.path.join(dir_fixtures, "raw", file), dir_out, chunksize=chunksize, **dict_file_options[file])
+                with open(path_out, newline="") as f:
+                    if f.read() != expected:
+                        failures.append((file, chunksize))
+    return failures
+
+
+def preprocess_parser():
+    parser = argparse.ArgumentParser(description="Format dates, names and corporate abbreviations, and split relationships by type.")
+    parser.add_argument("--dir_raw", help="directory with the raw csv files (default: data/raw)",
+                        default="data/raw")
+    parser.add_argument("--dir_out", help="output directory (default: data/preprocessed)",
+                        default="data/preprocessed")
+    parser.add_argument("--num_processes", type=int, help="number of worker processes (default: one per file, up to the number of cores)",
+                        default=None)
+    parser.add_argument("--chunk_size", type=int, help="rows to format at a time; 0 to read each file at once (default: 500000)",
+                        default=500000)
+    parser.add_argument("--check", action="store_true",
+                        help="instead of preprocessing, check that the fixture files format to their expected output (default: False)",
+                        default=False)
+    return parser
+
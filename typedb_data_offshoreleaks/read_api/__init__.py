@@ -0,0 +1,3 @@
+from .session_pool import *
+from .result_cache import *
+from .reader import *
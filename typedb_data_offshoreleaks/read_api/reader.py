@@ -0,0 +1,302 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from .result_cache import ResultCache
+from .session_pool import SessionPool
+
+pattern_label = re.compile(r"^[A-Za-z][\w-]*$")
+
+# directed lookups by name: (relation type, role of the given nodes, role of the nodes returned)
+dict_directed_lookups = {
+    "officers": ("officer_of", "has_officer", "is_officer"),
+    "officer_of": ("officer_of", "is_officer", "has_officer"),
+    "intermediaries": ("intermediary_of", "has_intermediary", "is_intermediary"),
+    "intermediary_of": ("intermediary_of", "is_intermediary", "has_intermediary"),
+    "addresses": ("registered_address", "has_address", "is_address"),
+    "registered_at": ("registered_address", "is_address", "has_address")
+    }
+
+
+def typeql_string(value):
+    '''@usage render a value as a TypeQL string literal, e.g. 'O\\'Brien' '''
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def check_label(label):
+    '''@usage guard against anything but a type or role label being put into a query'''
+    if not pattern_label.match(label):
+        raise ValueError(f"not a type label: {label!r}")
+    return label
+
+
+def as_list(ids):
+    '''@usage accept a single id as well as a list of them'''
+    return [ids] if isinstance(ids, str) else list(ids)
+
+
+def query_by_id(node_id):
+    '''@usage TypeQL query for a node and each of its attributes'''
+    return f"match $x isa node, has id {typeql_string(node_id)}, has $a; get $x, $a;"
+
+
+def query_by_name(
+    text,
+    node_type="node",
+    exact=False,
+    limit=100
+    ):
+    '''@usage TypeQL query for the nodes whose name is, or contains, text'''
+    predicate = "=" if exact else "contains"
+    return (
+        f"match $x isa {check_label(node_type)}, has id $id, has name $name; $name {predicate} {typeql_string(text)}; "
+        f"get $x, $id, $name; limit {int(limit)};"
+        )
+
+
+def query_neighbourhood(
+    node_id,
+    relation_type="relation"
+    ):
+    '''@usage TypeQL query for the nodes related to a node, and the relations between them'''
+    return f"match $x isa node, has id {typeql_string(node_id)}; $r ($x, $y) isa {check_label(relation_type)}; $y isa node, has id $id; get $r, $y, $id;"
+
+
+def query_related(
+    node_id,
+    relation_type,
+    role,
+    other_role
+    ):
+    '''@usage TypeQL query for the nodes playing other_role in the relations where a node plays role'''
+    return (
+        f"match $x isa node, has id {typeql_string(node_id)}; "
+        f"$r ({check_label(role)}: $x, {check_label(other_role)}: $y) isa {check_label(relation_type)}; "
+        f"$y has id $id; get $r, $y, $id;"
+        )
+
+
+def concept_to_dict(concept):
+    '''@usage plain python copy of a concept, which stays valid once its transaction is closed'''
+    if concept.is_attribute():
+        return {"type": concept.get_type().get_label().name(), "value": concept.get_value()}
+    return {"type": concept.get_type().get_label().name(), "iid": concept.get_iid()}
+
+
+def answer_to_dict(concept_map):
+    '''@usage plain python copy of a query answer: dict of variable to concept_to_dict'''
+    return {var: concept_to_dict(concept) for var, concept in concept_map.map().items()}
+
+
+class OffshoreLeaksReader:
+    '''
+    @usage read-side access to the offshoreleaks database: lookups by id and name, neighbourhoods and
+        n-hop expansions, run over a session pool and cached until the migrator next commits.
+        Functions taking ids take one id or a list, and answer a list of ids with one query each,
+        all sent in the same transaction before any answer is read.
+        Results are shared with the cache, so treat them as read-only.
+        The cache learns of commits from the modification time of the migrator's commit marker file, so it assumes
+        the reader and the migrator share a filesystem, e.g. run on one host. A reader elsewhere, or any writer
+        other than the migrator, goes unnoticed: rely on cache_ttl then, or call cache.invalidate() after writes.
+    '''
+
+    def __init__(
+        self,
+        address="localhost:1729",
+        database="offshoreleaks",
+        pool_size=4,
+        parallelisation=2,
+        infer=False,
+        cache_size=10000,
+        cache_ttl=300,
+        commit_marker="data/last_commit",
+        max_queries_per_transaction=200
+        ):
+        '''
+        @param address: typedb server address, "host:port"
+        @param database: database
+        @param pool_size: integer, number of sessions, and of transactions run at once
+        @param parallelisation: integer, client parallelisation
+        @param infer: if True, also return the relations the schema's rules infer
+        @param cache_size: integer, number of query results to cache; 0 disables the cache
+        @param cache_ttl: seconds a cached result stays valid; None for no expiry
+        @param commit_marker: the migrator's --commit_marker, whose change empties the cache; only seen on the migrator's host
+        @param max_queries_per_transaction: integer, lookups to send in one transaction; more are split over the pool
+        '''
+        self.pool = SessionPool(address, database, pool_size, parallelisation, infer)
+        self.cache = ResultCache(cache_size, cache_ttl, commit_marker if commit_marker else None)
+        self.executor = ThreadPoolExecutor(pool_size)
+        self.max_queries_per_transaction = max_queries_per_transaction
+
+    def run_queries(self, queries):
+        '''@usage run match queries in one transaction, sending them all before reading the answers'''
+        with self.pool.transaction() as tx:
+            iterators = [tx.query().match(query) for query in queries]
+            return [[answer_to_dict(concept_map) for concept_map in iterator] for iterator in iterators]
+
+    def match_many(self, queries):
+        '''
+        @usage run match queries, taking what it can from the cache
+        @param queries: list of TypeQL match queries
+        @return list of lists of answers, see answer_to_dict, in the order of queries
+        '''
+        results = {}
+        missing = []
+        for query in dict.fromkeys(queries):
+            hit, result = self.cache.get(query)
+            if hit:
+                results[query] = result
+            else:
+                missing.append(query)
+        if missing:
+            version = self.cache.current_version()
+            size = self.max_queries_per_transaction
+            batches = [missing[i:i + size] for i in range(0, len(missing), size)]
+            for batch, answers in zip(batches, self.executor.map(self.run_queries, batches)):
+                for query, result in zip(batch, answers):
+                    results[query] = result
+                    self.cache.put(query, result, version)
+        return [results[query] for query in queries]
+
+    def match(self, query):
+        '''@usage run one match query, see match_many'''
+        return self.match_many([query])[0]
+
+    def by_id(self, ids):
+        '''
+        @usage look up nodes by id
+        @param ids: id or list of ids
+        @return dict of id to {"id": .., "type": .., attribute: value}, with a list of values
+            for attributes a node owns more than once; ids not found are left out
+        '''
+        ids = list(dict.fromkeys(as_list(ids)))
+        nodes = {}
+        for node_id, answers in zip(ids, self.match_many([query_by_id(node_id) for node_id in ids])):
+            for answer in answers:
+                node = nodes.setdefault(node_id, {"id": node_id, "type": answer["x"]["type"]})
+                attr, value = answer["a"]["type"], answer["a"]["value"]
+                if attr == "id":
+                    continue
+                if attr in node:
+                    node[attr] = (node[attr] if isinstance(node[attr], list) else [node[attr]]) + [value]
+                else:
+                    node[attr] = value
+        return nodes
+
+    def by_name(
+        self,
+        text,
+        node_type="node",
+        exact=False,
+        limit=100
+        ):
+        '''
+        @usage look up nodes by name. Without exact, this scans every name of node_type, so narrow node_type where possible
+        @param text: the name, or part of it
+        @param node_type: e.g. officer or org_entity
+        @param exact: if True, match the whole name
+        @param limit: integer, most nodes to return
+        @return list of {"id": .., "type": .., "name": ..}
+        '''
+        answers = self.match(query_by_name(text, node_type, exact, limit))
+        return [{"id": a["id"]["value"], "type": a["x"]["type"], "name": a["name"]["value"]} for a in answers]
+
+    def neighbourhood(
+        self,
+        ids,
+        relation_type="relation"
+        ):
+        '''
+        @usage the nodes directly related to each node
+        @param ids: id or list of ids
+        @param relation_type: e.g. officer_of, or directed_relation; by default all relations
+        @return dict of id to list of {"id": .., "type": .., "relation": .., "relation_iid": ..}
+        '''
+        ids = as_list(ids)
+        list_answers = self.match_many([query_neighbourhood(node_id, relation_type) for node_id in ids])
+        return {
+            node_id: [
+                {"id": a["id"]["value"], "type": a["y"]["type"], "relation": a["r"]["type"], "relation_iid": a["r"]["iid"]}
+                for a in answers
+                ]
+            for node_id, answers in zip(ids, list_answers)
+            }
+
+    def related(
+        self,
+        ids,
+        lookup
+        ):
+        '''
+        @usage follow a directed relation from each node, e.g. from companies to their officers
+        @param ids: id or list of ids
+        @param lookup: a key of dict_directed_lookups, e.g. "officers" or "addresses"
+        @return dict of id to list of {"id": .., "type": ..}
+        '''
+        relation_type, role, other_role = dict_directed_lookups[lookup]
+        ids = as_list(ids)
+        list_answers = self.match_many([query_related(node_id, relation_type, role, other_role) for node_id in ids])
+        return {
+            node_id: [{"id": a["id"]["value"], "type": a["y"]["type"]} for a in answers]
+            for node_id, answers in zip(ids, list_answers)
+            }
+
+    def officers(self, ids):
+        '''@usage the officers of each corporate entity, see related'''
+        return self.related(ids, "officers")
+
+    def officer_of(self, ids):
+        '''@usage the corporate entities each officer is an officer of, see related'''
+        return self.related(ids, "officer_of")
+
+    def intermediaries(self, ids):
+        '''@usage the intermediaries of each corporate entity, see related'''
+        return self.related(ids, "intermediaries")
+
+    def addresses(self, ids):
+        '''@usage the registered addresses of each corporate entity, see related'''
+        return self.related(ids, "addresses")
+
+    def expand(
+        self,
+        ids,
+        hops=2,
+        relation_type="relation",
+        max_nodes=1000
+        ):
+        '''
+        @usage breadth-first expansion from the given nodes, one batch of neighbourhood lookups per hop
+        @param ids: id or list of ids to start from
+        @param hops: integer, number of relations to follow outwards
+        @param relation_type: type of relation to follow
+        @param max_nodes: integer, stop expanding once this many nodes are reached
+        @return {"nodes": dict of id to type, "edges": list of (id, relation type, id)} between those nodes.
+            The type of a start node is None unless another node found is related to it
+        '''
+        nodes = {node_id: None for node_id in as_list(ids)}
+        edges = {}
+        frontier = list(nodes)
+        for _ in range(hops):
+            if not frontier or len(nodes) >= max_nodes:
+                break
+            next_frontier = []
+            for node_id, neighbours in self.neighbourhood(frontier, relation_type).items():
+                for neighbour in neighbours:
+                    if neighbour["id"] not in nodes and len(nodes) < max_nodes:
+                        nodes[neighbour["id"]] = neighbour["type"]
+                        next_frontier.append(neighbour["id"])
+                    elif nodes.get(neighbour["id"], "") is None:
+                        nodes[neighbour["id"]] = neighbour["type"]
+                    if neighbour["id"] in nodes:
+                        edges.setdefault(neighbour["relation_iid"], (node_id, neighbour["relation"], neighbour["id"]))
+            frontier = next_frontier
+        return {"nodes": nodes, "edges": list(edges.values())}
+
+    def close(self):
+        self.executor.shutdown()
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
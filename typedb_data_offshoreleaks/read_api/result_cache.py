@@ -0,0 +1,82 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+def commit_marker_version(path):
+    '''@usage modification time of the migrator's commit marker, which changes whenever data is committed; None if there is none'''
+    try:
+        return os.stat(path).st_mtime_ns
+    except (OSError, TypeError):
+        return None
+
+
+class ResultCache:
+    '''
+    @usage thread-safe LRU cache of query results whose entries expire after ttl seconds,
+        and which empties itself as soon as the migrator commits, see set_commit_marker.
+        Commits are seen through a local file, so only by readers on the migrator's host
+    '''
+
+    def __init__(
+        self,
+        max_size=10000,
+        ttl=300,
+        commit_marker=None
+        ):
+        '''
+        @param max_size: integer, number of results to keep; 0 disables the cache
+        @param ttl: seconds a result stays valid; None for no expiry
+        @param commit_marker: path to the migrator's commit marker, or None to rely on ttl alone
+        '''
+        self.max_size = max_size
+        self.ttl = ttl
+        self.commit_marker = commit_marker
+        self.version = commit_marker_version(commit_marker)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def check_version(self):
+        '''@usage empty the cache if data was committed since it last checked'''
+        version = commit_marker_version(self.commit_marker)
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def get(self, key):
+        '''@return (True, result) if key is cached and fresh, else (False, None)'''
+        with self.lock:
+            self.check_version()
+            entry = self.entries.get(key)
+            if entry is not None and (self.ttl is None or time.monotonic() - entry[0] < self.ttl):
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def current_version(self):
+        '''@usage version of the data, to take before running a query whose result is to be put'''
+        return commit_marker_version(self.commit_marker)
+
+    def put(self, key, result, version):
+        '''@usage cache a result, unless data was committed since version was taken, which would make it stale already'''
+        if not self.max_size:
+            return
+        with self.lock:
+            self.check_version()
+            if version != self.version:
+                return
+            self.entries[key] = (time.monotonic(), result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
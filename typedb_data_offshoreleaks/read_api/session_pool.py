@@ -0,0 +1,61 @@
+import queue
+from contextlib import contextmanager
+from typedb.client import TypeDB, SessionType, TransactionType, TypeDBOptions
+
+
+class SessionPool:
+    '''
+    @usage one client with a fixed set of open data sessions, lent out one per read transaction,
+        so that many lookups share connections instead of each opening a client of its own
+    '''
+
+    def __init__(
+        self,
+        address="localhost:1729",
+        database="offshoreleaks",
+        size=4,
+        parallelisation=2,
+        infer=False
+        ):
+        '''
+        @param address: typedb server address, "host:port"
+        @param database: database
+        @param size: integer, number of sessions, i.e. of read transactions that may be open at once
+        @param parallelisation: integer, client parallelisation
+        @param infer: if True, read transactions also return what the schema's rules infer
+        '''
+        self.client = TypeDB.core_client(address=address, parallelisation=parallelisation)
+        self.options = TypeDBOptions.core()
+        self.options.infer = infer
+        self.size = size
+        self.sessions = queue.Queue()
+        try:
+            for _ in range(size):
+                self.sessions.put(self.client.session(database, SessionType.DATA))
+        except Exception:
+            self.close()
+            raise
+
+    @contextmanager
+    def transaction(self):
+        '''@usage borrow a session for one read transaction, waiting for one to be returned if all are in use'''
+        session = self.sessions.get()
+        try:
+            with session.transaction(TransactionType.READ, self.options) as tx:
+                yield tx
+        finally:
+            self.sessions.put(session)
+
+    def close(self):
+        while True:
+            try:
+                self.sessions.get_nowait().close()
+            except queue.Empty:
+                break
+        self.client.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()